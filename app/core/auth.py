@@ -29,15 +29,7 @@ def require_admin(
         raise HTTPException(status_code=403, detail="Invalid admin token")
 
 
-def get_current_user(
-    authorization: str | None = Header(default=None),
-    session: Session = Depends(get_session),
-    settings: Settings = Depends(get_settings),
-) -> User:
-    if not authorization or not authorization.lower().startswith("bearer "):
-        raise HTTPException(status_code=401, detail="Missing bearer token")
-
-    api_key = authorization.split(" ", 1)[1].strip()
+def user_for_api_key(session: Session, settings: Settings, api_key: str) -> User:
     if not api_key:
         raise HTTPException(status_code=401, detail="Missing API key")
 
@@ -55,4 +47,16 @@ def get_current_user(
     row.last_used_at = now_utc()
     session.add(row)
     session.commit()
-    return user
\ No newline at end of file
+    return user
+
+
+def get_current_user(
+    authorization: str | None = Header(default=None),
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+) -> User:
+    if not authorization or not authorization.lower().startswith("bearer "):
+        raise HTTPException(status_code=401, detail="Missing bearer token")
+
+    api_key = authorization.split(" ", 1)[1].strip()
+    return user_for_api_key(session, settings, api_key)
@@ -13,6 +13,13 @@ class Settings:
     db_path: Path = Path(os.getenv("DB_PATH", "/app/data/db.sqlite3"))
     media_dir: Path = Path(os.getenv("MEDIA_DIR", "/app/data/media"))
 
+    # Database (DATABASE_URL overrides DB_PATH; pool settings apply to server databases)
+    database_url: str = os.getenv("DATABASE_URL", "")
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    db_pool_recycle_s: int = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+    migrate_on_startup: bool = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
     # Server
     host: str = os.getenv("HOST", "0.0.0.0")
     port: int = int(os.getenv("PORT", "8000"))
@@ -30,9 +37,84 @@ class Settings:
     max_text_len: int = int(os.getenv("MAX_TEXT_LEN", "3000"))
     max_batch_size: int = int(os.getenv("MAX_BATCH_SIZE", "50"))
     min_batch_size: int = int(os.getenv("MIN_BATCH_SIZE", "2"))
+    max_voice_batch_size: int = int(os.getenv("MAX_VOICE_BATCH_SIZE", "200"))
+    voice_batch_chunk_size: int = int(os.getenv("VOICE_BATCH_CHUNK_SIZE", "16"))  # items per model call
+    page_size_default: int = int(os.getenv("PAGE_SIZE_DEFAULT", "100"))
+    page_size_max: int = int(os.getenv("PAGE_SIZE_MAX", "500"))
+    max_upload_mb: int = int(os.getenv("MAX_UPLOAD_MB", "50"))
+
+    # Reference audio normalization (applied before prompt extraction)
+    ref_sample_rate: int = int(os.getenv("REF_SAMPLE_RATE", "24000"))
+    ref_max_seconds: float = float(os.getenv("REF_MAX_SECONDS", "30"))
+    audio_workers: int = int(os.getenv("AUDIO_WORKERS", "4"))
+
+    # Long-form synthesis (/tts/longform)
+    longform_max_chars: int = int(os.getenv("LONGFORM_MAX_CHARS", "1000000"))
+    longform_segment_chars: int = int(os.getenv("LONGFORM_SEGMENT_CHARS", "400"))
+    longform_batch_size: int = int(os.getenv("LONGFORM_BATCH_SIZE", "8"))  # segments per model call
+    longform_crossfade_ms: int = int(os.getenv("LONGFORM_CROSSFADE_MS", "40"))
+    longform_target_batch_s: float = float(os.getenv("LONGFORM_TARGET_BATCH_S", "0"))  # 0 = fixed batch size
+    longform_lease_s: int = int(os.getenv("LONGFORM_LEASE_S", "300"))  # a job whose runner stops renewing is taken over
+    longform_poll_s: float = float(os.getenv("LONGFORM_POLL_S", "5"))  # how often idle runners look for unclaimed jobs
+    longform_max_attempts: int = int(os.getenv("LONGFORM_MAX_ATTEMPTS", "5"))  # failed model calls in a row before a job is "error"
+
+    # Per-voice phrase library (see app/services/phrases.py)
+    phrase_max_per_voice: int = int(os.getenv("PHRASE_MAX_PER_VOICE", "1000"))
+    phrase_max_formats: int = int(os.getenv("PHRASE_MAX_FORMATS", "4"))  # renditions per phrase
+    phrase_batch_size: int = int(os.getenv("PHRASE_BATCH_SIZE", "16"))  # phrases per pre-render model call
+    phrase_idle_s: float = float(os.getenv("PHRASE_IDLE_S", "3"))  # GPU idle this long before pre-rendering
+    phrase_poll_s: float = float(os.getenv("PHRASE_POLL_S", "5"))
+    phrase_max_attempts: int = int(os.getenv("PHRASE_MAX_ATTEMPTS", "5"))  # failed model calls before a phrase is "error"
+
+    # Graceful shutdown (see app/services/drain.py)
+    drain_timeout_s: float = float(os.getenv("DRAIN_TIMEOUT_S", "120"))  # in-flight work gets this long to finish
+    drain_retry_after_s: int = int(os.getenv("DRAIN_RETRY_AFTER_S", "30"))  # Retry-After on rejected requests
+    drain_flag_dir: Path = Path(os.getenv("DRAIN_FLAG_DIR", "/dev/shm/qwen3-tts"))  # per boot: must not survive a restart
+
+    # Media retention (0 = disabled / unlimited)
+    stored_ttl_days: int = int(os.getenv("STORED_TTL_DAYS", "0"))
+    storage_quota_mb: int = int(os.getenv("STORAGE_QUOTA_MB", "0"))
+    unstored_ttl_hours: int = int(os.getenv("UNSTORED_TTL_HOURS", "24"))  # unstored long-form outputs
+    orphan_grace_minutes: int = int(os.getenv("ORPHAN_GRACE_MINUTES", "60"))
+    retention_interval_minutes: int = int(os.getenv("RETENTION_INTERVAL_MINUTES", "60"))
+    derived_cache_mb: int = int(os.getenv("DERIVED_CACHE_MB", "1024"))  # transcoded samples/previews (see app/services/derived.py)
+
+    # GPU memory (see app/services/gpu_memory.py)
+    gpu_max_batch_chars: int = int(os.getenv("GPU_MAX_BATCH_CHARS", "0"))  # initial cap; 0 = learn from OOMs
+    gpu_cache_trim_fraction: float = float(os.getenv("GPU_CACHE_TRIM_FRACTION", "0.90"))  # 0 = never trim
+
+    # Device-resident voice prompts (0 = disabled)
+    prompt_pool_mb: int = int(os.getenv("PROMPT_POOL_MB", "512"))
+    prompt_pool_warm: int = int(os.getenv("PROMPT_POOL_WARM", "8"))  # most-used voices uploaded at startup
 
     # Batch discount calibration defaults
     batch_discount_default: float = float(os.getenv("BATCH_DISCOUNT_DEFAULT", "0.90"))
     batch_discount_min: float = float(os.getenv("BATCH_DISCOUNT_MIN", "0.60"))
     batch_discount_max: float = float(os.getenv("BATCH_DISCOUNT_MAX", "1.00"))
-    batch_discount_ewma_alpha: float = float(os.getenv("BATCH_DISCOUNT_EWMA_ALPHA", "0.10"))
\ No newline at end of file
+    batch_discount_ewma_alpha: float = float(os.getenv("BATCH_DISCOUNT_EWMA_ALPHA", "0.10"))
+    calibration_flush_s: float = float(os.getenv("CALIBRATION_FLUSH_S", "5"))
+
+    # Idempotency-Key replays (see app/services/idempotency.py)
+    idempotency_ttl_s: int = int(os.getenv("IDEMPOTENCY_TTL_S", "86400"))  # how long finished responses are replayed
+    idempotency_wait_s: float = float(os.getenv("IDEMPOTENCY_WAIT_S", "30"))  # retry waiting on a request running elsewhere, then 409
+    idempotency_max_waiters: int = int(os.getenv("IDEMPOTENCY_MAX_WAITERS", "8"))  # per process; more get 409 straight away
+    idempotency_retry_after_s: int = int(os.getenv("IDEMPOTENCY_RETRY_AFTER_S", "10"))  # Retry-After on that 409
+    idempotency_lease_s: float = float(os.getenv("IDEMPOTENCY_LEASE_S", "60"))  # in-progress claim, renewed while it runs
+
+    # Cost model admission control (0 = disabled)
+    max_predicted_latency_s: float = float(os.getenv("MAX_PREDICTED_LATENCY_S", "0"))
+
+    # Admin profiling (see app/services/profiling.py)
+    profile_max_seconds: float = float(os.getenv("PROFILE_MAX_SECONDS", "300"))  # longest CPU sampling run
+    profile_max_generations: int = int(os.getenv("PROFILE_MAX_GENERATIONS", "20"))  # longest torch.profiler run
+
+    # Inference processes (see app/services/inference.py)
+    inference_mode: str = os.getenv("INFERENCE_MODE", "local")  # local | remote (python -m app.worker)
+    inference_transport: str = os.getenv("INFERENCE_TRANSPORT", "mp")  # mp | redis
+    inference_address: str = os.getenv("INFERENCE_ADDRESS", "127.0.0.1:50055")  # mp queue server
+    inference_authkey: str = os.getenv("INFERENCE_AUTHKEY", "")  # defaults to HMAC_SECRET
+    inference_timeout_s: float = float(os.getenv("INFERENCE_TIMEOUT_S", "600"))
+    inference_workers: int = int(os.getenv("INFERENCE_WORKERS", "1"))
+    inference_shm_dir: Path = Path(os.getenv("INFERENCE_SHM_DIR", "/dev/shm"))
+    redis_url: str = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+    inference_queue_prefix: str = os.getenv("INFERENCE_QUEUE_PREFIX", "qtts")
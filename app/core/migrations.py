@@ -0,0 +1,383 @@
+# app/core/migrations.py
+"""
+Versioned migrations, applied after create_all().
+
+create_all() only creates missing tables; columns and indexes added to
+existing tables (and data backfills) are listed here in version order.
+"schema" migrations are short DDL and run at startup. "data" migrations are
+batched backfills: each chunk is its own short transaction and the cursor is
+persisted in runtime_stats, so they can run in the background against a live
+database and resume after a restart.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+from sqlalchemy import Index, Table, inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError, OperationalError, ProgrammingError
+from sqlalchemy.schema import CreateIndex
+from sqlmodel import Session, select
+
+from app.core.models import Batch, Generation, LongformJob, Phrase, RuntimeStat, SchemaMigration, User, Voice
+from app.core.security import now_utc, sha256_file
+
+log = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_ROWS = 500
+BACKFILL_PAUSE_S = 0.05  # yield the write lock to live traffic between chunks
+SCHEMA_LOCK_ID = 0x717774  # pg_advisory_lock key shared by every instance
+DATA_MIGRATION_LOCK_ID = 0x717775
+DATA_MIGRATION_RETRY_S = 60.0  # how often the other processes check whether the runner is gone
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    kind: str  # "schema" | "data"
+    fn: Callable[[Engine], None]
+
+
+# ---- helpers ----
+
+@contextmanager
+def _db_lock(engine: Engine, key: int, suffix: str, wait: bool = True) -> Iterator[bool]:
+    """
+    A lock shared by every process using the database: a Postgres advisory
+    lock, or for SQLite an exclusive lock on a file next to the database.
+    Yields whether it was taken (always, when waiting for it).
+    """
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            if wait:
+                conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": key})
+                acquired = True
+            else:
+                acquired = bool(conn.execute(text("SELECT pg_try_advisory_lock(:k)"), {"k": key}).scalar())
+            conn.commit()
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": key})
+                    conn.commit()
+        return
+    database = engine.url.database
+    if engine.dialect.name != "sqlite" or not database or database == ":memory:":
+        yield True
+        return
+    import fcntl
+
+    with open(f"{database}.{suffix}", "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            acquired = True
+        except BlockingIOError:
+            acquired = False
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+@contextmanager
+def schema_lock(engine: Engine) -> Iterator[None]:
+    """
+    Serializes create_all() and schema migrations across processes (every
+    uvicorn worker runs them at startup).
+    """
+    with _db_lock(engine, SCHEMA_LOCK_ID, "migrate.lock"):
+        yield
+
+
+def data_migration_lock(engine: Engine, wait: bool = True):
+    """Held while data migrations run, so only one process (worker / instance) runs them."""
+    return _db_lock(engine, DATA_MIGRATION_LOCK_ID, "data-migrate.lock", wait)
+
+
+def _columns(engine: Engine, table: Table) -> set[str]:
+    return {c["name"] for c in inspect(engine).get_columns(table.name)}
+
+
+def add_missing_columns(engine: Engine, table: Table, names: list[str]) -> None:
+    existing = _columns(engine, table)
+    for name in names:
+        if name in existing:
+            continue
+        col = table.c[name]
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {name} {col.type.compile(engine.dialect)}"
+        if col.default is not None and col.default.is_scalar:
+            ddl += f" DEFAULT {_sql_literal(col.default.arg)}"
+        elif not col.nullable:
+            raise RuntimeError(f"Cannot add NOT NULL column {table.name}.{name} without a default")
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+        except (OperationalError, ProgrammingError):
+            # Added by a process that did not take schema_lock (e.g. an older version)
+            if name not in _columns(engine, table):
+                raise
+
+
+def _sql_literal(value) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def create_indexes(engine: Engine, indexes: list[Index]) -> None:
+    if engine.dialect.name != "postgresql":
+        for ix in indexes:
+            ix.create(engine, checkfirst=True)
+        return
+    # CONCURRENTLY: live writes continue while the index builds; it cannot run in a transaction
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for ix in indexes:
+            invalid = conn.execute(
+                text(
+                    "SELECT 1 FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {"name": ix.name},
+            ).first()
+            if invalid:
+                # Left behind by an interrupted concurrent build
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {ix.name}"))
+            ddl = str(CreateIndex(ix, if_not_exists=True).compile(dialect=engine.dialect))
+            conn.execute(text(re.sub(r"^CREATE (UNIQUE )?INDEX", r"CREATE \1INDEX CONCURRENTLY", ddl)))
+
+
+def _cursor_key(version: int) -> str:
+    return f"migration_cursor:{version}"
+
+
+def run_backfill(
+    engine: Engine,
+    version: int,
+    fetch: Callable[[Connection, int, int], list],
+    apply: Callable[[Connection, list], None],
+    prepare: Optional[Callable[[list], list]] = None,
+) -> None:
+    """
+    Generic resumable backfill over an integer id column.
+    fetch(conn, after_id, limit) -> rows with .id; prepare(rows) does slow work
+    (file IO etc.) outside any transaction; apply(conn, prepared) writes one chunk.
+    """
+    key = _cursor_key(version)
+    with Session(engine) as s:
+        row = s.get(RuntimeStat, key)
+        cursor = int(row.value) if row else 0
+    done = 0
+    t0 = time.perf_counter()
+    while True:
+        with engine.connect() as conn:
+            rows = fetch(conn, cursor, BACKFILL_CHUNK_ROWS)
+        if not rows:
+            break
+        prepared = prepare(rows) if prepare else rows
+        with engine.begin() as conn:
+            apply(conn, prepared)
+            cursor = rows[-1].id
+            _save_cursor(conn, key, cursor)
+        done += len(rows)
+        log.info("migration %s: %d rows backfilled (cursor=%d, %.1fs)", version, done, cursor, time.perf_counter() - t0)
+        time.sleep(BACKFILL_PAUSE_S)
+
+
+def _save_cursor(conn: Connection, key: str, cursor: int) -> None:
+    updated = conn.execute(
+        text("UPDATE runtime_stats SET value = :v, updated_at = :t WHERE key = :k"),
+        {"v": str(cursor), "t": now_utc(), "k": key},
+    ).rowcount
+    if not updated:
+        conn.execute(
+            text("INSERT INTO runtime_stats (key, value, updated_at) VALUES (:k, :v, :t)"),
+            {"v": str(cursor), "t": now_utc(), "k": key},
+        )
+
+
+# ---- migrations ----
+
+def _m1_retention_columns(engine: Engine) -> None:
+    add_missing_columns(engine, User.__table__, ["storage_ttl_days", "storage_quota_mb"])
+    add_missing_columns(engine, Generation.__table__, ["audio_sha256", "audio_bytes"])
+
+
+def _m2_listing_indexes(engine: Engine) -> None:
+    create_indexes(engine, [*Voice.__table__.indexes, *Generation.__table__.indexes, *Batch.__table__.indexes])
+
+
+def _m3_backfill_stored_audio(engine: Engine) -> None:
+    def fetch(conn: Connection, after_id: int, limit: int) -> list:
+        return conn.execute(
+            text(
+                "SELECT id, audio_path FROM generations "
+                "WHERE id > :after AND audio_path IS NOT NULL AND audio_bytes IS NULL "
+                "ORDER BY id LIMIT :limit"
+            ),
+            {"after": after_id, "limit": limit},
+        ).all()
+
+    def prepare(rows: list) -> list[tuple[int, Optional[str], int]]:
+        out = []
+        for r in rows:
+            try:
+                out.append((r.id, sha256_file(r.audio_path), os.path.getsize(r.audio_path)))
+            except OSError:
+                out.append((r.id, None, 0))
+        return out
+
+    def apply(conn: Connection, prepared: list) -> None:
+        conn.execute(
+            text("UPDATE generations SET audio_sha256 = :sha, audio_bytes = :size WHERE id = :id"),
+            [{"id": i, "sha": sha, "size": size} for i, sha, size in prepared],
+        )
+
+    run_backfill(engine, 3, fetch, apply, prepare)
+
+
+def _m4_cost_model_columns(engine: Engine) -> None:
+    add_missing_columns(engine, Generation.__table__, ["chars"])
+    add_missing_columns(engine, Batch.__table__, ["total_chars", "item_count"])
+
+
+def _m5_backfill_generation_chars(engine: Engine) -> None:
+    # Only stored generations kept their text; the rest stay NULL (not used for fitting)
+    def fetch(conn: Connection, after_id: int, limit: int) -> list:
+        return conn.execute(
+            text(
+                "SELECT id, input_text FROM generations "
+                "WHERE id > :after AND input_text IS NOT NULL AND chars IS NULL "
+                "ORDER BY id LIMIT :limit"
+            ),
+            {"after": after_id, "limit": limit},
+        ).all()
+
+    def apply(conn: Connection, rows: list) -> None:
+        conn.execute(
+            text("UPDATE generations SET chars = :chars WHERE id = :id"),
+            [{"id": r.id, "chars": len(r.input_text)} for r in rows],
+        )
+
+    run_backfill(engine, 5, fetch, apply)
+
+
+def _m6_longform_output_options(engine: Engine) -> None:
+    add_missing_columns(engine, LongformJob.__table__, ["sample_rate", "channels", "bitrate_kbps"])
+
+
+def _m7_longform_job_leases(engine: Engine) -> None:
+    add_missing_columns(engine, LongformJob.__table__, ["runner_id", "lease_expires_at"])
+
+
+def _m8_generation_phrase_id(engine: Engine) -> None:
+    add_missing_columns(engine, Generation.__table__, ["phrase_id"])
+
+
+def _m9_phrase_retries(engine: Engine) -> None:
+    add_missing_columns(engine, Phrase.__table__, ["attempts", "retry_at"])
+
+
+def _m10_longform_job_retries(engine: Engine) -> None:
+    add_missing_columns(engine, LongformJob.__table__, ["attempts", "retry_at"])
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "retention columns", "schema", _m1_retention_columns),
+    # "data": built in the background (concurrently on Postgres) so large tables don't hold up startup
+    Migration(2, "listing/history composite indexes", "data", _m2_listing_indexes),
+    Migration(3, "backfill stored audio hash/size", "data", _m3_backfill_stored_audio),
+    Migration(4, "cost model feature columns", "schema", _m4_cost_model_columns),
+    Migration(5, "backfill generation chars", "data", _m5_backfill_generation_chars),
+    Migration(6, "long-form output options", "schema", _m6_longform_output_options),
+    Migration(7, "long-form job leases", "schema", _m7_longform_job_leases),
+    Migration(8, "generation phrase library reference", "schema", _m8_generation_phrase_id),
+    Migration(9, "phrase render retries", "schema", _m9_phrase_retries),
+    Migration(10, "long-form job retries", "schema", _m10_longform_job_retries),
+]
+
+
+# ---- runner ----
+
+def applied_versions(engine: Engine) -> set[int]:
+    with Session(engine) as s:
+        return set(s.exec(select(SchemaMigration.version)).all())
+
+
+def pending_migrations(engine: Engine, kind: Optional[str] = None) -> list[Migration]:
+    done = applied_versions(engine)
+    return [m for m in MIGRATIONS if m.version not in done and (kind is None or m.kind == kind)]
+
+
+def apply_migration(engine: Engine, m: Migration) -> None:
+    t0 = time.perf_counter()
+    log.info("Applying migration %d (%s, %s)", m.version, m.name, m.kind)
+    m.fn(engine)
+    with Session(engine) as s:
+        s.add(SchemaMigration(version=m.version, name=m.name, applied_at=now_utc()))
+        try:
+            s.commit()
+        except IntegrityError:
+            # Another instance finished it concurrently (all migrations are idempotent)
+            s.rollback()
+    log.info("Migration %d done in %.1fs", m.version, time.perf_counter() - t0)
+
+
+def run_migrations(engine: Engine, kind: Optional[str] = None) -> None:
+    for m in pending_migrations(engine, kind):
+        apply_migration(engine, m)
+
+
+def start_background_data_migrations(engine: Engine) -> Optional[threading.Thread]:
+    """
+    Runs pending data migrations in one process only: whichever takes
+    data_migration_lock first. The others check back every
+    DATA_MIGRATION_RETRY_S and take over (from the persisted cursor) if that
+    process goes away before they are done.
+    """
+    if not pending_migrations(engine, "data"):
+        return None
+
+    def run() -> None:
+        try:
+            while True:
+                with data_migration_lock(engine, wait=False) as acquired:
+                    if acquired:
+                        run_migrations(engine, "data")
+                        return
+                time.sleep(DATA_MIGRATION_RETRY_S)
+                if not pending_migrations(engine, "data"):
+                    return
+        except Exception:
+            log.exception("Background data migration failed; it will resume on next start")
+
+    t = threading.Thread(target=run, name="data-migrations", daemon=True)
+    t.start()
+    return t
+
+
+def migration_status(engine: Engine) -> list[dict]:
+    done = applied_versions(engine)
+    with Session(engine) as s:
+        cursors = {r.key: r.value for r in s.exec(select(RuntimeStat).where(RuntimeStat.key.startswith("migration_cursor:")))}
+    return [
+        {
+            "version": m.version,
+            "name": m.name,
+            "kind": m.kind,
+            "applied": m.version in done,
+            "cursor": cursors.get(_cursor_key(m.version)),
+        }
+        for m in MIGRATIONS
+    ]
@@ -4,6 +4,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import Optional
 
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import SQLModel, Field
 
 
@@ -13,6 +14,10 @@ class User(SQLModel, table=True):
     created_at: datetime
     is_active: bool = True
 
+    # Stored-output retention overrides (None = server default)
+    storage_ttl_days: Optional[int] = None
+    storage_quota_mb: Optional[int] = None
+
 
 class ApiKey(SQLModel, table=True):
     __tablename__ = "api_keys"
@@ -50,6 +55,11 @@ class AudioFile(SQLModel, table=True):
 
 class Voice(SQLModel, table=True):
     __tablename__ = "voices"
+    __table_args__ = (
+        # Covers the /voices listing projection so pages never read rows (and prompt_blob overflow pages)
+        Index("ix_voices_user_list", "user_id", "deleted_at", "created_at", "id", "name", "language", "use_count"),
+        Index("ix_voices_user_language", "user_id", "deleted_at", "language", "created_at", "id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
 
     user_id: int = Field(foreign_key="users.id", index=True)
@@ -71,6 +81,7 @@ class Voice(SQLModel, table=True):
 
 class Batch(SQLModel, table=True):
     __tablename__ = "batches"
+    __table_args__ = (Index("ix_batches_user_created", "user_id", "created_at", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
 
     user_id: int = Field(foreign_key="users.id", index=True)
@@ -84,6 +95,8 @@ class Batch(SQLModel, table=True):
     batch_discount_used: float
 
     latency_ms_total: int
+    total_chars: Optional[int] = None  # cost-model features
+    item_count: Optional[int] = None
 
     status: str = "ok"
     error: Optional[str] = None
@@ -93,11 +106,13 @@ class Batch(SQLModel, table=True):
 
 class Generation(SQLModel, table=True):
     __tablename__ = "generations"
+    __table_args__ = (Index("ix_generations_user_created", "user_id", "created_at", "id"),)
     id: Optional[int] = Field(default=None, primary_key=True)
 
     user_id: int = Field(foreign_key="users.id", index=True)
     voice_id: int = Field(foreign_key="voices.id", index=True)
     batch_id: Optional[int] = Field(default=None, foreign_key="batches.id", index=True)
+    phrase_id: Optional[int] = None  # served from the phrase library (voice_phrases.id; kept after the phrase is deleted)
 
     store: bool = False
     requested_format: str = "wav"
@@ -107,12 +122,15 @@ class Generation(SQLModel, table=True):
     tokens_used: int = 0
 
     latency_ms: int
+    chars: Optional[int] = None  # input length (cost-model feature)
     status: str = "ok"
     error: Optional[str] = None
 
     created_at: datetime
 
     audio_path: Optional[str] = None
+    audio_sha256: Optional[str] = None  # content hash of the stored file (ETag)
+    audio_bytes: Optional[int] = None
     input_text: Optional[str] = None
 
 
@@ -120,4 +138,124 @@ class RuntimeStat(SQLModel, table=True):
     __tablename__ = "runtime_stats"
     key: str = Field(primary_key=True)
     value: str
-    updated_at: datetime
\ No newline at end of file
+    updated_at: datetime
+
+class PromptCache(SQLModel, table=True):
+    __tablename__ = "prompt_cache"
+    # sha256 over (audio sha256, ref text, x_vector_only_mode, model revision)
+    key: str = Field(primary_key=True)
+
+    audio_sha256: str = Field(index=True)
+    x_vector_only_mode: bool = False
+    model_revision: str
+
+    prompt_blob: bytes
+
+    created_at: datetime
+    hit_count: int = 0
+    last_hit_at: Optional[datetime] = None
+
+
+class IdempotencyRecord(SQLModel, table=True):
+    __tablename__ = "idempotency_keys"
+    # sha256 over (user id, Idempotency-Key header)
+    key: str = Field(primary_key=True)
+    user_id: int = Field(foreign_key="users.id", index=True)
+
+    endpoint: str
+    fingerprint: str  # sha256 over (user id, endpoint, request body)
+    status: str = "in_progress"  # in_progress/done
+
+    # Recorded response (status == "done")
+    status_code: Optional[int] = None
+    media_type: Optional[str] = None
+    headers_json: Optional[str] = None
+    body_path: Optional[str] = None
+
+    created_at: datetime
+    expires_at: datetime = Field(index=True)  # in_progress: lease of the running request; done: replay window
+
+
+class Phrase(SQLModel, table=True):
+    __tablename__ = "voice_phrases"
+    __table_args__ = (UniqueConstraint("voice_id", "text_key", name="uq_voice_phrases_voice_text"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    user_id: int = Field(foreign_key="users.id", index=True)
+    voice_id: int = Field(foreign_key="voices.id", index=True)
+
+    text: str
+    text_key: str  # sha256 over (text, language, temperature)
+    language: str = "auto"
+    temperature: float = 1.0
+
+    status: str = Field(default="pending", index=True)  # pending/rendering/ready/error
+    error: Optional[str] = None
+    hit_count: int = 0
+    attempts: int = 0  # failed model calls in a row; retried with backoff until PHRASE_MAX_ATTEMPTS
+    retry_at: Optional[datetime] = None  # pending: not claimed before this
+
+    created_at: datetime
+    updated_at: datetime  # rendering: claim time (stale claims are retaken)
+
+
+class PhraseRendition(SQLModel, table=True):
+    __tablename__ = "voice_phrase_renditions"
+    __table_args__ = (UniqueConstraint("phrase_id", "opts_key", name="uq_voice_phrase_renditions_opts"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    phrase_id: int = Field(foreign_key="voice_phrases.id", index=True)
+
+    opts_key: str  # format/sample_rate/channels/bitrate as requested
+    requested_format: str
+    sample_rate: Optional[int] = None  # None = native
+    channels: int = 1
+    bitrate_kbps: Optional[int] = None
+
+    # Set once rendered
+    path: Optional[str] = None
+    bytes: Optional[int] = None
+    out_sample_rate: Optional[int] = None
+
+
+class LongformJob(SQLModel, table=True):
+    __tablename__ = "longform_jobs"
+    id: Optional[int] = Field(default=None, primary_key=True)
+
+    user_id: int = Field(foreign_key="users.id", index=True)
+    voice_id: int = Field(foreign_key="voices.id", index=True)
+
+    requested_format: str = "wav"
+    sample_rate: Optional[int] = None  # None = native
+    channels: int = 1
+    bitrate_kbps: Optional[int] = None
+    language: str = "auto"
+    temperature: float = 1.0
+    store: bool = False
+
+    status: str = Field(default="queued", index=True)  # queued/running/done/error
+    error: Optional[str] = None
+    runner_id: Optional[str] = None  # process working on it (None = free to claim)
+    lease_expires_at: Optional[datetime] = None
+    attempts: int = 0  # failed model calls in a row
+    retry_at: Optional[datetime] = None  # not claimed before this (backoff after a failed model call)
+
+    segments_json: str  # JSON list of segment texts
+    total_segments: int
+    done_segments: int = 0
+
+    tokens_used: int = 0
+    latency_ms_total: int = 0
+
+    created_at: datetime
+    updated_at: datetime
+    finished_at: Optional[datetime] = None
+
+    audio_path: Optional[str] = None
+    generation_id: Optional[int] = Field(default=None, foreign_key="generations.id")
+
+
+class SchemaMigration(SQLModel, table=True):
+    __tablename__ = "schema_migrations"
+    version: int = Field(primary_key=True)
+    name: str
+    applied_at: datetime
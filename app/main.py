@@ -1,29 +1,76 @@
 # app/main.py
 from __future__ import annotations
 
+import logging
 import os
 import time
 from contextlib import asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 
 from app.core.config import Settings
-from app.core.db import init_db, SessionDep
-from app.core.startup import load_models_or_raise
-from app.routes import voices, tts, usage, health, auth, admin
+from app.core.db import get_engine, init_db, SessionDep
+from app.routes import voices, phrases, tts, estimate, ws_tts, longform, stored, history, usage, health, auth, admin
+from app.services.batch_discount import calibrator
+from app.services.cost_model import cost_estimator
+from app.services.drain import drain
+from app.services.inference import inference
+from app.services.jobs import job_runner
+from app.services.phrases import phrase_renderer
+from app.services.retention import retention_engine
+
+log = logging.getLogger(__name__)
+
+# POSTs rejected while draining; reads, downloads, polling and /admin keep working
+DRAIN_REJECT_PREFIXES = ("/tts", "/batchtts", "/clonevoice", "/designvoice")
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     settings = Settings()
-    init_db(settings.db_path)
+    init_db(settings)
+    # In-memory batch-discount calibration, merged into the DB periodically
+    calibrator.start(settings)
+    # Fitted latency model (python -m app.cli fit-cost-model), if any
+    cost_estimator.load(get_engine())
+
+    settings.media_dir.mkdir(parents=True, exist_ok=True)
+    if settings.inference_mode == "local":
+        # torch is only imported when models run in this process
+        from app.core.startup import load_models_or_raise
+
+        # Validate model dirs exist + load models once per process
+        load_models_or_raise(settings)
+    # INFERENCE_MODE=remote: model calls go to `python -m app.worker` processes
+    inference.start(settings)
+    # Upload the most used voices' prompts to the GPU in the background
+    inference.warm(settings)
 
-    # Validate model dirs exist + load models once per process
-    load_models_or_raise(settings)
+    # Background long-form synthesis (resumes unfinished jobs)
+    job_runner.start(settings)
+    # Pre-render registered phrases while the GPU is idle
+    phrase_renderer.start(settings)
+    # Periodic media expiry / quota / orphan sweep
+    retention_engine.start(settings)
+    # SIGTERM drains first and closes the listener afterwards
+    drain.install_signal_handler(settings)
 
     yield
 
+    # Normally started by SIGTERM already; every wait below shares its deadline.
+    # Let in-flight requests finish and hand the current long-form job back after its batch
+    drain.begin_shutdown(settings)
+    if not await run_in_threadpool(drain.wait_idle, drain.remaining()):
+        log.warning("Drain timeout: shutting down with requests still in flight")
+    retention_engine.stop()
+    phrase_renderer.stop()
+    await run_in_threadpool(job_runner.stop, drain.remaining())
+    inference.stop()
+    calibrator.stop()
+
 
 def create_app() -> FastAPI:
     app = FastAPI(
@@ -32,12 +79,42 @@ def create_app() -> FastAPI:
         lifespan=lifespan,
     )
 
+    @app.middleware("http")
+    async def reject_oversized_uploads(request: Request, call_next):
+        # Reject before the multipart body is parsed; per-file limits are enforced while streaming.
+        if request.url.path in ("/clonevoice", "/clonevoices"):
+            settings = Settings()
+            max_files = 1 if request.url.path == "/clonevoice" else settings.max_voice_batch_size
+            limit = (settings.max_upload_mb * max_files + 1) * 1024 * 1024  # +1 MB for form fields
+            content_length = request.headers.get("content-length", "")
+            if content_length.isdigit() and int(content_length) > limit:
+                return JSONResponse(status_code=413, content={"detail": f"Upload too large (max {settings.max_upload_mb} MB)"})
+        return await call_next(request)
+
+    @app.middleware("http")
+    async def drain_gate(request: Request, call_next):
+        settings = Settings()
+        if request.method == "POST" and request.url.path.startswith(DRAIN_REJECT_PREFIXES) and drain.active(settings):
+            return JSONResponse(
+                status_code=503,
+                content={"detail": "Server is draining; retry shortly"},
+                headers={"Retry-After": str(settings.drain_retry_after_s)},
+            )
+        with drain.track():
+            return await call_next(request)
+
     app.include_router(health.router, tags=["health"])
     app.include_router(auth.router, tags=["auth"])
     app.include_router(admin.router, tags=["admin"])
     app.include_router(voices.router, tags=["voices"])
+    app.include_router(phrases.router, tags=["voices"])
     app.include_router(tts.router, tags=["tts"])
+    app.include_router(estimate.router, tags=["tts"])
+    app.include_router(ws_tts.router, tags=["tts"])
+    app.include_router(longform.router, tags=["tts"])
+    app.include_router(stored.router, tags=["stored"])
     app.include_router(usage.router, tags=["usage"])
+    app.include_router(history.router, tags=["usage"])
 
     return app
 
@@ -1,2 +1,2 @@
 # app/routes/__init__.py
-from . import voices, tts, usage, health, auth, admin
+from . import voices, phrases, tts, estimate, ws_tts, longform, stored, history, usage, health, auth, admin
@@ -2,15 +2,26 @@
 from __future__ import annotations
 
 from datetime import timedelta
+from typing import Optional
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
 from sqlmodel import Session, select
 
 from app.core.auth import get_settings, require_admin
-from app.core.db import get_session
+from app.core.db import get_engine, get_session
+from app.core.migrations import migration_status
 from app.core.models import User, Invite
 from app.core.security import now_utc, hmac_sha256_hex, new_invite_code
 from app.core.config import Settings
+from app.services.cost_model import cost_estimator
+from app.services.derived import derived_cache
+from app.services.drain import drain
+from app.services.idempotency import idempotency
+from app.services.inference import inference
+from app.services.jobs import job_runner
+from app.services.profiling import artifact_path, list_artifacts, profiler
+from app.services.retention import retention_engine
 
 router = APIRouter(prefix="/admin")
 
@@ -52,4 +63,178 @@ def admin_create_invite(
     session.add(inv)
     session.commit()
     # Important: return the invite code ONCE.
-    return {"invite_code": invite_code, "expires_hours": expires_hours}
\ No newline at end of file
+    return {"invite_code": invite_code, "expires_hours": expires_hours}
+
+
+@router.post("/users/{user_id}/retention")
+def admin_set_user_retention(
+    user_id: int,
+    ttl_days: Optional[int] = None,
+    quota_mb: Optional[int] = None,
+    session: Session = Depends(get_session),
+    _: None = Depends(require_admin),
+):
+    """
+    Per-user overrides for stored outputs. Omit a value to fall back to the
+    server default (STORED_TTL_DAYS / STORAGE_QUOTA_MB); 0 means unlimited.
+    """
+    user = session.exec(select(User).where(User.id == user_id)).first()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.storage_ttl_days = ttl_days
+    user.storage_quota_mb = quota_mb
+    session.add(user)
+    session.commit()
+    return {"user_id": user.id, "storage_ttl_days": ttl_days, "storage_quota_mb": quota_mb}
+
+
+@router.get("/retention")
+def admin_retention_report(_: None = Depends(require_admin)):
+    return {"last_report": retention_engine.latest_report()}
+
+
+@router.post("/retention/run")
+def admin_retention_run(
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    return retention_engine.run_once(settings).to_dict()
+
+
+@router.get("/migrations")
+def admin_migrations(_: None = Depends(require_admin)):
+    return {"migrations": migration_status(get_engine())}
+
+
+@router.get("/cost-model")
+def admin_cost_model(_: None = Depends(require_admin)):
+    model = cost_estimator.model
+    if model is None:
+        return {"model": None}
+    return {"model": {"coef": model.coef, "n_samples": model.n_samples, "fitted_at": model.fitted_at, "report": model.report}}
+
+
+@router.post("/cost-model/reload")
+def admin_cost_model_reload(_: None = Depends(require_admin)):
+    """Reloads the model saved by `python -m app.cli fit-cost-model`."""
+    model = cost_estimator.load(get_engine())
+    return {"loaded": model is not None, "fitted_at": model.fitted_at if model else None}
+
+
+@router.get("/idempotency")
+def admin_idempotency(_: None = Depends(require_admin)):
+    """In-flight requests in this process and how many were coalesced or replayed."""
+    return idempotency.snapshot()
+
+
+@router.get("/gpu")
+def admin_gpu(_: None = Depends(require_admin)):
+    try:
+        return inference.stats()
+    except (TimeoutError, RuntimeError) as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+
+@router.get("/drain")
+def admin_drain_status(
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    return {**drain.snapshot(settings), "longform_jobs": job_runner.snapshot()}
+
+
+@router.post("/drain")
+def admin_drain(
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    """
+    Starts draining every API process on this host (e.g. from a preStop hook):
+    /ready reports "draining", new work gets 503 + Retry-After, and the
+    long-form runner hands its job back after the current batch.
+    """
+    drain.begin(settings, all_workers=True)
+    return drain.snapshot(settings)
+
+
+@router.delete("/drain")
+def admin_undrain(
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    drain.cancel(settings)
+    return drain.snapshot(settings)
+
+
+@router.post("/profile/cpu", status_code=202)
+def admin_profile_cpu(
+    seconds: float = 30.0,
+    interval_ms: float = 10.0,
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    """Samples this process's Python stacks for `seconds`; download the .folded artifact when done."""
+    try:
+        return profiler.start_cpu(settings, seconds, interval_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/profile/torch", status_code=202)
+def admin_profile_torch(
+    generations: int = 5,
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    """Runs torch.profiler around the next `generations` model calls (Chrome trace + summary table)."""
+    try:
+        return inference.profile_torch(settings, generations)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except TimeoutError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@router.post("/profile/state")
+def admin_profile_state(
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    """Thread stacks, scheduler state and cache occupancy of this process, also saved as an artifact."""
+    try:
+        caches = inference.stats()
+    except (TimeoutError, RuntimeError, OSError) as e:
+        caches = {"error": str(e)}
+    sections = {
+        "scheduler": {"longform_jobs": job_runner.snapshot(), "idempotency": idempotency.snapshot()},
+        "caches": {**caches, "derived_audio": derived_cache.snapshot()},
+    }
+    return profiler.dump_state(settings, sections)
+
+
+@router.get("/profiles")
+def admin_profiles(
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    return {**profiler.snapshot(), "artifacts": list_artifacts(settings)}
+
+
+@router.get("/profiles/{name}")
+def admin_profile_download(
+    name: str,
+    settings: Settings = Depends(get_settings),
+    _: None = Depends(require_admin),
+):
+    try:
+        path = artifact_path(settings, name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Artifact not found")
+    media_type = "application/json" if path.suffix == ".json" else "text/plain"
+    return FileResponse(path, media_type=media_type, filename=name)
@@ -0,0 +1,68 @@
+# app/routes/estimate.py
+from __future__ import annotations
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+
+from app.core.auth import get_current_user, get_settings
+from app.core.config import Settings
+from app.routes.tts import BatchItem, batch_item_texts, dedupe, preprocess_text_batch, preprocess_text_single
+from app.services.audio_store import ensure_supported_output
+from app.services.batch_discount import calibrator
+from app.services.cost_model import cost_estimator
+from app.services.tokens import tokens_for_batch, tokens_for_text
+
+router = APIRouter()
+
+
+class EstimateRequest(BaseModel):
+    text: list[str | BatchItem] | str = Field(..., min_length=1)
+    language: str = "auto"
+    format: str = Field(default="wav", description="wav|mp3|ogg|pcm|flac|opus")
+    expand_numbers: bool = False
+
+
+@router.post("/estimate")
+def estimate(
+    req: EstimateRequest,
+    settings: Settings = Depends(get_settings),
+    _user=Depends(get_current_user),
+):
+    """
+    Predicts latency, GPU-seconds and tokens for a /tts (string) or /batchtts
+    (list) request without running it. Batch tokens use the current
+    calibrated discount, so the charged amount can differ slightly; repeated
+    items are counted once, as /batchtts generates them once.
+    """
+    try:
+        ensure_supported_output(req.format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    language = (req.language or "auto").strip() or "auto"
+
+    if isinstance(req.text, str):
+        texts = [preprocess_text_single(req.text, settings, language, req.expand_numbers)]
+        discount = None
+        tokens = tokens_for_text(texts[0])
+    else:
+        items = [it if isinstance(it, BatchItem) else BatchItem(text=it) for it in req.text]
+        languages = [(it.language or "").strip() or language for it in items]
+        texts = preprocess_text_batch(batch_item_texts(req.text), settings, languages, req.expand_numbers)
+        unique, _ = dedupe([(t, it.voice_id, lang, it.temperature) for t, it, lang in zip(texts, items, languages)])
+        texts = [texts[i] for i in unique]
+        discount = calibrator.discount(settings, len(texts), sum(len(t) for t in texts) / len(texts))
+        tokens = tokens_for_batch(texts, round(discount, 3))
+
+    est = cost_estimator.predict(settings, [len(t) for t in texts], language, req.format)
+    model = cost_estimator.model
+    return {
+        "items": len(texts),
+        "chars": sum(len(t) for t in texts),
+        "predicted_latency_ms": est.latency_ms,
+        "gpu_seconds": est.gpu_seconds,
+        "source": est.source,
+        "model_fitted_at": model.fitted_at if est.source == "model" and model else None,
+        "tokens": tokens,
+        "batch_discount": discount,
+        "admitted": not cost_estimator.over_budget(settings, est),
+    }
@@ -1,9 +1,12 @@
 # app/routes/health.py
 from __future__ import annotations
 
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from app.services.qwen_models import model_registry
+from app.core.auth import get_settings
+from app.core.config import Settings
+from app.services.drain import drain
+from app.services.inference import inference
 
 router = APIRouter()
 
@@ -14,7 +17,9 @@ def health():
 
 
 @router.get("/ready")
-def ready():
-    if not model_registry.loaded or model_registry.base is None or model_registry.voice_design is None:
+def ready(settings: Settings = Depends(get_settings)):
+    if drain.active(settings):
+        return {"status": "draining"}
+    if not inference.ready(design=True):
         return {"status": "not_ready"}
     return {"status": "ready"}
\ No newline at end of file
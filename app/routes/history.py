@@ -0,0 +1,174 @@
+# app/routes/history.py
+from __future__ import annotations
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlmodel import Session, select, func
+
+from app.core.auth import get_current_user, get_settings
+from app.core.config import Settings
+from app.core.db import get_engine, get_session
+from app.core.models import Batch, Generation
+from app.core.security import as_utc_aware
+from app.services.drain import drain
+from app.services.pagination import before_cursor, encode_cursor
+
+router = APIRouter()
+
+EXPORT_PAGE_SIZE = 1000
+
+GENERATION_COLUMNS = (
+    "id", "batch_id", "voice_id", "created_at", "status", "error", "tokens_used",
+    "latency_ms", "requested_format", "language", "temperature", "store",
+)
+BATCH_COLUMNS = (
+    "id", "voice_id", "created_at", "status", "error", "tokens_used", "batch_discount_used",
+    "latency_ms_total", "requested_format", "language", "store",
+)
+
+
+def _filtered(model, columns, user_id: int, since, until, voice_id, status):
+    q = select(*[getattr(model, c) for c in columns]).where(model.user_id == user_id)
+    if since is not None:
+        q = q.where(model.created_at >= as_utc_aware(since))
+    if until is not None:
+        q = q.where(model.created_at < as_utc_aware(until))
+    if voice_id is not None:
+        q = q.where(model.voice_id == voice_id)
+    if status is not None:
+        q = q.where(model.status == status)
+    return q
+
+
+def _row_dict(row, columns) -> dict:
+    out = dict(zip(columns, row))
+    out["created_at"] = out["created_at"].isoformat()
+    return out
+
+
+def _page(session: Session, settings: Settings, q, model, columns, limit, cursor) -> dict:
+    limit = max(1, min(limit or settings.page_size_default, settings.page_size_max))
+    if cursor:
+        try:
+            q = q.where(before_cursor(model.created_at, model.id, cursor))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    rows = session.exec(q.order_by(model.created_at.desc(), model.id.desc()).limit(limit)).all()
+    items = [_row_dict(r, columns) for r in rows]
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def _export(session: Session, q, model, columns, user_id: int, fmt: str, filename: str) -> StreamingResponse:
+    """
+    Streams every matching row, newest first, in keyset pages on a private
+    session. Rows created after the export started are excluded (id snapshot),
+    so concurrent writes never shift or duplicate rows mid-stream.
+    """
+    if fmt not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be csv or ndjson")
+    snapshot_id = session.exec(select(func.max(model.id)).where(model.user_id == user_id)).one() or 0
+    q = q.where(model.id <= snapshot_id)
+
+    def rows() -> Iterator[dict]:
+        with Session(get_engine()) as s:
+            page_q = q
+            while True:
+                page = s.exec(page_q.order_by(model.created_at.desc(), model.id.desc()).limit(EXPORT_PAGE_SIZE)).all()
+                for r in page:
+                    yield _row_dict(r, columns)
+                if len(page) < EXPORT_PAGE_SIZE:
+                    return
+                last = page[-1]
+                page_q = q.where(before_cursor(model.created_at, model.id, encode_cursor(last.created_at, last.id)))
+
+    def ndjson() -> Iterator[bytes]:
+        for d in rows():
+            yield (json.dumps(d) + "\n").encode("utf-8")
+
+    def csv_lines() -> Iterator[bytes]:
+        buf = io.StringIO()
+        w = csv.DictWriter(buf, fieldnames=list(columns))
+        w.writeheader()
+        for i, d in enumerate(rows()):
+            w.writerow(d)
+            if i % 500 == 0:
+                yield buf.getvalue().encode("utf-8")
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue().encode("utf-8")
+
+    media_type = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}.{fmt}"', "X-Snapshot-Max-Id": str(snapshot_id)}
+    return StreamingResponse(drain.tracked(csv_lines() if fmt == "csv" else ndjson()), media_type=media_type, headers=headers)
+
+
+@router.get("/generations")
+def list_generations(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    voice_id: Optional[int] = None,
+    status: Optional[str] = None,
+    batch_id: Optional[int] = None,
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    q = _filtered(Generation, GENERATION_COLUMNS, user.id, since, until, voice_id, status)
+    if batch_id is not None:
+        q = q.where(Generation.batch_id == batch_id)
+    return _page(session, settings, q, Generation, GENERATION_COLUMNS, limit, cursor)
+
+
+@router.get("/generations/export")
+def export_generations(
+    format: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    voice_id: Optional[int] = None,
+    status: Optional[str] = None,
+    session: Session = Depends(get_session),
+    user=Depends(get_current_user),
+):
+    q = _filtered(Generation, GENERATION_COLUMNS, user.id, since, until, voice_id, status)
+    return _export(session, q, Generation, GENERATION_COLUMNS, user.id, format, "generations")
+
+
+@router.get("/batches")
+def list_batches(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    voice_id: Optional[int] = None,
+    status: Optional[str] = None,
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    q = _filtered(Batch, BATCH_COLUMNS, user.id, since, until, voice_id, status)
+    return _page(session, settings, q, Batch, BATCH_COLUMNS, limit, cursor)
+
+
+@router.get("/batches/export")
+def export_batches(
+    format: str = "ndjson",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    voice_id: Optional[int] = None,
+    status: Optional[str] = None,
+    session: Session = Depends(get_session),
+    user=Depends(get_current_user),
+):
+    q = _filtered(Batch, BATCH_COLUMNS, user.id, since, until, voice_id, status)
+    return _export(session, q, Batch, BATCH_COLUMNS, user.id, format, "batches")
@@ -0,0 +1,148 @@
+# app/routes/longform.py
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+from sqlmodel import Session, select
+
+from app.core.auth import get_current_user, get_settings
+from app.core.config import Settings
+from app.core.db import get_session
+from app.core.models import LongformJob, Voice
+from app.core.security import now_utc
+from app.routes.tts import output_options
+from app.services.audio_store import OUTPUT_MEDIA_TYPES
+from app.services.inference import inference
+from app.services.jobs import job_runner
+from app.services.longform import segment_text
+from app.services.tokens import tokens_for_text
+
+router = APIRouter()
+
+
+class LongformRequest(BaseModel):
+    text: str = Field(..., min_length=1)
+    voice_id: int
+    store: bool = False
+    language: str = "auto"
+    temperature: float = 1.0
+    format: str = Field(default="wav", description="wav|mp3|ogg|pcm|flac|opus (pcm = raw s16le)")
+    sample_rate: Optional[int] = None
+    channels: int = 1
+    bitrate: Optional[int] = None  # kbps, mp3/ogg/opus only
+
+
+def _job_out(job: LongformJob) -> dict:
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "error": job.error,
+        "attempts": job.attempts,
+        "retry_at": job.retry_at.isoformat() if job.retry_at else None,
+        "total_segments": job.total_segments,
+        "done_segments": job.done_segments,
+        "progress": round(job.done_segments / job.total_segments, 4) if job.total_segments else 1.0,
+        "tokens_used": job.tokens_used,
+        "latency_ms_total": job.latency_ms_total,
+        "generation_id": job.generation_id,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _get_job(session: Session, job_id: int, user_id: int) -> LongformJob:
+    job = session.exec(select(LongformJob).where(LongformJob.id == job_id, LongformJob.user_id == user_id)).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@router.post("/tts/longform", status_code=202)
+def create_longform(
+    req: LongformRequest,
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    """
+    Queues a long document for synthesis. The text is segmented into sentence
+    units, generated in batches against the voice's prompt and joined with
+    short crossfades. Poll GET /tts/longform/{job_id} for progress.
+    """
+    text = req.text.strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="Text must not be empty")
+    if len(text) > settings.longform_max_chars:
+        raise HTTPException(status_code=400, detail=f"Text too long (max {settings.longform_max_chars})")
+    opts = output_options(req)
+
+    v = session.exec(select(Voice).where(Voice.id == req.voice_id, Voice.user_id == user.id, Voice.deleted_at.is_(None))).first()
+    if not v:
+        raise HTTPException(status_code=404, detail="Voice not found")
+    if not inference.ready():
+        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    segments = segment_text(text, min(settings.longform_segment_chars, settings.max_text_len))
+    if not segments:
+        raise HTTPException(status_code=400, detail="Text must not be empty")
+
+    ts = now_utc()
+    job = LongformJob(
+        user_id=user.id,
+        voice_id=v.id,
+        requested_format=opts.fmt,
+        sample_rate=opts.sample_rate,
+        channels=opts.channels,
+        bitrate_kbps=opts.bitrate_kbps,
+        language=(req.language or "auto").strip() or "auto",
+        temperature=req.temperature,
+        store=req.store,
+        status="queued",
+        segments_json=json.dumps(segments),
+        total_segments=len(segments),
+        tokens_used=sum(tokens_for_text(s) for s in segments),
+        created_at=ts,
+        updated_at=ts,
+    )
+    session.add(job)
+    session.commit()
+    session.refresh(job)
+
+    job_runner.submit(job.id)
+    # Upload the voice's prompt to the GPU while the job waits in the queue
+    inference.prefetch(settings, v.id, v.prompt_blob)
+    return _job_out(job)
+
+
+@router.get("/tts/longform/{job_id}")
+def get_longform(
+    job_id: int,
+    session: Session = Depends(get_session),
+    user=Depends(get_current_user),
+):
+    return _job_out(_get_job(session, job_id, user.id))
+
+
+@router.get("/tts/longform/{job_id}/audio")
+def get_longform_audio(
+    job_id: int,
+    session: Session = Depends(get_session),
+    user=Depends(get_current_user),
+):
+    job = _get_job(session, job_id, user.id)
+    if job.status != "done":
+        raise HTTPException(status_code=409, detail=f"Job not finished (status: {job.status})")
+    if not job.audio_path or not Path(job.audio_path).is_file():
+        raise HTTPException(status_code=410, detail="Long-form audio no longer available")
+    media_type = OUTPUT_MEDIA_TYPES[job.requested_format]
+    headers = {
+        "X-Generation-Id": str(job.generation_id),
+        "X-Tokens-Used": str(job.tokens_used),
+        "X-Latency-Ms": str(job.latency_ms_total),
+    }
+    return FileResponse(job.audio_path, media_type=media_type, filename=f"longform.{job.requested_format}", headers=headers)
@@ -0,0 +1,148 @@
+# app/routes/phrases.py
+from __future__ import annotations
+
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlmodel import Session, select
+
+from app.core.auth import get_current_user, get_settings
+from app.core.config import Settings
+from app.core.db import get_session
+from app.core.models import Phrase, PhraseRendition, Voice
+from app.routes.tts import output_options, preprocess_text_single
+from app.services.pagination import before_cursor, encode_cursor
+from app.services.phrases import delete_phrases, register_phrases
+
+router = APIRouter()
+
+
+class PhraseItem(BaseModel):
+    """One phrase; unset fields fall back to the request's values."""
+    text: str
+    language: Optional[str] = None
+    temperature: Optional[float] = None
+
+
+class PhraseFormat(BaseModel):
+    format: str = "wav"
+    sample_rate: Optional[int] = None
+    channels: int = 1
+    bitrate: Optional[int] = None
+
+
+class PhraseRequest(BaseModel):
+    phrases: list[str | PhraseItem] = Field(..., min_length=1)
+    language: str = "auto"
+    temperature: float = 1.0
+    formats: list[PhraseFormat] = Field(default_factory=lambda: [PhraseFormat()], min_length=1)
+    expand_numbers: bool = False  # must match the /tts requests that should hit
+
+
+def _get_voice(session: Session, voice_id: int, user_id: int) -> Voice:
+    v = session.exec(select(Voice).where(Voice.id == voice_id, Voice.user_id == user_id, Voice.deleted_at.is_(None))).first()
+    if not v:
+        raise HTTPException(status_code=404, detail="Voice not found")
+    return v
+
+
+@router.post("/voices/{voice_id}/phrases", status_code=202)
+def add_phrases(
+    voice_id: int,
+    req: PhraseRequest,
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    """
+    Registers phrases to pre-render for this voice in each of `formats`.
+    Rendering happens in the background while the GPU is idle; /tts requests
+    with the same text, language, temperature and output options are then
+    served from storage. Registering a phrase again adds missing formats.
+    """
+    v = _get_voice(session, voice_id, user.id)
+    if len(req.phrases) > settings.phrase_max_per_voice:
+        raise HTTPException(status_code=400, detail=f"Too many phrases (max {settings.phrase_max_per_voice})")
+    if len(req.formats) > settings.phrase_max_formats:
+        raise HTTPException(status_code=400, detail=f"Too many formats (max {settings.phrase_max_formats})")
+    formats = list(dict.fromkeys(output_options(f) for f in req.formats))
+
+    items = []
+    for p in req.phrases:
+        if isinstance(p, str):
+            p = PhraseItem(text=p)
+        language = (p.language or req.language or "auto").strip() or "auto"
+        temperature = req.temperature if p.temperature is None else p.temperature
+        # Stored exactly as /tts will see the text, so matching is a key lookup
+        items.append((preprocess_text_single(p.text, settings, language, req.expand_numbers), language, temperature))
+
+    try:
+        return register_phrases(session, settings, v, items, formats)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/voices/{voice_id}/phrases")
+def list_phrases(
+    voice_id: int,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    v = _get_voice(session, voice_id, user.id)
+    limit = max(1, min(limit or settings.page_size_default, settings.page_size_max))
+    q = select(Phrase).where(Phrase.voice_id == v.id)
+    if status is not None:
+        q = q.where(Phrase.status == status)
+    if cursor:
+        try:
+            q = q.where(before_cursor(Phrase.created_at, Phrase.id, cursor))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    rows = session.exec(q.order_by(Phrase.created_at.desc(), Phrase.id.desc()).limit(limit)).all()
+
+    renditions: dict[int, list[dict]] = {p.id: [] for p in rows}
+    for r in session.exec(select(PhraseRendition).where(PhraseRendition.phrase_id.in_(list(renditions)))):
+        renditions[r.phrase_id].append({
+            "format": r.requested_format,
+            "sample_rate": r.out_sample_rate or r.sample_rate,
+            "channels": r.channels,
+            "bitrate": r.bitrate_kbps,
+            "ready": r.path is not None,
+            "bytes": r.bytes,
+        })
+    items = [
+        {
+            "phrase_id": p.id,
+            "text": p.text,
+            "language": p.language,
+            "temperature": p.temperature,
+            "status": p.status,
+            "error": p.error,
+            "hits": p.hit_count,
+            "formats": renditions[p.id],
+            "created_at": p.created_at.isoformat(),
+        }
+        for p in rows
+    ]
+    next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id) if len(rows) == limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+@router.post("/voices/{voice_id}/phrases/{phrase_id}/delete")
+def delete_phrase(
+    voice_id: int,
+    phrase_id: int,
+    session: Session = Depends(get_session),
+    user=Depends(get_current_user),
+):
+    v = _get_voice(session, voice_id, user.id)
+    p = session.exec(select(Phrase).where(Phrase.id == phrase_id, Phrase.voice_id == v.id)).first()
+    if not p:
+        raise HTTPException(status_code=404, detail="Phrase not found")
+    delete_phrases(session, [p])
+    return {"status": "deleted"}
@@ -0,0 +1,193 @@
+# app/routes/stored.py
+from __future__ import annotations
+
+import json
+import zipfile
+from pathlib import Path
+from typing import Iterator, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from sqlmodel import Session, select
+
+from app.core.auth import get_current_user, get_settings
+from app.core.config import Settings
+from app.core.db import get_session
+from app.core.models import Generation
+from app.core.security import sha256_file
+from app.services.audio_store import OUTPUT_MEDIA_TYPES
+from app.services.derived import CACHE_CONTROL, DerivedSpec, derived_cache, derived_etag, etag_matches
+from app.services.drain import drain
+from app.services.encode import OutputOptions
+
+router = APIRouter()
+
+EXPORT_MAX_LIMIT = 1000
+EXPORT_CHUNK_BYTES = 1024 * 1024
+
+
+def serve_audio(
+    request: Request,
+    settings: Settings,
+    source_path: str,
+    source_sha: str,
+    source_fmt: str,
+    filename: str,
+    headers: dict[str, str],
+    format: Optional[str] = None,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+    bitrate: Optional[int] = None,
+    duration: Optional[float] = None,
+) -> Response:
+    """
+    Serves an immutable audio file as is, or (when any output option is set)
+    its transcoded version from the derived cache. Either way with a content
+    ETag, If-None-Match and Range support and long cache headers.
+    """
+    spec = None
+    fmt, etag = source_fmt, f'"{source_sha}"'
+    headers = {**headers, "Cache-Control": CACHE_CONTROL}
+    if (format, sample_rate, channels, bitrate, duration) != (None,) * 5:
+        try:
+            spec = DerivedSpec(
+                OutputOptions(format or source_fmt, sample_rate, channels or 1, bitrate), duration
+            ).validate()
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        fmt, etag = spec.opts.fmt, derived_etag(source_sha, spec)
+        headers["X-Channels"] = str(spec.opts.channels)
+        if spec.opts.sample_rate:
+            headers["X-Sample-Rate"] = str(spec.opts.sample_rate)
+    headers["ETag"] = etag
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    path = source_path
+    if spec is not None:
+        try:
+            path = str(derived_cache.get(settings, source_path, source_sha, spec))
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Could not transcode audio: {e}")
+    media_type = OUTPUT_MEDIA_TYPES.get(fmt, "application/octet-stream")
+    return FileResponse(path, media_type=media_type, filename=f"{filename}.{fmt}", headers=headers)
+
+
+class _ZipSink:
+    """Unseekable write target for zipfile; collected bytes are drained by the response generator."""
+
+    def __init__(self) -> None:
+        self._buf = bytearray()
+
+    def write(self, data) -> int:
+        self._buf += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+def _stream_zip(rows: list[Generation]) -> Iterator[bytes]:
+    sink = _ZipSink()
+    manifest = []
+    # ZIP_STORED: outputs are already audio; streaming mode writes data descriptors, no seeking
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as z:
+        for g in rows:
+            path = Path(g.audio_path or "")
+            if not path.is_file():
+                manifest.append({"generation_id": g.id, "error": "missing"})
+                continue
+            arcname = f"{g.id}{path.suffix}"
+            with path.open("rb") as src, z.open(arcname, mode="w", force_zip64=True) as dst:
+                while chunk := src.read(EXPORT_CHUNK_BYTES):
+                    dst.write(chunk)
+                    yield sink.drain()
+            manifest.append({
+                "generation_id": g.id,
+                "filename": arcname,
+                "batch_id": g.batch_id,
+                "voice_id": g.voice_id,
+                "format": g.requested_format,
+                "language": g.language,
+                "created_at": g.created_at.isoformat(),
+                "input_text": g.input_text,
+                "sha256": g.audio_sha256,
+            })
+        z.writestr("manifest.json", json.dumps(manifest, indent=2))
+    yield sink.drain()
+
+
+@router.get("/getstored/export")
+def export_stored(
+    after_id: int = 0,
+    limit: int = 100,
+    session: Session = Depends(get_session),
+    user=Depends(get_current_user),
+):
+    """
+    Streams up to `limit` stored generations with id > after_id as one ZIP
+    (audio files + manifest.json). Page with X-Next-After-Id.
+    """
+    limit = max(1, min(limit, EXPORT_MAX_LIMIT))
+    rows = session.exec(
+        select(Generation)
+        .where(
+            Generation.user_id == user.id,
+            Generation.store == True,  # pylint: disable=singleton-comparison
+            Generation.audio_path.is_not(None),
+            Generation.id > after_id,
+        )
+        .order_by(Generation.id)
+        .limit(limit)
+    ).all()
+
+    headers = {"Content-Disposition": 'attachment; filename="stored_export.zip"', "X-Item-Count": str(len(rows))}
+    if len(rows) == limit:
+        headers["X-Next-After-Id"] = str(rows[-1].id)
+    return StreamingResponse(drain.tracked(_stream_zip(list(rows))), media_type="application/zip", headers=headers)
+
+
+@router.get("/getstored/{generation_id}")
+def get_stored(
+    generation_id: int,
+    request: Request,
+    format: Optional[str] = None,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+    bitrate: Optional[int] = None,
+    duration: Optional[float] = None,
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    """
+    Returns a stored generation's audio, or a transcoded copy / excerpt of it
+    when format, sample_rate, channels, bitrate or duration (seconds) is
+    given. Supports Range / If-Range requests (served by FileResponse, which
+    uses the server's pathsend/sendfile path when available) and
+    If-None-Match against a content-hash ETag.
+    """
+    g = session.exec(
+        select(Generation).where(Generation.id == generation_id, Generation.user_id == user.id)
+    ).first()
+    if not g or not g.store or not g.audio_path:
+        raise HTTPException(status_code=404, detail="Stored generation not found")
+    if not Path(g.audio_path).is_file():
+        raise HTTPException(status_code=410, detail="Stored audio no longer available")
+
+    if g.audio_sha256 is None:
+        # Rows stored before hashes were recorded: compute once and keep
+        g.audio_sha256 = sha256_file(g.audio_path)
+        session.add(g)
+        session.commit()
+
+    fmt = Path(g.audio_path).suffix.lstrip(".") or g.requested_format
+    return serve_audio(
+        request, settings, g.audio_path, g.audio_sha256, fmt, str(g.id), {"X-Generation-Id": str(g.id)},
+        format, sample_rate, channels, bitrate, duration,
+    )
@@ -2,54 +2,77 @@
 from __future__ import annotations
 
 import io
+import os
 import time
 import zipfile
+from collections import Counter
 from pathlib import Path
+from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import FileResponse, StreamingResponse
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import Response
 from pydantic import BaseModel, Field
 from sqlmodel import Session, select
-import soundfile as sf
-from torch import cuda
 
 from app.core.auth import get_current_user, get_settings
 from app.core.config import Settings
 from app.core.db import get_session
-from app.core.models import Voice, Generation, Batch
-from app.core.security import now_utc
+from app.core.models import Voice, Generation, Batch, Phrase, PhraseRendition
+from app.core.security import now_utc, sha256_file
 from app.services.tokens import tokens_for_text, tokens_for_batch
-from app.services.audio_store import ensure_supported_output
-from app.services.encode import convert_audio
-from app.services.qwen_models import model_registry
-from app.services.batch_discount import (
-    get_batch_discount,
-    update_single_latency_per_char,
-    update_batch_discount_from_observation,
+from app.services.audio_store import OUTPUT_MEDIA_TYPES
+from app.services.encode import OutputOptions, encode_audio
+from app.services.output_paths import write_output_audio, write_output_bytes
+from app.services.batch_discount import calibrator
+from app.services.cost_model import Estimate, cost_estimator
+from app.services.idempotency import (
+    MAX_KEY_LEN,
+    IdempotencyInProgress,
+    IdempotencyKeyReused,
+    StoredResponse,
+    idempotency,
 )
+from app.services.inference import CallStats, inference
+from app.services.normalize import normalize_text
+from app.services.phrases import lookup as phrase_lookup
 
 router = APIRouter()
 
 
+class BatchItem(BaseModel):
+    """One /batchtts item; unset fields fall back to the request's values."""
+    text: str
+    voice_id: Optional[int] = None
+    language: Optional[str] = None
+    temperature: Optional[float] = None
+
+
 class TTSRequest(BaseModel):
-    text: list[str] | str = Field(..., min_length=1)
-    voice_id: int
+    text: list[str | BatchItem] | str = Field(..., min_length=1)
+    voice_id: Optional[int] = None  # required for /tts; default voice for /batchtts items
     store: bool = False
     language: str = "auto"
     temperature: float = 1.0
-    format: str = Field(default="wav", description="wav|mp3|ogg")
+    format: str = Field(default="wav", description="wav|mp3|ogg|pcm|flac|opus (pcm = raw s16le)")
+    sample_rate: Optional[int] = None  # resampled on the server; None = the model's native rate
+    channels: int = 1
+    bitrate: Optional[int] = None  # kbps, mp3/ogg/opus only
+    expand_numbers: bool = False  # spell out numbers/currency/abbreviations (English text)
 
 
-def preprocess_text_single(text: str, settings: Settings):
-    text = text.strip()
+def preprocess_text_single(text: str, settings: Settings, language: str = "auto", expand_numbers: bool = False):
+    text = normalize_text(text, language, expand_numbers)
     if not text:
         raise HTTPException(status_code=400, detail="Text must not be empty")
     if len(text) > settings.max_text_len:
         raise HTTPException(status_code=400, detail=f"Text too long (max {settings.max_text_len})")
     return text
 
-def preprocess_text_batch(texts: list[str], settings: Settings):
-    texts = [t.strip() for t in texts]
+def preprocess_text_batch(
+    texts: list[str], settings: Settings, languages: Optional[list[str]] = None, expand_numbers: bool = False
+):
+    languages = languages or ["auto"] * len(texts)
+    texts = [normalize_text(t, lang, expand_numbers) for t, lang in zip(texts, languages)]
     if any(not t for t in texts):
         raise HTTPException(status_code=400, detail="All texts must be non-empty")
     if any(len(t) > settings.max_text_len for t in texts):
@@ -57,18 +80,104 @@ def preprocess_text_batch(texts: list[str], settings: Settings):
     return texts
 
 
+def dedupe(keys: list) -> tuple[list[int], list[int]]:
+    """
+    (first index of each distinct key, position -> index into that list), so
+    identical items are generated once and fanned back out.
+    """
+    first: dict = {}
+    unique: list[int] = []
+    slots: list[int] = []
+    for i, key in enumerate(keys):
+        if key not in first:
+            first[key] = len(unique)
+            unique.append(i)
+        slots.append(first[key])
+    return unique, slots
+
+
+def batch_item_texts(items: list[str | BatchItem]) -> list[str]:
+    return [it if isinstance(it, str) else it.text for it in items]
+
+
+def voice_usage(texts: list[str], voice_ids: list[int], tokens_used: int) -> dict[str, dict]:
+    """
+    Per-voice share of a batch: items, chars and tokens (the batch total split
+    by chars; remainders go to the voices with the most chars).
+    """
+    chars: dict[int, int] = {}
+    items: Counter = Counter(voice_ids)
+    for text, vid in zip(texts, voice_ids):
+        chars[vid] = chars.get(vid, 0) + len(text)
+    total = sum(chars.values()) or 1
+    shares = {vid: tokens_used * c // total for vid, c in chars.items()}
+    for vid in sorted(chars, key=chars.get, reverse=True)[: tokens_used - sum(shares.values())]:
+        shares[vid] += 1
+    return {str(vid): {"items": items[vid], "chars": chars[vid], "tokens": shares[vid]} for vid in chars}
+
+
+def output_options(req) -> OutputOptions:
+    """format/sample_rate/channels/bitrate of a request (400 if invalid)."""
+    try:
+        return OutputOptions(
+            fmt=req.format, sample_rate=req.sample_rate, channels=req.channels, bitrate_kbps=req.bitrate
+        ).validate()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def output_headers(opts: OutputOptions, native_sr: int) -> dict[str, str]:
+    return {"X-Sample-Rate": str(opts.sample_rate or native_sr), "X-Channels": str(opts.channels)}
+
+
+def admit_or_reject(est: Estimate, settings: Settings) -> None:
+    if cost_estimator.over_budget(settings, est):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Request predicted to take {est.latency_ms / 1000:.1f}s (max {settings.max_predicted_latency_s:g}s); "
+                   "split it into smaller requests or use /tts/longform",
+        )
+
+
+def run_idempotent(settings: Settings, user_id: int, endpoint: str, req: BaseModel, key: Optional[str], compute) -> Response:
+    """
+    Coalesces identical in-flight requests and honours Idempotency-Key
+    (see app/services/idempotency.py). Replays carry Idempotent-Replayed: true.
+    """
+    if key is not None and not 0 < len(key) <= MAX_KEY_LEN:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1-{MAX_KEY_LEN} characters")
+    try:
+        result, replayed = idempotency.run(settings, user_id, endpoint, req.model_dump(mode="json"), key, compute)
+    except IdempotencyKeyReused as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e), headers={"Retry-After": str(settings.idempotency_retry_after_s)})
+    headers = dict(result.headers)
+    if replayed:
+        headers["Idempotent-Replayed"] = "true"
+    return Response(result.body, status_code=result.status_code, media_type=result.media_type, headers=headers)
+
+
 @router.post("/tts")
 def tts(
     req: TTSRequest,
     session: Session = Depends(get_session),
     settings: Settings = Depends(get_settings),
     user=Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(default=None),
 ):
+    return run_idempotent(settings, user.id, "/tts", req, idempotency_key, lambda: _tts(req, session, settings, user))
+
+
+def _tts(req: TTSRequest, session: Session, settings: Settings, user) -> StoredResponse:
     if isinstance(req.text, list):
         raise HTTPException(status_code=400, detail="Single TTS endpoint expects a single text string, not a list")
-    text = preprocess_text_single(req.text, settings)
+    if req.voice_id is None:
+        raise HTTPException(status_code=400, detail="voice_id is required")
+    language = (req.language or "auto").strip() or "auto"
+    text = preprocess_text_single(req.text, settings, language, req.expand_numbers)
 
-    ensure_supported_output(req.format)
+    opts = output_options(req)
 
     v = session.exec(select(Voice).where(Voice.id == req.voice_id, Voice.user_id == user.id, Voice.deleted_at.is_(None))).first()
     if not v:
@@ -76,38 +185,23 @@ def tts(
     if v.id is None:
         raise HTTPException(status_code=500, detail="Voice has no ID (DB error)")
 
-    if model_registry.base is None:
+    hit = phrase_lookup(session, v.id, text, language, req.temperature, opts)
+    if hit is not None:
+        served = _tts_from_library(req, session, settings, user, v, text, language, opts, *hit)
+        if served is not None:
+            return served
+
+    if not inference.ready():
         raise HTTPException(status_code=503, detail="Model not loaded")
 
-    prompt = model_registry.load_prompt(v.prompt_blob)
-    language = (req.language or "auto").strip() or "auto"
+    admit_or_reject(cost_estimator.predict(settings, [len(text)], language, req.format), settings)
 
     t0 = time.perf_counter()
-    out_wavs, sr = model_registry.base.generate_voice_clone(
-        text=text,
-        language=language,
-        voice_clone_prompt=[prompt],
-        temperature=req.temperature,
-    )
+    out_wavs, sr, mem = inference.synthesize(settings, v.id, v.prompt_blob, [text], language, req.temperature)
     latency_ms = int((time.perf_counter() - t0) * 1000)
-    cuda.empty_cache()
-
-    # Save to temp wav, convert if needed
-    out_dir = settings.media_dir / "gens" / str(user.id)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    gen_ts = int(now_utc().timestamp() * 1000)
-    tmp_wav = str(out_dir / f"gen_{gen_ts}.wav")
-    audio = out_wavs[0]
-    sf.write(tmp_wav, audio, sr)
-
-    final_path = tmp_wav
-    if req.format != "wav":
-        final_path = str(out_dir / f"gen_{gen_ts}.{req.format}")
-        convert_audio(tmp_wav, final_path)
-        try:
-            Path(tmp_wav).unlink(missing_ok=True)
-        except Exception:
-            pass
+
+    # Write to a unique, sharded output path (atomic rename; concurrent calls never collide)
+    final_path = write_output_audio(settings, "gens", user.id, out_wavs[0], sr, opts)
 
     # DB write
     tokens_used = tokens_for_text(text)
@@ -121,10 +215,13 @@ def tts(
         temperature=req.temperature,
         tokens_used=tokens_used,
         latency_ms=latency_ms,
+        chars=len(text),
         status="ok",
         error=None,
         created_at=now_utc(),
         audio_path=final_path if req.store else None,
+        audio_sha256=sha256_file(final_path) if req.store else None,
+        audio_bytes=os.path.getsize(final_path) if req.store else None,
         input_text=text if req.store else None,
     )
     session.add(gen)
@@ -134,17 +231,86 @@ def tts(
     session.commit()
     session.refresh(gen)
 
-    # Update single latency baseline for batch calibration
-    update_single_latency_per_char(session, settings, chars=len(text), latency_ms=latency_ms)
+    # Update single latency baseline for batch calibration (OOM retries would skew it)
+    if not mem.ooms:
+        calibrator.observe_single(settings, chars=len(text), latency_ms=latency_ms)
 
     # Return audio + metadata headers
     headers = {
         "X-Generation-Id": str(gen.id),
         "X-Tokens-Used": str(tokens_used),
         "X-Latency-Ms": str(latency_ms),
+        **output_headers(opts, sr),
     }
-    media_type = {"wav": "audio/wav", "mp3": "audio/mpeg", "ogg": "audio/ogg"}[req.format]
-    return FileResponse(final_path, media_type=media_type, filename=f"tts.{req.format}", headers=headers)
+    if mem.peak_mb is not None:
+        headers["X-Peak-Memory-Mb"] = str(mem.peak_mb)
+    headers["Content-Disposition"] = f'attachment; filename="tts.{req.format}"'
+    body = Path(final_path).read_bytes()
+    if not req.store:
+        # Unstored outputs only exist to be sent
+        Path(final_path).unlink(missing_ok=True)
+    return StoredResponse(body, OUTPUT_MEDIA_TYPES[req.format], headers)
+
+
+def _tts_from_library(
+    req: TTSRequest,
+    session: Session,
+    settings: Settings,
+    user,
+    v: Voice,
+    text: str,
+    language: str,
+    opts: OutputOptions,
+    phrase: Phrase,
+    rendition: PhraseRendition,
+) -> Optional[StoredResponse]:
+    """Serves /tts from the voice's pre-rendered phrase (no model call); None if its file is gone."""
+    t0 = time.perf_counter()
+    try:
+        body = Path(rendition.path).read_bytes()
+    except OSError:
+        return None
+    final_path = write_output_bytes(settings, "gens", user.id, body, req.format) if req.store else None
+    latency_ms = int((time.perf_counter() - t0) * 1000)
+
+    tokens_used = tokens_for_text(text)
+    gen = Generation(
+        user_id=user.id,
+        voice_id=v.id,
+        batch_id=None,
+        phrase_id=phrase.id,
+        store=req.store,
+        requested_format=req.format,
+        language=language,
+        temperature=req.temperature,
+        tokens_used=tokens_used,
+        latency_ms=latency_ms,
+        chars=len(text),
+        status="ok",
+        error=None,
+        created_at=now_utc(),
+        audio_path=final_path,
+        audio_sha256=sha256_file(final_path) if req.store else None,
+        audio_bytes=len(body) if req.store else None,
+        input_text=text if req.store else None,
+    )
+    session.add(gen)
+    phrase.hit_count += 1
+    session.add(phrase)
+    v.use_count += 1
+    session.add(v)
+    session.commit()
+    session.refresh(gen)
+
+    headers = {
+        "X-Generation-Id": str(gen.id),
+        "X-Tokens-Used": str(tokens_used),
+        "X-Latency-Ms": str(latency_ms),
+        "X-Phrase-Id": str(phrase.id),
+        **output_headers(opts, rendition.out_sample_rate),
+        "Content-Disposition": f'attachment; filename="tts.{req.format}"',
+    }
+    return StoredResponse(body, OUTPUT_MEDIA_TYPES[req.format], headers)
 
 
 @router.post("/batchtts")
@@ -153,7 +319,17 @@ def batchtts(
     session: Session = Depends(get_session),
     settings: Settings = Depends(get_settings),
     user=Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(default=None),
 ):
+    """
+    Items are strings or {"text", "voice_id", "language", "temperature"}
+    objects; unset fields default to the request's. Items with different
+    voices/languages share model calls (one call per distinct temperature).
+    """
+    return run_idempotent(settings, user.id, "/batchtts", req, idempotency_key, lambda: _batchtts(req, session, settings, user))
+
+
+def _batchtts(req: TTSRequest, session: Session, settings: Settings, user) -> StoredResponse:
     if isinstance(req.text, str):
         raise HTTPException(status_code=400, detail="Batch TTS endpoint expects a list of text strings, not a single string")
     if len(req.text) < settings.min_batch_size:
@@ -161,50 +337,90 @@ def batchtts(
     if len(req.text) > settings.max_batch_size:
         raise HTTPException(status_code=400, detail=f"Batch too large (max {settings.max_batch_size})")
 
-    texts = preprocess_text_batch(req.text, settings)
-
-    ensure_supported_output(req.format)
-
-    v = session.exec(select(Voice).where(Voice.id == req.voice_id, Voice.user_id == user.id, Voice.deleted_at.is_(None))).first()
-    if not v:
-        raise HTTPException(status_code=404, detail="Voice not found")
-    if v.id is None:
-        raise HTTPException(status_code=500, detail="Voice has no ID (DB error)")
-    if model_registry.base is None:
+    default_language = (req.language or "auto").strip() or "auto"
+    voice_ids: list[int] = []
+    languages: list[str] = []
+    temperatures: list[float] = []
+    for i, it in enumerate(req.text):
+        item = it if isinstance(it, BatchItem) else BatchItem(text=it)
+        voice_id = item.voice_id if item.voice_id is not None else req.voice_id
+        if voice_id is None:
+            raise HTTPException(status_code=400, detail=f"Item {i} has no voice_id (and the request sets none)")
+        voice_ids.append(voice_id)
+        languages.append((item.language or "").strip() or default_language)
+        temperatures.append(item.temperature if item.temperature is not None else req.temperature)
+    texts = preprocess_text_batch(batch_item_texts(req.text), settings, languages, req.expand_numbers)
+
+    # Identical (normalized) items are generated once and fanned out to every position
+    unique, slots = dedupe(list(zip(texts, voice_ids, languages, temperatures)))
+    unique_texts = [texts[i] for i in unique]
+
+    opts = output_options(req)
+
+    voices = {
+        v.id: v
+        for v in session.exec(
+            select(Voice).where(Voice.id.in_(set(voice_ids)), Voice.user_id == user.id, Voice.deleted_at.is_(None))
+        ).all()
+    }
+    missing = sorted(set(voice_ids) - voices.keys())
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Voice not found: {', '.join(map(str, missing))}")
+    if not inference.ready():
         raise HTTPException(status_code=503, detail="Model not loaded")
 
-    prompt = model_registry.load_prompt(v.prompt_blob)
-    language = (req.language or "auto").strip() or "auto"
+    admit_or_reject(cost_estimator.predict(settings, [len(t) for t in unique_texts], default_language, req.format), settings)
 
-    # Current discount, then update after observing batch latency
-    discount_before = get_batch_discount(session, settings)
+    # Prompts and languages are per item in a model call; temperature is per call
+    groups: dict[float, list[int]] = {}
+    for i in unique:
+        groups.setdefault(temperatures[i], []).append(i)
 
+    # Split into sub-batches that fit in GPU memory by the inference backend (halved again on OOM)
     t0 = time.perf_counter()
-    out_wavs, sr = model_registry.base.generate_voice_clone(
-        text=texts,                     # batch list supported by Qwen3-TTS
-        language=[language] * len(texts),
-        voice_clone_prompt=[prompt],
-        temperature=req.temperature,
-    )
+    out_wavs: dict[int, object] = {}
+    mem = CallStats()
+    sr = None
+    for temperature, idx in groups.items():
+        group_voices = {voice_ids[i] for i in idx}
+        wavs, sr, stats = inference.synthesize_items(
+            settings,
+            {vid: voices[vid].prompt_blob for vid in group_voices},
+            [voice_ids[i] for i in idx],
+            [texts[i] for i in idx],
+            [languages[i] for i in idx],
+            temperature,
+        )
+        if len(wavs) != len(idx):
+            raise HTTPException(status_code=500, detail="Batch generation returned unexpected output shape")
+        for i, wav in zip(idx, wavs):
+            out_wavs[i] = wav
+        mem = mem.add(stats)
     latency_ms_total = int((time.perf_counter() - t0) * 1000)
-    cuda.empty_cache()
 
     # Update discount based on observed efficiency vs rolling single baseline
-    total_chars = sum(len(t) for t in texts)
-    discount_after = update_batch_discount_from_observation(session, settings, total_chars, latency_ms_total)
+    # (only when the batch ran as one call; split batches measure something else).
+    # Calibration, cost-model rows and tokens count the generated (unique) items.
+    total_chars = sum(len(t) for t in unique_texts)
+    if mem.sub_batches == 1 and not mem.ooms:
+        discount_after = calibrator.observe_batch(settings, len(unique), total_chars, latency_ms_total)
+    else:
+        discount_after = calibrator.discount(settings, len(unique), total_chars / len(unique))
     discount_after = round(discount_after, 3)
-    tokens_used = tokens_for_batch(texts, discount_after)
+    tokens_used = tokens_for_batch(unique_texts, discount_after)
 
-    # Create batch row
+    # Create batch row (voice_id = first item's voice; each generation records its own)
     batch = Batch(
         user_id=user.id,
-        voice_id=v.id,
+        voice_id=voice_ids[0],
         requested_format=req.format,
-        language=language,
+        language=default_language,
         store=req.store,
         tokens_used=tokens_used,
         batch_discount_used=discount_after,
         latency_ms_total=latency_ms_total,
+        total_chars=total_chars,
+        item_count=len(unique),
         status="ok",
         error=None,
         created_at=now_utc(),
@@ -214,42 +430,34 @@ def batchtts(
     session.refresh(batch)
 
     # Write outputs and generations (generations.tokens_used = 0 for batch items)
-    out_dir = settings.media_dir / "batches" / str(user.id) / str(batch.id)
-    out_dir.mkdir(parents=True, exist_ok=True)
-
     gen_ids: list[int] = []
     file_paths: list[str] = []
 
-    # out_wavs expected list
-    if not isinstance(out_wavs, list) or len(out_wavs) != len(texts):
-        raise HTTPException(status_code=500, detail="Batch generation returned unexpected output shape")
-
-    for i, wav in enumerate(out_wavs):
-        tmp_wav = str(out_dir / f"{i}.wav")
-        sf.write(tmp_wav, wav, sr)
-
-        final_path = tmp_wav
-        if req.format != "wav":
-            final_path = str(out_dir / f"{i}.{req.format}")
-            convert_audio(tmp_wav, final_path)
-            try:
-                Path(tmp_wav).unlink(missing_ok=True)
-            except Exception:
-                pass
+    encoded: dict[int, bytes] = {}
+    for i, slot in enumerate(slots):
+        u = unique[slot]
+        if u not in encoded:
+            encoded[u], _ = encode_audio(out_wavs[u], sr, opts)
+        # Duplicates get their own file: stored generations expire independently
+        final_path = write_output_bytes(settings, "batches", user.id, encoded[u], req.format)
 
         g = Generation(
             user_id=user.id,
-            voice_id=v.id,
+            voice_id=voice_ids[i],
             batch_id=batch.id,
             store=req.store,
             requested_format=req.format,
-            language=language,
+            language=languages[i],
+            temperature=temperatures[i],
             tokens_used=0,  # per your requirement
             latency_ms=0,   # you could store per-item if you time it; otherwise keep 0
+            chars=len(texts[i]),
             status="ok",
             error=None,
             created_at=now_utc(),
             audio_path=final_path if req.store else None,
+            audio_sha256=sha256_file(final_path) if req.store else None,
+            audio_bytes=os.path.getsize(final_path) if req.store else None,
             input_text=texts[i] if req.store else None,
         )
         session.add(g)
@@ -258,8 +466,10 @@ def batchtts(
         gen_ids.append(g.id)
         file_paths.append(final_path)
 
-    v.use_count += len(texts)
-    session.add(v)
+    per_voice = Counter(voice_ids)
+    for vid, n in per_voice.items():
+        voices[vid].use_count += n
+        session.add(voices[vid])
     session.commit()
 
     # Create zip in memory for response
@@ -271,21 +481,36 @@ def batchtts(
         manifest = {
             "batch_id": batch.id,
             "generation_ids": gen_ids,
+            "voice_ids": voice_ids,
             "format": req.format,
-            "language": language,
+            "sample_rate": opts.sample_rate or sr,
+            "channels": opts.channels,
+            "language": default_language,
             "tokens_used": tokens_used,
             "batch_discount_used": discount_after,
             "latency_ms_total": latency_ms_total,
             "store": req.store,
+            "voices": voice_usage(texts, voice_ids, tokens_used),
+            "items": len(texts),
+            "deduped": len(texts) - len(unique),
+            "model_calls": len(groups),
+            "gpu": mem.to_dict(),
         }
         import json
         z.writestr("manifest.json", json.dumps(manifest, indent=2))
 
-    buf.seek(0)
+    if not req.store:
+        # Everything is in the zip buffer now
+        for fp in file_paths:
+            Path(fp).unlink(missing_ok=True)
+
     headers = {
         "X-Batch-Id": str(batch.id),
         "X-Tokens-Used": str(tokens_used),
         "X-Batch-Discount-Used": str(discount_after),
         "X-Latency-Ms-Total": str(latency_ms_total),
+        **output_headers(opts, sr),
     }
-    return StreamingResponse(buf, media_type="application/zip", headers=headers)
\ No newline at end of file
+    if mem.peak_mb is not None:
+        headers["X-Peak-Memory-Mb"] = str(mem.peak_mb)
+    return StoredResponse(buf.getvalue(), "application/zip", headers)
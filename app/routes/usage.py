@@ -8,6 +8,7 @@ from sqlmodel import Session, select, func
 from app.core.auth import get_current_user
 from app.core.db import get_session
 from app.core.models import Voice, Generation, Batch
+from app.services.phrases import library_stats
 
 router = APIRouter()
 
@@ -49,4 +50,5 @@ def usage(
         "voices_created": int(voices_created),
         "tts_calls": int(tts_calls),
         "batch_calls": int(batch_calls),
+        "phrase_library": library_stats(session, user.id),
     }
\ No newline at end of file
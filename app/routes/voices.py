@@ -1,25 +1,37 @@
 # app/routes/voices.py
 from __future__ import annotations
 
+import io
 import os
 from pathlib import Path
 from typing import Optional
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
-from fastapi.responses import FileResponse
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel, Field
 from sqlmodel import Session, select
 import soundfile as sf
-from qwen_tts import VoiceClonePromptItem
 
 from app.core.auth import get_current_user, get_settings
 from app.core.config import Settings
 from app.core.db import get_session
-from app.core.models import AudioFile, Voice
+from app.core.models import AudioFile, Phrase, Voice
 from app.core.security import now_utc
-from app.services.audio_store import sniff_ext, write_dedup_audio
-from app.services.tokens import tokens_for_text
-from app.services.qwen_models import model_registry
+from app.routes.stored import serve_audio
+from app.services.audio_store import (
+    UploadTooLarge,
+    normalization_tag,
+    normalize_references,
+    normalized_reference_path,
+    sniff_ext,
+    stream_dedup_upload,
+    write_dedup_audio,
+)
+from app.services.inference import inference
+from app.services.prompt_cache import prompt_cache_key, get_cached_prompt, put_cached_prompt
+from app.services.pagination import before_cursor, encode_cursor
+from app.services.phrases import delete_phrases
+from app.services.tokens import tokens_for_text, tokens_for_design
 
 router = APIRouter()
 
@@ -30,6 +42,10 @@ class DesignVoiceRequest(BaseModel):
     language: Optional[str] = Field(default="auto")
 
 
+class DesignVoicesRequest(BaseModel):
+    items: list[DesignVoiceRequest] = Field(..., min_length=1)
+
+
 class VoiceOut(BaseModel):
     voice_id: int
     name: str
@@ -57,6 +73,184 @@ STANDARD_EN_REFERENCE_SCRIPT = (
 )
 
 
+def _get_or_create_audio(session: Session, sha: str, path: str, fmt: str) -> AudioFile:
+    audio = session.exec(select(AudioFile).where(AudioFile.sha256 == sha)).first()
+    if audio is None:
+        audio = AudioFile(sha256=sha, path=path, fmt=fmt, created_at=now_utc())
+        session.add(audio)
+        session.commit()
+        session.refresh(audio)
+    if audio.id is None:
+        raise HTTPException(status_code=500, detail="ID missing")
+    return audio
+
+
+def _store_designed_audio(session: Session, settings: Settings, wav, sr: int) -> AudioFile:
+    # Encode in memory so concurrent designs never share a temp path
+    buf = io.BytesIO()
+    sf.write(buf, wav, sr, format="WAV")
+    sha, path = write_dedup_audio(settings, buf.getvalue(), "wav")
+    return _get_or_create_audio(session, sha, path, "wav")
+
+
+def _create_voice(
+    session: Session,
+    user_id: int,
+    name: str,
+    audio: AudioFile,
+    ref_text: str,
+    language: str,
+    prompt_blob: bytes,
+    description: Optional[str] = None,
+) -> Voice:
+    voice = Voice(
+        user_id=user_id,
+        name=name,
+        ref_audio_file_id=audio.id,
+        ref_text=ref_text,
+        voice_description=description,
+        language=language,
+        prompt_blob=prompt_blob,
+        created_at=now_utc(),
+        deleted_at=None,
+        use_count=0,
+    )
+    session.add(voice)
+    session.commit()
+    session.refresh(voice)
+    return voice
+
+
+def _run_chunked(fn, items: list, chunk_size: int) -> list:
+    """
+    Runs fn over items in chunks of chunk_size (one model call per chunk).
+    If a batched call fails, the chunk is retried item by item so one bad
+    input only fails itself. Returns one (result, error) pair per item.
+    """
+    results: list = []
+    for start in range(0, len(items), max(1, chunk_size)):
+        chunk = items[start:start + chunk_size]
+        try:
+            out = fn(chunk)
+            if len(out) != len(chunk):
+                raise RuntimeError("Model returned unexpected output shape")
+            results.extend((o, None) for o in out)
+        except Exception as e:
+            if len(chunk) == 1:
+                results.append((None, str(e) or e.__class__.__name__))
+                continue
+            for item in chunk:
+                try:
+                    results.append((fn([item])[0], None))
+                except Exception as e:
+                    results.append((None, str(e) or e.__class__.__name__))
+    return results
+
+
+def _extract_prompts(
+    session: Session,
+    settings: Settings,
+    refs: list[tuple[AudioFile, str]],
+) -> list[tuple[Optional[bytes], Optional[str], bool]]:
+    """
+    Resolves a prompt blob for each (reference audio, ref text) pair.
+    Pairs already derived under the current model revision come from the
+    prompt cache without a GPU pass; the rest are normalized in the audio
+    worker pool and extracted in batched calls.
+    Returns one (prompt_blob, error, cache_hit) triple per pair.
+    """
+    revision = f"{inference.base_revision()}:{normalization_tag(settings)}"
+    keys = [prompt_cache_key(audio.sha256, ref_text, False, revision) for audio, ref_text in refs]
+    out: list[tuple[Optional[bytes], Optional[str], bool]] = []
+    misses: list[int] = []
+    for i, key in enumerate(keys):
+        blob = get_cached_prompt(session, key)
+        out.append((blob, None, blob is not None))
+        if blob is None:
+            misses.append(i)
+
+    ref_paths: dict[int, str] = {}
+    normalized = normalize_references(settings, [(refs[i][0].sha256, refs[i][0].path) for i in misses])
+    for i, (path, error) in zip(misses, normalized):
+        if path is None:
+            out[i] = (None, error, False)
+        else:
+            ref_paths[i] = path
+    misses = [i for i in misses if i in ref_paths]
+
+    def extract(chunk: list[int]) -> list[bytes]:
+        return inference.extract_prompts(settings, [ref_paths[i] for i in chunk], [refs[i][1] for i in chunk])
+
+    for i, (blob, error) in zip(misses, _run_chunked(extract, misses, settings.voice_batch_chunk_size)):
+        if error is not None:
+            out[i] = (None, error, False)
+            continue
+        put_cached_prompt(session, keys[i], refs[i][0].sha256, False, revision, blob)
+        out[i] = (blob, None, False)
+    return out
+
+
+def _clone_uploaded(
+    session: Session, settings: Settings, user_id: int, name: str, transcript: str, language: str, sha: str, path: str, ext: str
+) -> dict:
+    audio = _get_or_create_audio(session, sha, path, ext)
+
+    # Compute prompt blob now (costs tokens), unless this audio + transcript was derived before
+    if not inference.ready():
+        raise HTTPException(status_code=503, detail="Model not loaded")
+
+    [(prompt_blob, error, cache_hit)] = _extract_prompts(session, settings, [(audio, transcript)])
+    if prompt_blob is None:
+        raise HTTPException(status_code=500, detail=f"Prompt extraction failed: {error}")
+
+    voice = _create_voice(session, user_id, name, audio, transcript, language, prompt_blob)
+
+    tokens_used = tokens_for_text(transcript)
+    return {"voice_id": voice.id, "tokens_used": tokens_used, "prompt_cache_hit": cache_hit}
+
+
+def _clone_uploaded_batch(
+    session: Session,
+    settings: Settings,
+    user_id: int,
+    names: list[str],
+    languages: Optional[list[str]],
+    uploaded: list[tuple[int, str, str, str, str]],
+    results: list[dict],
+) -> dict:
+    n = len(results)
+    pending = [(i, _get_or_create_audio(session, sha, path, ext), transcript) for i, sha, path, ext, transcript in uploaded]
+
+    tokens_total = 0
+    cache_hits = 0
+    extracted = _extract_prompts(session, settings, [(audio, transcript) for _, audio, transcript in pending])
+    for (i, audio, transcript), (prompt_blob, error, cache_hit) in zip(pending, extracted):
+        if prompt_blob is None:
+            results[i]["error"] = error
+            continue
+        language = ((languages[i] if languages else "") or "auto").strip() or "auto"
+        voice = _create_voice(session, user_id, names[i].strip(), audio, transcript, language, prompt_blob)
+        tokens_used = tokens_for_text(transcript)
+        tokens_total += tokens_used
+        cache_hits += int(cache_hit)
+        results[i] = {
+            "index": i,
+            "status": "ok",
+            "voice_id": voice.id,
+            "tokens_used": tokens_used,
+            "prompt_cache_hit": cache_hit,
+        }
+
+    created = sum(1 for r in results if r["status"] == "ok")
+    return {
+        "results": results,
+        "created": created,
+        "failed": n - created,
+        "tokens_used": tokens_total,
+        "prompt_cache_hits": cache_hits,
+    }
+
+
 @router.post("/clonevoice")
 async def clonevoice(
     name: str = Form(...),
@@ -74,50 +268,62 @@ async def clonevoice(
         raise HTTPException(status_code=400, detail="Name must not be empty")
 
     ext = sniff_ext(file.filename or "")
-    raw = await file.read()
-    if not raw:
-        raise HTTPException(status_code=400, detail="Empty file upload")
 
-    # Dedup audio
-    sha, path = write_dedup_audio(settings, raw, ext)
-    audio = session.exec(select(AudioFile).where(AudioFile.sha256 == sha)).first()
-    if audio is None:
-        audio = AudioFile(sha256=sha, path=path, fmt=ext, created_at=now_utc())
-        session.add(audio)
-        session.commit()
-        session.refresh(audio)
-    if audio.id is None:
-        raise HTTPException(status_code=500, detail="ID missing")
+    # Stream to disk while hashing (dedup by sha256)
+    try:
+        sha, path = await stream_dedup_upload(settings, file, ext)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Only the upload is async; DB and model work must not block the event loop
+    return await run_in_threadpool(
+        _clone_uploaded, session, settings, user.id, name.strip(), transcript, language or "auto", sha, path, ext
+    )
 
-    # Compute prompt blob now (costs tokens)
-    if model_registry.base is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
 
-    prompt_obj: list[VoiceClonePromptItem] = model_registry.base.create_voice_clone_prompt(
-        ref_audio=audio.path,
-        ref_text=transcript,
-        x_vector_only_mode=False,
-    )
-    prompt_blob = model_registry.dump_prompt(prompt_obj[0])
+@router.post("/clonevoices")
+async def clonevoices(
+    names: list[str] = Form(...),
+    transcripts: list[str] = Form(...),
+    languages: Optional[list[str]] = Form(None),
+    files: list[UploadFile] = File(...),
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    """
+    Batch variant of /clonevoice. Item i is (names[i], transcripts[i], files[i], languages[i]).
+    Prompt extraction runs as batched model calls; failures are reported per item.
+    """
+    n = len(files)
+    if len(names) != n or len(transcripts) != n or (languages and len(languages) != n):
+        raise HTTPException(status_code=400, detail="names, transcripts, files (and languages if given) must have equal length")
+    if n > settings.max_voice_batch_size:
+        raise HTTPException(status_code=400, detail=f"Too many voices (max {settings.max_voice_batch_size})")
+    if not await run_in_threadpool(inference.ready):
+        raise HTTPException(status_code=503, detail="Model not loaded")
 
-    voice = Voice(
-        user_id=user.id,
-        name=name.strip(),
-        ref_audio_file_id=audio.id,
-        ref_text=transcript,
-        voice_description=None,
-        language=(language or "auto"),
-        prompt_blob=prompt_blob,
-        created_at=now_utc(),
-        deleted_at=None,
-        use_count=0,
-    )
-    session.add(voice)
-    session.commit()
-    session.refresh(voice)
+    results: list[dict] = [{"index": i, "status": "error", "error": None} for i in range(n)]
+    uploaded: list[tuple[int, str, str, str, str]] = []  # (index, sha, path, ext, transcript)
+
+    for i in range(n):
+        transcript = transcripts[i].strip()
+        if not transcript:
+            results[i]["error"] = "Transcript must not be empty"
+            continue
+        if not names[i].strip():
+            results[i]["error"] = "Name must not be empty"
+            continue
+        ext = sniff_ext(files[i].filename or "")
+        try:
+            sha, path = await stream_dedup_upload(settings, files[i], ext)
+        except ValueError as e:
+            results[i]["error"] = str(e)
+            continue
+        uploaded.append((i, sha, path, ext, transcript))
 
-    tokens_used = tokens_for_text(transcript)
-    return {"voice_id": voice.id, "tokens_used": tokens_used}
+    return await run_in_threadpool(_clone_uploaded_batch, session, settings, user.id, names, languages, uploaded, results)
 
 
 @router.post("/designvoice")
@@ -127,91 +333,126 @@ def designvoice(
     settings: Settings = Depends(get_settings),
     user=Depends(get_current_user),
 ):
-    if model_registry.voice_design is None or model_registry.base is None:
+    if not inference.ready(design=True):
         raise HTTPException(status_code=503, detail="Models not loaded")
 
     language = (req.language or "auto").strip() or "auto"
 
-    # 1) Generate reference audio with VoiceDesign model
-    # Qwen3-TTS supports batch lists, but here it's single.
-    out_wavs, sr = model_registry.voice_design.generate_voice_design(
-        text=STANDARD_EN_REFERENCE_SCRIPT,
-        language=language,
-        instruct=req.description,
-    )
-
-    # Store reference wav
-    out_dir = settings.media_dir / "voices" / str(user.id)
-    out_dir.mkdir(parents=True, exist_ok=True)
-    ref_wav_path = str(out_dir / f"designed_{int(now_utc().timestamp())}.wav")
-    audio = out_wavs[0]
-    sf.write(ref_wav_path, audio, sr)
-
-    # Add to audio_files with sha256 dedup
-    raw = Path(ref_wav_path).read_bytes()
-    sha, dedup_path = write_dedup_audio(settings, raw, "wav")
-    if dedup_path != ref_wav_path:
-        # If dedup created a different canonical path, remove temp and use canonical
-        try:
-            Path(ref_wav_path).unlink(missing_ok=True)
-        except Exception:
-            pass
-        ref_wav_path = dedup_path
+    # 1) Generate reference audio with VoiceDesign model (see /designvoices for batching)
+    out_wavs, sr = inference.design(settings, [STANDARD_EN_REFERENCE_SCRIPT], [language], [req.description])
 
-    audio = session.exec(select(AudioFile).where(AudioFile.sha256 == sha)).first()
-    if audio is None:
-        audio = AudioFile(sha256=sha, path=ref_wav_path, fmt="wav", created_at=now_utc())
-        session.add(audio)
-        session.commit()
-        session.refresh(audio)
-    if audio.id is None:
-        raise HTTPException(status_code=500, detail="ID missing")
+    # Store reference wav (sha256 dedup into audio_files)
+    audio = _store_designed_audio(session, settings, out_wavs[0], sr)
 
     # 2) Compute clone prompt blob from the reference audio + reference text
-    prompt_obj: list[VoiceClonePromptItem] = model_registry.base.create_voice_clone_prompt(
-        ref_audio=audio.path,
-        ref_text=STANDARD_EN_REFERENCE_SCRIPT,
-        x_vector_only_mode=False,
-    )
-    prompt_blob = model_registry.dump_prompt(prompt_obj[0])
+    [(prompt_blob, error, _)] = _extract_prompts(session, settings, [(audio, STANDARD_EN_REFERENCE_SCRIPT)])
+    if prompt_blob is None:
+        raise HTTPException(status_code=500, detail=f"Prompt extraction failed: {error}")
 
-    voice = Voice(
-        user_id=user.id,
-        name=req.name.strip(),
-        ref_audio_file_id=audio.id,
-        ref_text=STANDARD_EN_REFERENCE_SCRIPT,
-        voice_description=req.description,
-        language=language,
-        prompt_blob=prompt_blob,
-        created_at=now_utc(),
-        deleted_at=None,
-        use_count=0,
+    voice = _create_voice(
+        session, user.id, req.name.strip(), audio, STANDARD_EN_REFERENCE_SCRIPT, language, prompt_blob,
+        description=req.description,
     )
-    session.add(voice)
-    session.commit()
-    session.refresh(voice)
 
-    tokens_used = len(req.description) + len(STANDARD_EN_REFERENCE_SCRIPT)
+    tokens_used = tokens_for_design(req.description, STANDARD_EN_REFERENCE_SCRIPT)
     return {"voice_id": voice.id, "tokens_used": tokens_used}
 
 
+@router.post("/designvoices")
+def designvoices(
+    req: DesignVoicesRequest,
+    session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
+    user=Depends(get_current_user),
+):
+    """
+    Batch variant of /designvoice. Design generation and prompt extraction
+    both run as batched model calls; failures are reported per item.
+    """
+    n = len(req.items)
+    if n > settings.max_voice_batch_size:
+        raise HTTPException(status_code=400, detail=f"Too many voices (max {settings.max_voice_batch_size})")
+    if not inference.ready(design=True):
+        raise HTTPException(status_code=503, detail="Models not loaded")
+
+    results: list[dict] = [{"index": i, "status": "error", "error": None} for i in range(n)]
+    items = [(i, it, (it.language or "auto").strip() or "auto") for i, it in enumerate(req.items)]
+
+    def design(chunk: list) -> list:
+        out_wavs, sr = inference.design(
+            settings,
+            [STANDARD_EN_REFERENCE_SCRIPT] * len(chunk),
+            [language for _, _, language in chunk],
+            [it.description for _, it, _ in chunk],
+        )
+        return [(wav, sr) for wav in out_wavs]
+
+    designed: list[tuple[int, DesignVoiceRequest, str, AudioFile]] = []
+    for (i, it, language), (out, error) in zip(items, _run_chunked(design, items, settings.voice_batch_chunk_size)):
+        if error is not None:
+            results[i]["error"] = error
+            continue
+        designed.append((i, it, language, _store_designed_audio(session, settings, *out)))
+
+    tokens_total = 0
+    extracted = _extract_prompts(session, settings, [(audio, STANDARD_EN_REFERENCE_SCRIPT) for *_, audio in designed])
+    for (i, it, language, audio), (prompt_blob, error, _) in zip(designed, extracted):
+        if prompt_blob is None:
+            results[i]["error"] = error
+            continue
+        voice = _create_voice(
+            session, user.id, it.name.strip(), audio, STANDARD_EN_REFERENCE_SCRIPT, language, prompt_blob,
+            description=it.description,
+        )
+        tokens_used = tokens_for_design(it.description, STANDARD_EN_REFERENCE_SCRIPT)
+        tokens_total += tokens_used
+        results[i] = {"index": i, "status": "ok", "voice_id": voice.id, "tokens_used": tokens_used}
+
+    created = sum(1 for r in results if r["status"] == "ok")
+    return {"results": results, "created": created, "failed": n - created, "tokens_used": tokens_total}
+
+
 @router.get("/voices", response_model=list[VoiceOut])
 def list_voices(
+    response: Response,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    name: Optional[str] = None,
+    language: Optional[str] = None,
     session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
     user=Depends(get_current_user),
 ):
-    voices = session.exec(
-        select(Voice).where(Voice.user_id == user.id, Voice.deleted_at.is_(None)).order_by(Voice.created_at.desc())
-    ).all()
+    """
+    Newest first. Pass the X-Next-Cursor response header back as `cursor`
+    for the next page; `name` is a prefix filter, `language` exact.
+    """
+    limit = max(1, min(limit or settings.page_size_default, settings.page_size_max))
+    q = select(Voice.id, Voice.name, Voice.created_at, Voice.use_count, Voice.language).where(
+        Voice.user_id == user.id, Voice.deleted_at.is_(None)
+    )
+    if name:
+        q = q.where(Voice.name.startswith(name, autoescape=True))
+    if language:
+        q = q.where(Voice.language == language)
+    if cursor:
+        try:
+            q = q.where(before_cursor(Voice.created_at, Voice.id, cursor))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    rows = session.exec(q.order_by(Voice.created_at.desc(), Voice.id.desc()).limit(limit)).all()
+
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(rows[-1].created_at, rows[-1].id)
     return [
         VoiceOut(
-            voice_id=v.id,
-            name=v.name,
-            created_at=v.created_at.isoformat(),
-            use_count=v.use_count,
-            language=v.language or "auto",
+            voice_id=r.id,
+            name=r.name,
+            created_at=r.created_at.isoformat(),
+            use_count=r.use_count,
+            language=r.language or "auto",
         )
-        for v in voices
+        for r in rows
     ]
 
 
@@ -238,16 +479,33 @@ def get_voice(
 @router.get("/voices/{voice_id}/sample")
 def voice_sample(
     voice_id: int,
+    request: Request,
+    format: Optional[str] = None,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+    bitrate: Optional[int] = None,
+    duration: Optional[float] = None,
     session: Session = Depends(get_session),
+    settings: Settings = Depends(get_settings),
     user=Depends(get_current_user),
 ):
+    """
+    The voice's reference audio as uploaded, or a transcoded preview when any
+    of format / sample_rate / channels / bitrate / duration is given (e.g.
+    `?format=opus&bitrate=24&duration=5`). Previews are cached on first use.
+    """
     v = session.exec(select(Voice).where(Voice.id == voice_id, Voice.user_id == user.id, Voice.deleted_at.is_(None))).first()
     if not v:
         raise HTTPException(status_code=404, detail="Voice not found")
     audio = session.exec(select(AudioFile).where(AudioFile.id == v.ref_audio_file_id)).first()
     if not audio:
         raise HTTPException(status_code=404, detail="Audio file not found")
-    return FileResponse(audio.path, media_type="audio/wav", filename=f"{v.name}_sample.wav")
+    if not Path(audio.path).is_file():
+        raise HTTPException(status_code=410, detail="Reference audio no longer available")
+    return serve_audio(
+        request, settings, audio.path, audio.sha256, audio.fmt, f"{v.name}_sample", {"X-Voice-Id": str(v.id)},
+        format, sample_rate, channels, bitrate, duration,
+    )
 
 
 @router.post("/voices/{voice_id}/delete")
@@ -264,6 +522,8 @@ def delete_voice(
     v.deleted_at = now_utc()
     session.add(v)
     session.commit()
+    inference.invalidate(v.id)
+    delete_phrases(session, session.exec(select(Phrase).where(Phrase.voice_id == v.id)).all())
 
     # If the audio file is not referenced by ANY non-deleted voice, delete it from disk and db.
     other = session.exec(
@@ -278,6 +538,7 @@ def delete_voice(
         if audio:
             try:
                 Path(audio.path).unlink(missing_ok=True)
+                normalized_reference_path(settings, audio.sha256).unlink(missing_ok=True)
             except Exception:
                 pass
             session.delete(audio)
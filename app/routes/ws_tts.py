@@ -0,0 +1,276 @@
+# app/routes/ws_tts.py
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, WebSocket, WebSocketDisconnect
+from pydantic import BaseModel, ValidationError
+from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+
+from app.core.auth import get_settings, user_for_api_key
+from app.core.config import Settings
+from app.core.db import get_engine
+from app.core.models import Generation, Voice
+from app.core.security import now_utc
+from app.services.drain import drain
+from app.services.encode import OutputOptions, encode_audio
+from app.services.inference import inference
+from app.services.longform import split_complete
+from app.services.tokens import tokens_for_text
+
+router = APIRouter()
+
+WS_FORMATS = ("wav", "pcm", "flac", "opus")  # pcm = raw 16-bit little-endian mono; others: one file per chunk
+
+
+class WsStart(BaseModel):
+    type: str
+    voice_id: int
+    api_key: Optional[str] = None  # or an Authorization: Bearer header on the upgrade request
+    language: str = "auto"
+    temperature: float = 1.0
+    format: str = "wav"
+    sample_rate: Optional[int] = None  # e.g. 8000 for telephony; None = native
+
+
+@dataclass
+class _Session:
+    user_id: int
+    voice_id: int
+    prompt_blob: bytes
+    language: str
+    temperature: float
+    opts: OutputOptions
+    chunks: int = 0
+    chars: int = 0
+    tokens_used: int = 0
+    latency_ms: int = 0
+    send_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+def _open_session(settings: Settings, api_key: str, start: WsStart) -> _Session:
+    with Session(get_engine()) as session:
+        user = user_for_api_key(session, settings, api_key)
+        v = session.exec(select(Voice).where(Voice.id == start.voice_id, Voice.user_id == user.id, Voice.deleted_at.is_(None))).first()
+        if not v:
+            raise HTTPException(status_code=404, detail="Voice not found")
+        if not inference.ready():
+            raise HTTPException(status_code=503, detail="Model not loaded")
+        inference.prefetch(settings, v.id, v.prompt_blob)
+        return _Session(
+            user_id=user.id,
+            voice_id=v.id,
+            prompt_blob=v.prompt_blob,
+            language=(start.language or "auto").strip() or "auto",
+            temperature=start.temperature,
+            opts=OutputOptions(fmt=start.format, sample_rate=start.sample_rate),
+        )
+
+
+def _record_session(sess: _Session, status: str, error: Optional[str]) -> Optional[int]:
+    # One accounting row per session (streamed audio is never stored)
+    if not sess.chunks:
+        return None
+    with Session(get_engine()) as session:
+        gen = Generation(
+            user_id=sess.user_id,
+            voice_id=sess.voice_id,
+            batch_id=None,
+            store=False,
+            requested_format=sess.opts.fmt,
+            language=sess.language,
+            temperature=sess.temperature,
+            tokens_used=sess.tokens_used,
+            latency_ms=sess.latency_ms,
+            chars=None,  # spans many model calls; kept out of cost-model fitting
+            status=status,
+            error=error,
+            created_at=now_utc(),
+        )
+        session.add(gen)
+        v = session.get(Voice, sess.voice_id)
+        if v is not None:
+            v.use_count += 1
+            session.add(v)
+        session.commit()
+        session.refresh(gen)
+        return gen.id
+
+
+async def _send(ws: WebSocket, sess: Optional[_Session], message: dict, payload: Optional[bytes] = None) -> None:
+    # The metadata frame and its binary frame must not interleave with other sends
+    lock = sess.send_lock if sess else asyncio.Lock()
+    async with lock:
+        await ws.send_json(message)
+        if payload is not None:
+            await ws.send_bytes(payload)
+
+
+async def _synthesize(ws: WebSocket, settings: Settings, sess: _Session, queue: "asyncio.Queue[Optional[tuple[int, str, float]]]") -> None:
+    """
+    Consumes flushed text units in order. Units that queued up while the
+    previous call ran are generated together as one batch.
+    """
+    ending = False
+    while not ending:
+        item = await queue.get()
+        if item is None:
+            return
+        batch = [item]
+        while len(batch) < max(1, settings.longform_batch_size):
+            try:
+                nxt = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+            if nxt is None:
+                ending = True
+                break
+            batch.append(nxt)
+
+        texts = [t for _, t, _ in batch]
+        t0 = time.perf_counter()
+        wavs, sr, _ = await run_in_threadpool(
+            inference.synthesize, settings, sess.voice_id, sess.prompt_blob, texts, sess.language, sess.temperature
+        )
+        latency_ms = int((time.perf_counter() - t0) * 1000)
+        sess.latency_ms += latency_ms
+
+        for (seq, text, queued_at), wav in zip(batch, wavs):
+            payload, out_sr = await run_in_threadpool(encode_audio, wav, sr, sess.opts)
+            sess.chunks += 1
+            sess.chars += len(text)
+            sess.tokens_used += tokens_for_text(text)
+            await _send(ws, sess, {
+                "type": "audio",
+                "seq": seq,
+                "text": text,
+                "format": sess.opts.fmt,
+                "sample_rate": out_sr,
+                "bytes": len(payload),
+                "queue_ms": int((t0 - queued_at) * 1000),
+                "latency_ms": latency_ms,
+                "batch_size": len(batch),
+            }, payload)
+
+
+@router.websocket("/ws/tts")
+async def ws_tts(websocket: WebSocket, settings: Settings = Depends(get_settings)):
+    """
+    Incremental-text TTS session. Client -> server JSON messages:
+      {"type": "start", "voice_id": 1, "language": "auto", "format": "wav"|"pcm"|"flac"|"opus",
+       "sample_rate": 16000, "api_key": "..."}
+      {"type": "text", "delta": "partial text"}   (any number)
+      {"type": "flush"}                          (synthesize buffered text now)
+      {"type": "end"}                            (flush, finish, close)
+    Text is synthesized whenever a sentence completes. Server -> client: one
+    "audio" JSON frame (seq, text, timing) followed by a binary frame per
+    chunk, then {"type": "done", ...} with the session's single accounting
+    record. Auth and voice/prompt resolution happen once, at "start".
+    """
+    await websocket.accept()
+    if drain.active(settings):
+        await _send(websocket, None, {
+            "type": "error",
+            "status": 503,
+            "detail": "Server is draining; retry shortly",
+            "retry_after_s": settings.drain_retry_after_s,
+        })
+        await websocket.close(code=1013)  # try again later
+        return
+    with drain.track():
+        await _session(websocket, settings)
+
+
+async def _session(websocket: WebSocket, settings: Settings) -> None:
+    try:
+        start = WsStart.model_validate(await websocket.receive_json())
+        if start.type != "start":
+            raise ValueError("First message must be {\"type\": \"start\", ...}")
+        if start.format not in WS_FORMATS:
+            raise ValueError(f"Unsupported stream format: {start.format}. Supported: {list(WS_FORMATS)}")
+        OutputOptions(fmt=start.format, sample_rate=start.sample_rate).validate()
+        api_key = start.api_key or ""
+        authorization = websocket.headers.get("authorization", "")
+        if not api_key and authorization.lower().startswith("bearer "):
+            api_key = authorization.split(" ", 1)[1].strip()
+        sess = await run_in_threadpool(_open_session, settings, api_key, start)
+    except WebSocketDisconnect:
+        return
+    except (ValidationError, ValueError) as e:
+        await _send(websocket, None, {"type": "error", "status": 400, "detail": str(e)})
+        await websocket.close(code=1008)
+        return
+    except HTTPException as e:
+        await _send(websocket, None, {"type": "error", "status": e.status_code, "detail": e.detail})
+        await websocket.close(code=1008)
+        return
+
+    await _send(websocket, sess, {"type": "ready", "voice_id": sess.voice_id, "format": sess.opts.fmt})
+    queue: "asyncio.Queue[Optional[tuple[int, str, float]]]" = asyncio.Queue()
+    worker = asyncio.create_task(_synthesize(websocket, settings, sess, queue))
+
+    buffer = ""
+    received = 0
+    seq = 0
+
+    def enqueue(units: list[str]) -> None:
+        nonlocal seq
+        for u in units:
+            queue.put_nowait((seq, u, time.perf_counter()))
+            seq += 1
+
+    status, error = "ok", None
+    try:
+        while True:
+            receive = asyncio.ensure_future(websocket.receive_json())
+            done, _ = await asyncio.wait({receive, worker}, return_when=asyncio.FIRST_COMPLETED)
+            if worker in done:
+                receive.cancel()
+                worker.result()  # synthesis failed; re-raise
+                break
+            msg = receive.result()
+            kind = msg.get("type") if isinstance(msg, dict) else None
+            if kind == "text":
+                delta = str(msg.get("delta", ""))
+                received += len(delta)
+                if received > settings.longform_max_chars:
+                    raise ValueError(f"Session text too long (max {settings.longform_max_chars})")
+                units, buffer = split_complete(buffer + delta, settings.longform_segment_chars)
+                enqueue(units)
+            elif kind in ("flush", "end"):
+                enqueue([buffer.strip()] if buffer.strip() else [])
+                buffer = ""
+                if kind == "end":
+                    queue.put_nowait(None)
+                    await worker
+                    break
+            else:
+                await _send(websocket, sess, {"type": "error", "status": 400, "detail": f"Unknown message type: {kind}"})
+    except WebSocketDisconnect:
+        status, error = "error", "client disconnected"
+    except ValueError as e:
+        status, error = "error", str(e)
+        await _send(websocket, sess, {"type": "error", "status": 400, "detail": error})
+    except Exception as e:
+        status, error = "error", str(e) or e.__class__.__name__
+        await _send(websocket, sess, {"type": "error", "status": 500, "detail": error})
+    finally:
+        if not worker.done():
+            worker.cancel()
+
+    # Chunks already delivered are charged even if the session ended early
+    generation_id = await run_in_threadpool(_record_session, sess, status, error)
+    if error != "client disconnected":
+        await _send(websocket, sess, {
+            "type": "done",
+            "generation_id": generation_id,
+            "chunks": sess.chunks,
+            "chars": sess.chars,
+            "tokens_used": sess.tokens_used,
+            "latency_ms": sess.latency_ms,
+        })
+        await websocket.close(code=1000 if status == "ok" else 1011)
@@ -1,16 +1,39 @@
 # app/services/audio_store.py
 from __future__ import annotations
 
+import hashlib
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 
 from app.core.security import sha256_file_bytes
 from app.core.config import Settings
+from app.services.encode import normalize_reference_audio
 
 
 SUPPORTED_UPLOAD_FORMATS = {"wav", "mp3", "ogg"}
-SUPPORTED_OUTPUT_FORMATS = {"wav", "mp3", "ogg"}
+SUPPORTED_OUTPUT_FORMATS = {"wav", "mp3", "ogg", "pcm", "flac", "opus"}
+OUTPUT_MEDIA_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "ogg": "audio/ogg",
+    "pcm": "audio/pcm",  # raw s16le; rate/channels in X-Sample-Rate / X-Channels
+    "flac": "audio/flac",
+    "opus": "audio/ogg; codecs=opus",
+}
+
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+_prep_pool: Optional[ThreadPoolExecutor] = None
+
+
+class UploadTooLarge(ValueError):
+    pass
 
 
 def sniff_ext(filename: str) -> str:
@@ -40,4 +63,94 @@ def write_dedup_audio(settings: Settings, raw: bytes, ext: str) -> Tuple[str, st
     path = out_dir / f"{h}.{ext}"
     if not path.exists():
         path.write_bytes(raw)
-    return h, str(path)
\ No newline at end of file
+    return h, str(path)
+
+
+async def stream_dedup_upload(settings: Settings, upload: UploadFile, ext: str) -> Tuple[str, str]:
+    """
+    Streaming variant of write_dedup_audio for uploads: copies the upload to a
+    temp file in chunks while hashing, rejecting it as soon as it exceeds
+    MAX_UPLOAD_MB, then renames it to media_dir/audio/<sha256>.<ext>.
+    File IO runs in the threadpool so large uploads don't stall the event loop.
+    Returns (sha256, absolute_path).
+    """
+    ensure_supported_upload(ext)
+    max_bytes = settings.max_upload_mb * 1024 * 1024
+    tmp_dir = settings.media_dir / "tmp"
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = tmp_dir / f"upload_{uuid.uuid4().hex}.{ext}"
+
+    h = hashlib.sha256()
+    size = 0
+    try:
+        f = await run_in_threadpool(open, tmp_path, "wb")
+        try:
+            while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"Upload too large (max {settings.max_upload_mb} MB)")
+                await run_in_threadpool(_hash_and_write, h, f, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+        if size == 0:
+            raise ValueError("Empty file upload")
+
+        sha = h.hexdigest()
+        path = settings.media_dir / "audio" / f"{sha}.{ext}"
+        await run_in_threadpool(_keep_upload, tmp_path, path)
+        return sha, str(path)
+    finally:
+        await run_in_threadpool(tmp_path.unlink, missing_ok=True)
+
+
+def _hash_and_write(h, f, chunk: bytes) -> None:
+    h.update(chunk)
+    f.write(chunk)
+
+
+def _keep_upload(tmp_path: Path, path: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if not path.exists():
+        os.replace(tmp_path, path)
+
+
+def normalized_reference_path(settings: Settings, sha: str) -> Path:
+    return settings.media_dir / "audio" / "norm" / f"{sha}.wav"
+
+
+def _normalize_one(settings: Settings, sha: str, src: str) -> str:
+    out = normalized_reference_path(settings, sha)
+    if out.exists():
+        return str(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_name(f"{sha}.{uuid.uuid4().hex}.tmp.wav")
+    try:
+        normalize_reference_audio(src, str(tmp), settings.ref_sample_rate, settings.ref_max_seconds)
+        os.replace(tmp, out)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return str(out)
+
+
+def normalize_references(settings: Settings, refs: list[tuple[str, str]]) -> list[tuple[Optional[str], Optional[str]]]:
+    """
+    Normalizes (sha256, source_path) references in the audio worker pool.
+    Results are cached on disk by sha256. Returns one (normalized_path, error)
+    pair per reference, in order.
+    """
+    global _prep_pool
+    if _prep_pool is None:
+        _prep_pool = ThreadPoolExecutor(max_workers=max(1, settings.audio_workers), thread_name_prefix="audio-prep")
+
+    def run(ref: tuple[str, str]) -> tuple[Optional[str], Optional[str]]:
+        try:
+            return _normalize_one(settings, *ref), None
+        except Exception as e:
+            return None, f"Could not decode reference audio: {e}"
+
+    return list(_prep_pool.map(run, refs))
+
+
+def normalization_tag(settings: Settings) -> str:
+    # Part of the prompt cache revision: prompts depend on how the reference was normalized
+    return f"norm{settings.ref_sample_rate}x{settings.ref_max_seconds:g}"
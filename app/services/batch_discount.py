@@ -1,90 +1,228 @@
 # app/services/batch_discount.py
 from __future__ import annotations
 
-from dataclasses import dataclass
-from datetime import datetime, timezone
+import logging
+import threading
+from typing import Optional
 
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
 
 from app.core.models import RuntimeStat
 from app.core.config import Settings
+from app.core.db import get_engine
 from app.core.security import now_utc
 
+log = logging.getLogger(__name__)
 
 SINGLE_LAT_PER_CHAR_KEY = "single_latency_per_char_ms"
 BATCH_DISCOUNT_KEY = "batch_discount_current"
 
+# Upper bounds; the last bucket is open-ended
+BATCH_SIZE_BUCKETS = (1, 4, 8, 16, 32)
+ITEM_CHARS_BUCKETS = (50, 200, 800)
 
-def _get_float(session: Session, key: str, default: float) -> float:
-    row = session.exec(select(RuntimeStat).where(RuntimeStat.key == key)).first()
-    if not row:
-        return default
-    try:
-        return float(row.value)
-    except Exception:
-        return default
-
-
-def _set_float(session: Session, key: str, value: float) -> None:
-    row = session.exec(select(RuntimeStat).where(RuntimeStat.key == key)).first()
-    if not row:
-        row = RuntimeStat(key=key, value=str(value), updated_at=now_utc())
-        session.add(row)
-    else:
-        row.value = str(value)
-        row.updated_at = now_utc()
-    session.commit()
-
-
-def get_batch_discount(session: Session, settings: Settings) -> float:
-    raw_discount = _get_float(session, BATCH_DISCOUNT_KEY, settings.batch_discount_default)
-    return round(raw_discount, 5)
-
-
-def update_single_latency_per_char(session: Session, settings: Settings, chars: int, latency_ms: int) -> None:
-    if chars <= 0:
-        return
-    observed = latency_ms / float(chars)
-    current = _get_float(session, SINGLE_LAT_PER_CHAR_KEY, default=observed)
-    alpha = settings.batch_discount_ewma_alpha
-    new_val = (1 - alpha) * current + alpha * observed
-    _set_float(session, SINGLE_LAT_PER_CHAR_KEY, new_val)
-
-
-def update_batch_discount_from_observation(
-    session: Session,
-    settings: Settings,
-    total_chars: int,
-    batch_latency_ms: int,
-) -> float:
-    """
-    We infer batch efficiency using the rolling single-latency-per-char baseline:
-      expected = single_lat_ms_per_char * total_chars
-      efficiency = batch_latency_ms / expected
-    If batching is faster, efficiency < 1.0 => discount < 1.0
+CAS_RETRIES = 5
+
+
+def _bucket(value: float, bounds: tuple[int, ...]) -> str:
+    for b in bounds:
+        if value <= b:
+            return f"le{b}"
+    return f"gt{bounds[-1]}"
+
+
+def single_key(avg_chars: float) -> str:
+    return f"{SINGLE_LAT_PER_CHAR_KEY}:len={_bucket(avg_chars, ITEM_CHARS_BUCKETS)}"
 
-    We EWMA update batch_discount_current toward clamp(efficiency).
+
+def discount_key(batch_size: int, avg_chars: float) -> str:
+    return (
+        f"{BATCH_DISCOUNT_KEY}:bs={_bucket(batch_size, BATCH_SIZE_BUCKETS)}"
+        f":len={_bucket(avg_chars, ITEM_CHARS_BUCKETS)}"
+    )
+
+
+class BatchCalibrator:
     """
-    if total_chars <= 0:
-        return get_batch_discount(session, settings)
-
-    single_lat = _get_float(session, SINGLE_LAT_PER_CHAR_KEY, default=None)  # type: ignore
-    if single_lat is None:
-        # no baseline yet; keep current
-        return get_batch_discount(session, settings)
-
-    expected = single_lat * total_chars
-    if expected <= 0:
-        return get_batch_discount(session, settings)
-
-    efficiency = batch_latency_ms / expected
-    # clamp
-    efficiency = max(settings.batch_discount_min, min(settings.batch_discount_max, efficiency))
-
-    current = get_batch_discount(session, settings)
-    alpha = settings.batch_discount_ewma_alpha
-    new_discount = (1 - alpha) * current + alpha * efficiency
-    new_discount = max(settings.batch_discount_min, min(settings.batch_discount_max, new_discount))
-    new_discount = round(new_discount, 5)
-    _set_float(session, BATCH_DISCOUNT_KEY, new_discount)
-    return new_discount
\ No newline at end of file
+    In-memory EWMA calibration of single-request latency per char and the
+    batch discount, bucketed by batch size and per-item text length (with the
+    legacy global keys as fallback for buckets that have no data yet).
+
+    Observations update the local estimate under a short lock and are also
+    accumulated as (sum, count). Every CALIBRATION_FLUSH_S the pending
+    observations are merged into runtime_stats with a compare-and-swap UPDATE,
+    applying n observations as one EWMA step of weight 1-(1-alpha)^n. Workers
+    in other processes therefore combine their evidence instead of
+    overwriting each other, and no request pays for a write transaction.
+    Each flush then reloads every calibration row, so buckets this process
+    never sees itself still follow what the other processes learned.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: dict[str, float] = {}
+        self._pending: dict[str, list[float]] = {}  # key -> [sum, count]
+        self._settings: Optional[Settings] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ---- lifecycle ----
+
+    def start(self, settings: Settings) -> None:
+        if self._thread is not None:
+            return
+        self._settings = settings
+        self._reload(get_engine())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="calibrator", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        assert self._settings is not None
+        while not self._stop.wait(self._settings.calibration_flush_s):
+            try:
+                self.flush()
+            except Exception:
+                log.exception("Calibration flush failed")
+
+    def _reload(self, engine) -> None:
+        with Session(engine) as session:
+            rows = session.exec(
+                select(RuntimeStat).where(
+                    RuntimeStat.key.startswith(SINGLE_LAT_PER_CHAR_KEY) | RuntimeStat.key.startswith(BATCH_DISCOUNT_KEY)
+                )
+            ).all()
+        with self._lock:
+            for r in rows:
+                if r.key in self._pending:
+                    # Observed here since the last merge; the local estimate is newer until the next flush
+                    continue
+                try:
+                    self._values[r.key] = float(r.value)
+                except ValueError:
+                    pass
+
+    # ---- reads ----
+
+    def _get(self, *keys: str) -> Optional[float]:
+        with self._lock:
+            for k in keys:
+                if k in self._values:
+                    return self._values[k]
+        return None
+
+    def single_latency_per_char(self, avg_chars: float) -> Optional[float]:
+        return self._get(single_key(avg_chars), SINGLE_LAT_PER_CHAR_KEY)
+
+    def discount(self, settings: Settings, batch_size: int, avg_chars: float) -> float:
+        value = self._get(discount_key(batch_size, avg_chars), BATCH_DISCOUNT_KEY)
+        return round(settings.batch_discount_default if value is None else value, 5)
+
+    # ---- writes ----
+
+    def _observe(self, settings: Settings, key: str, observed: float, lo: float, hi: float) -> float:
+        alpha = settings.batch_discount_ewma_alpha
+        with self._lock:
+            current = self._values.get(key, observed)
+            new_val = max(lo, min(hi, (1 - alpha) * current + alpha * observed))
+            self._values[key] = new_val
+            pending = self._pending.setdefault(key, [0.0, 0])
+            pending[0] += observed
+            pending[1] += 1
+            return new_val
+
+    def observe_single(self, settings: Settings, chars: int, latency_ms: int) -> None:
+        if chars <= 0:
+            return
+        observed = latency_ms / float(chars)
+        inf = float("inf")
+        self._observe(settings, single_key(chars), observed, 0.0, inf)
+        self._observe(settings, SINGLE_LAT_PER_CHAR_KEY, observed, 0.0, inf)
+
+    def observe_batch(self, settings: Settings, batch_size: int, total_chars: int, batch_latency_ms: int) -> float:
+        """
+        We infer batch efficiency using the single-latency-per-char baseline
+        for the same per-item length bucket:
+          expected = single_lat_ms_per_char * total_chars
+          efficiency = batch_latency_ms / expected
+        If batching is faster, efficiency < 1.0 => discount < 1.0
+        Returns the updated discount for this (batch size, length) bucket.
+        """
+        avg_chars = total_chars / max(1, batch_size)
+        if total_chars <= 0:
+            return self.discount(settings, batch_size, avg_chars)
+        single_lat = self.single_latency_per_char(avg_chars)
+        if single_lat is None or single_lat <= 0:
+            # no baseline yet; keep current
+            return self.discount(settings, batch_size, avg_chars)
+
+        lo, hi = settings.batch_discount_min, settings.batch_discount_max
+        efficiency = max(lo, min(hi, batch_latency_ms / (single_lat * total_chars)))
+        self._observe(settings, BATCH_DISCOUNT_KEY, efficiency, lo, hi)
+        return round(self._observe(settings, discount_key(batch_size, avg_chars), efficiency, lo, hi), 5)
+
+    # ---- persistence ----
+
+    def flush(self) -> None:
+        settings = self._settings
+        if settings is None:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        alpha = settings.batch_discount_ewma_alpha
+        engine = get_engine()
+        for key, (total, n) in pending.items():
+            mean = total / n
+            weight = 1 - (1 - alpha) ** n
+            merged = self._merge(engine, key, mean, weight)
+            if merged is None:
+                # Could not persist; keep the evidence for the next flush
+                with self._lock:
+                    p = self._pending.setdefault(key, [0.0, 0])
+                    p[0] += total
+                    p[1] += n
+                continue
+            with self._lock:
+                self._values[key] = merged
+        # Pick up what the other workers / instances merged, including buckets not seen here
+        self._reload(engine)
+
+    def _merge(self, engine, key: str, mean: float, weight: float) -> Optional[float]:
+        for _ in range(CAS_RETRIES):
+            try:
+                with engine.begin() as conn:
+                    row = conn.execute(text("SELECT value FROM runtime_stats WHERE key = :k"), {"k": key}).first()
+                    if row is None:
+                        conn.execute(
+                            text("INSERT INTO runtime_stats (key, value, updated_at) VALUES (:k, :v, :t)"),
+                            {"k": key, "v": repr(mean), "t": now_utc()},
+                        )
+                        return mean
+                    try:
+                        current = float(row.value)
+                    except ValueError:
+                        current = mean
+                    merged = (1 - weight) * current + weight * mean
+                    updated = conn.execute(
+                        text("UPDATE runtime_stats SET value = :v, updated_at = :t WHERE key = :k AND value = :old"),
+                        {"k": key, "v": repr(merged), "t": now_utc(), "old": row.value},
+                    ).rowcount
+                    if updated == 1:
+                        return merged
+            except IntegrityError:
+                # Lost an insert race; retry as an update
+                continue
+        return None
+
+
+calibrator = BatchCalibrator()
@@ -0,0 +1,283 @@
+# app/services/cost_model.py
+"""
+Latency cost model for a single model call (one /tts request, one /batchtts
+batch, or one long-form segment batch), learned from recorded Generation and
+Batch rows:
+
+  latency_ms ~ b0 + b_chars*chars + b_items*items
+               + sum_l b[chars:lang=l] * chars * (language == l)
+               + sum_f b[chars:fmt=f]  * chars * (format == f)
+
+Languages/formats with too few samples share the baseline coefficients.
+The fit is a least-squares fit weighted by 1/latency (i.e. on relative
+error), done offline with `python -m app.cli fit-cost-model` and stored as
+JSON in runtime_stats. The GPU is held for the whole call, so GPU-seconds
+are latency / 1000. Without a fitted model, predictions fall back to the
+online calibration (single ms per char x batch discount).
+"""
+from __future__ import annotations
+
+import json
+import logging
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.core.config import Settings
+from app.core.models import Batch, Generation, LongformJob, RuntimeStat
+from app.core.security import as_utc_aware, now_utc
+from app.services.batch_discount import calibrator
+
+log = logging.getLogger(__name__)
+
+COST_MODEL_KEY = "cost_model"
+MIN_FIT_SAMPLES = 30
+MIN_LEVEL_SAMPLES = 20  # rarer languages/formats use the baseline coefficients
+RIDGE = 1e-6
+HOLDOUT_FRACTION = 0.2
+
+
+@dataclass
+class Sample:
+    kind: str  # "single" | "batch"
+    chars: int
+    items: int
+    language: str
+    fmt: str
+    latency_ms: int
+    created_at: datetime
+
+
+def _norm_language(language: Optional[str]) -> str:
+    return (language or "auto").strip().lower() or "auto"
+
+
+def _feature_row(chars: int, items: int, language: str, fmt: str) -> dict[str, float]:
+    return {
+        "intercept": 1.0,
+        "chars": float(chars),
+        "items": float(items),
+        f"chars:lang={_norm_language(language)}": float(chars),
+        f"chars:fmt={fmt}": float(chars),
+    }
+
+
+@dataclass
+class CostModel:
+    coef: dict[str, float]
+    n_samples: int = 0
+    fitted_at: str = ""
+    report: dict = field(default_factory=dict)
+
+    def predict_ms(self, chars: int, items: int, language: str, fmt: str) -> float:
+        row = _feature_row(chars, items, language, fmt)
+        return max(1.0, sum(self.coef.get(k, 0.0) * v for k, v in row.items()))
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, raw: str) -> "CostModel":
+        return cls(**json.loads(raw))
+
+
+# ---- training data ----
+
+def load_samples(engine: Engine, since: Optional[datetime] = None, limit: Optional[int] = None) -> list[Sample]:
+    """
+    Successful single requests and batches that recorded their input length,
+    oldest first. Long-form generations are excluded: their latency is the
+    sum of several model calls.
+    """
+    longform_ids = select(LongformJob.generation_id).where(LongformJob.generation_id.is_not(None))
+    singles = select(
+        Generation.chars, Generation.language, Generation.requested_format, Generation.latency_ms, Generation.created_at
+    ).where(
+        Generation.batch_id.is_(None),
+        Generation.status == "ok",
+        Generation.chars > 0,
+        Generation.latency_ms > 0,
+        Generation.phrase_id.is_(None),
+        Generation.id.not_in(longform_ids),
+    )
+    batches = select(
+        Batch.total_chars, Batch.item_count, Batch.language, Batch.requested_format, Batch.latency_ms_total, Batch.created_at
+    ).where(
+        Batch.status == "ok",
+        Batch.total_chars > 0,
+        Batch.item_count > 0,
+        Batch.latency_ms_total > 0,
+    )
+    if since is not None:
+        singles = singles.where(Generation.created_at >= as_utc_aware(since))
+        batches = batches.where(Batch.created_at >= as_utc_aware(since))
+    if limit:
+        singles = singles.order_by(Generation.created_at.desc()).limit(limit)
+        batches = batches.order_by(Batch.created_at.desc()).limit(limit)
+
+    out: list[Sample] = []
+    with Session(engine) as session:
+        for chars, language, fmt, latency, created in session.exec(singles):
+            out.append(Sample("single", chars, 1, _norm_language(language), fmt, latency, created))
+        for chars, items, language, fmt, latency, created in session.exec(batches):
+            out.append(Sample("batch", chars, items, _norm_language(language), fmt, latency, created))
+    out.sort(key=lambda s: s.created_at)
+    return out[-limit:] if limit else out
+
+
+# ---- fitting / evaluation ----
+
+def _levels(values: list[str], baseline: Optional[str] = None) -> list[str]:
+    counts = Counter(values)
+    if baseline is None or baseline not in counts:
+        baseline = counts.most_common(1)[0][0]
+    return sorted(v for v, n in counts.items() if n >= MIN_LEVEL_SAMPLES and v != baseline)
+
+
+def fit(samples: list[Sample]) -> CostModel:
+    if len(samples) < MIN_FIT_SAMPLES:
+        raise ValueError(f"Not enough samples to fit ({len(samples)} < {MIN_FIT_SAMPLES})")
+    names = ["intercept", "chars", "items"]
+    names += [f"chars:lang={l}" for l in _levels([s.language for s in samples])]
+    names += [f"chars:fmt={f}" for f in _levels([s.fmt for s in samples], baseline="wav")]
+
+    rows = [_feature_row(s.chars, s.items, s.language, s.fmt) for s in samples]
+    X = np.array([[r.get(n, 0.0) for n in names] for r in rows])
+    y = np.array([s.latency_ms for s in samples], dtype=np.float64)
+
+    # Weighting each row by 1/y fits relative error, so short requests count as much as long ones
+    A = X / y[:, None]
+    scale = np.abs(A).max(axis=0)
+    scale[scale == 0] = 1.0
+    A /= scale
+    beta = np.linalg.solve(A.T @ A + RIDGE * np.eye(len(names)), A.T @ np.ones(len(y))) / scale
+
+    return CostModel(
+        coef={n: float(b) for n, b in zip(names, beta)},
+        n_samples=len(samples),
+        fitted_at=now_utc().isoformat(),
+    )
+
+
+def _metrics(pred: np.ndarray, actual: np.ndarray) -> dict:
+    if len(actual) == 0:
+        return {"n": 0}
+    err = pred - actual
+    ape = np.abs(err) / actual
+    return {
+        "n": int(len(actual)),
+        "mae_ms": round(float(np.mean(np.abs(err))), 1),
+        "mape": round(float(np.mean(ape)), 4),
+        "p50_ape": round(float(np.percentile(ape, 50)), 4),
+        "p90_ape": round(float(np.percentile(ape, 90)), 4),
+        "bias": round(float(np.mean(err / actual)), 4),  # > 0: over-predicts
+    }
+
+
+def accuracy(predict, samples: list[Sample]) -> dict:
+    """Error metrics overall and per kind / language / format."""
+    pred = np.array([predict(s) for s in samples], dtype=np.float64)
+    actual = np.array([s.latency_ms for s in samples], dtype=np.float64)
+    report = {"overall": _metrics(pred, actual)}
+    for attr in ("kind", "language", "fmt"):
+        groups: dict[str, list[int]] = {}
+        for i, s in enumerate(samples):
+            groups.setdefault(getattr(s, attr), []).append(i)
+        report[f"by_{attr}"] = {k: _metrics(pred[idx], actual[idx]) for k, idx in sorted(groups.items())}
+    return report
+
+
+def evaluate(samples: list[Sample], holdout: float = HOLDOUT_FRACTION) -> dict:
+    """
+    Fits on the oldest (1 - holdout) of the samples and reports accuracy on
+    the newest, next to the flat ms-per-char baseline the calibrator uses.
+    """
+    cut = int(len(samples) * (1 - holdout))
+    train, test = samples[:cut], samples[cut:]
+    model = fit(train)
+    ms_per_char = sum(s.latency_ms for s in train) / max(1, sum(s.chars for s in train))
+    return {
+        "train_samples": len(train),
+        "test_samples": len(test),
+        "model": accuracy(lambda s: model.predict_ms(s.chars, s.items, s.language, s.fmt), test),
+        "baseline_ms_per_char": accuracy(lambda s: ms_per_char * s.chars, test),
+    }
+
+
+# ---- runtime ----
+
+@dataclass
+class Estimate:
+    latency_ms: Optional[int]
+    source: str  # "model" | "calibration" | "none"
+
+    @property
+    def gpu_seconds(self) -> Optional[float]:
+        return None if self.latency_ms is None else round(self.latency_ms / 1000.0, 3)
+
+
+class CostEstimator:
+    def __init__(self) -> None:
+        self.model: Optional[CostModel] = None
+
+    def load(self, engine: Engine) -> Optional[CostModel]:
+        with Session(engine) as session:
+            row = session.get(RuntimeStat, COST_MODEL_KEY)
+        try:
+            self.model = CostModel.from_json(row.value) if row else None
+        except (ValueError, TypeError):
+            log.warning("Ignoring unreadable cost model in runtime_stats")
+            self.model = None
+        return self.model
+
+    def save(self, engine: Engine, model: CostModel) -> None:
+        with Session(engine) as session:
+            row = session.get(RuntimeStat, COST_MODEL_KEY)
+            if row is None:
+                row = RuntimeStat(key=COST_MODEL_KEY, value="", updated_at=now_utc())
+            row.value = model.to_json()
+            row.updated_at = now_utc()
+            session.add(row)
+            session.commit()
+        self.model = model
+
+    def predict(self, settings: Settings, chars: list[int], language: str, fmt: str) -> Estimate:
+        total, items = sum(chars), len(chars)
+        if self.model is not None:
+            return Estimate(int(round(self.model.predict_ms(total, items, language, fmt))), "model")
+        avg = total / max(1, items)
+        per_char = calibrator.single_latency_per_char(avg)
+        if per_char is None:
+            return Estimate(None, "none")
+        latency = per_char * total
+        if items > 1:
+            latency *= calibrator.discount(settings, items, avg)
+        return Estimate(int(round(latency)), "calibration")
+
+    def over_budget(self, settings: Settings, est: Estimate) -> bool:
+        """Admission check: MAX_PREDICTED_LATENCY_S (0 = off)."""
+        limit = settings.max_predicted_latency_s
+        return limit > 0 and est.latency_ms is not None and est.latency_ms > limit * 1000
+
+    def plan_batch(self, settings: Settings, chars: list[int], language: str, fmt: str) -> int:
+        """
+        Number of leading items of `chars` to generate in the next call: the
+        largest prefix predicted to finish within LONGFORM_TARGET_BATCH_S
+        (at least 1), so resumable progress is checkpointed at a steady pace.
+        """
+        target = settings.longform_target_batch_s
+        if target <= 0 or len(chars) <= 1:
+            return len(chars)
+        for n in range(len(chars), 1, -1):
+            est = self.predict(settings, chars[:n], language, fmt)
+            if est.latency_ms is None or est.latency_ms <= target * 1000:
+                return n
+        return 1
+
+
+cost_estimator = CostEstimator()
@@ -0,0 +1,118 @@
+# app/services/derived.py
+"""
+Transcoding cache for audio served back to clients (voice reference samples,
+stored generations). A derived asset — another format, sample rate, channel
+count, bitrate and/or a leading excerpt, e.g. a 5-second 24 kbps Opus preview
+for a voice picker — is made with ffmpeg on first request and kept under
+media_dir/derived/<source sha256>/<params hash>.<ext>. Sources are immutable
+(content-addressed), so the same URL always gets the same bytes and the
+responses can be cached for a long time.
+
+The retention sweep deletes derived assets whose source is gone and keeps the
+cache under DERIVED_CACHE_MB, least recently served first.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request
+
+from app.core.config import Settings
+from app.services.encode import OutputOptions, convert_audio
+from app.services.output_paths import atomic_output
+
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+MIN_DURATION_S = 0.5
+MAX_DURATION_S = 600.0
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    if not inm:
+        return False
+    return inm.strip() == "*" or etag in [t.strip().removeprefix("W/") for t in inm.split(",")]
+
+
+@dataclass(frozen=True)
+class DerivedSpec:
+    """What to derive from a source file; duration_s keeps only the first N seconds."""
+    opts: OutputOptions
+    duration_s: Optional[float] = None
+
+    def validate(self) -> "DerivedSpec":
+        self.opts.validate()
+        if self.opts.fmt == "pcm" and self.opts.sample_rate is None:
+            # Raw PCM carries no header, so the rate has to be known up front
+            raise ValueError("format pcm needs an explicit sample_rate")
+        if self.duration_s is not None and not MIN_DURATION_S <= self.duration_s <= MAX_DURATION_S:
+            raise ValueError(f"duration must be between {MIN_DURATION_S:g} and {MAX_DURATION_S:g} seconds")
+        return self
+
+    def key(self) -> str:
+        o = self.opts
+        duration = f"{self.duration_s:g}" if self.duration_s else "full"
+        params = f"{o.fmt}/{o.sample_rate or 'native'}/{o.channels}/{o.bitrate_kbps or 'default'}/{duration}"
+        return hashlib.sha256(params.encode("utf-8")).hexdigest()[:32]
+
+
+def derived_root(settings: Settings) -> Path:
+    return settings.media_dir / "derived"
+
+
+def derived_path(settings: Settings, source_sha: str, spec: DerivedSpec) -> Path:
+    return derived_root(settings) / source_sha / f"{spec.key()}.{spec.opts.fmt}"
+
+
+def derived_etag(source_sha: str, spec: DerivedSpec) -> str:
+    return f'"{source_sha}-{spec.key()[:16]}"'
+
+
+class DerivedCache:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._building: dict[Path, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, settings: Settings, source_path: str, source_sha: str, spec: DerivedSpec) -> Path:
+        """Path of the derived asset, transcoding it first if it is not cached yet."""
+        path = derived_path(settings, source_sha, spec)
+        if path.exists():
+            self._touch(path)
+            self.hits += 1
+            return path
+        with self._lock:
+            build_lock = self._building.setdefault(path, threading.Lock())
+        try:
+            # Concurrent first requests for the same asset wait for one transcode
+            with build_lock:
+                if not path.exists():
+                    path.parent.mkdir(parents=True, exist_ok=True)
+                    with atomic_output(path) as tmp:
+                        convert_audio(source_path, tmp, spec.opts, max_seconds=spec.duration_s)
+                    self.misses += 1
+                else:
+                    self.hits += 1
+        finally:
+            with self._lock:
+                self._building.pop(path, None)
+        return path
+
+    @staticmethod
+    def _touch(path: Path) -> None:
+        # mtime doubles as "last served" for the size-bounded sweep
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def snapshot(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
+
+
+derived_cache = DerivedCache()
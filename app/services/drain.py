@@ -0,0 +1,171 @@
+# app/services/drain.py
+"""
+Drain mode for redeploys. While draining, /ready reports "draining", new
+work (synthesis, voice creation, WebSocket sessions) is rejected with 503 and
+Retry-After, and requests already running are given until DRAIN_TIMEOUT_S to
+finish. The long-form job runner stops claiming jobs and hands back the one
+it is working on after the current batch (see JobRunner).
+
+Draining starts on SIGTERM, or earlier via POST /admin/drain (e.g. from a
+preStop hook), which drops a flag file in DRAIN_FLAG_DIR so every worker
+process of this container sees it. That directory is on tmpfs, so a restarted
+container never comes back up already draining.
+
+On SIGTERM the server keeps its listener open while draining (so clients get
+503 + Retry-After rather than connection refused) and only passes the signal
+on to uvicorn once in-flight requests are done. DRAIN_TIMEOUT_S is one
+deadline shared by that wait and the waits in the lifespan shutdown, so the
+whole stop fits in the container's grace period.
+
+Streaming responses outlive the middleware that counts requests; their
+bodies are wrapped in tracked() so wait_idle() covers them too.
+"""
+from __future__ import annotations
+
+import logging
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, TypeVar
+
+from app.core.config import Settings
+
+log = logging.getLogger(__name__)
+
+FLAG_CHECK_S = 1.0  # how stale the flag-file check may be
+
+T = TypeVar("T")
+
+
+def flag_path(settings: Settings) -> Path:
+    return settings.drain_flag_dir / "draining"
+
+
+class Drain:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._local = False
+        self._since: Optional[float] = None
+        self._inflight = 0
+        self._flag = False
+        self._flag_checked = 0.0
+        self._deadline: Optional[float] = None  # monotonic; set once shutdown starts
+
+    def active(self, settings: Settings) -> bool:
+        if self._local:
+            return True
+        now = time.monotonic()
+        if now - self._flag_checked > FLAG_CHECK_S:
+            self._flag = flag_path(settings).exists()
+            self._flag_checked = now
+            if self._flag and self._since is None:
+                self._since = time.time()
+        return self._flag
+
+    def begin(self, settings: Settings, all_workers: bool = False) -> None:
+        """Starts draining this process (and, with all_workers, every process on this host)."""
+        with self._lock:
+            self._local = True
+            if self._since is None:
+                self._since = time.time()
+        if all_workers:
+            path = flag_path(settings)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.touch()
+
+    def begin_shutdown(self, settings: Settings) -> None:
+        """Starts draining for good and starts the DRAIN_TIMEOUT_S shutdown clock (once)."""
+        self.begin(settings)
+        with self._lock:
+            if self._deadline is None:
+                self._deadline = time.monotonic() + settings.drain_timeout_s
+
+    def remaining(self) -> float:
+        """Seconds left of the shutdown deadline (0 once it has passed)."""
+        with self._lock:
+            if self._deadline is None:
+                return 0.0
+            return max(0.0, self._deadline - time.monotonic())
+
+    def install_signal_handler(self, settings: Settings) -> None:
+        """
+        Wraps the server's SIGTERM handler: the first SIGTERM starts draining and
+        the server is only told to stop once nothing is in flight (or the
+        deadline passes). A second SIGTERM stops it straight away.
+        """
+        if threading.current_thread() is not threading.main_thread():
+            return
+        previous = signal.getsignal(signal.SIGTERM)
+        if not callable(previous):
+            # No server handler to hand over to (not running under uvicorn)
+            return
+
+        def handle_sigterm(signum, frame) -> None:
+            if self._deadline is not None:
+                previous(signum, frame)
+                return
+            self.begin_shutdown(settings)
+            log.info("SIGTERM: draining for up to %.0fs before closing the listener", settings.drain_timeout_s)
+            threading.Thread(
+                target=self._stop_when_idle, args=(previous, signum), name="drain-shutdown", daemon=True
+            ).start()
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+
+    def _stop_when_idle(self, stop, signum: int) -> None:
+        if not self.wait_idle(self.remaining()):
+            log.warning("Drain timeout: closing the listener with requests still in flight")
+        stop(signum, None)
+
+    def cancel(self, settings: Settings) -> None:
+        flag_path(settings).unlink(missing_ok=True)
+        with self._lock:
+            self._local = False
+            self._since = None
+            self._flag = False
+            self._flag_checked = time.monotonic()
+
+    @contextmanager
+    def track(self) -> Iterator[None]:
+        """Counts a request / session as in flight for wait_idle()."""
+        with self._lock:
+            self._inflight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                if self._inflight == 0:
+                    self._idle.notify_all()
+
+    def tracked(self, chunks: Iterable[T]) -> Iterator[T]:
+        """A streaming response body that counts as in flight until it is fully sent."""
+        with self.track():
+            yield from chunks
+
+    def wait_idle(self, timeout: float) -> bool:
+        """Blocks until nothing is in flight or the timeout passes; True if idle."""
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._inflight > 0:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._idle.wait(left)
+            return True
+
+    def snapshot(self, settings: Settings) -> dict:
+        active = self.active(settings)
+        with self._lock:
+            return {
+                "draining": active,
+                "since": self._since if active else None,
+                "in_flight": self._inflight,
+                "retry_after_s": settings.drain_retry_after_s,
+            }
+
+
+drain = Drain()
@@ -1,42 +1,198 @@
 # app/services/encode.py
 from __future__ import annotations
 
+import io
 import subprocess
+import time
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Optional
 
+import numpy as np
+import soundfile as sf
 
-def convert_audio(in_wav_path: str, out_path: str) -> None:
+from app.services.resample import resample
+
+# Formats encoded in-process (no ffmpeg subprocess) vs through ffmpeg
+NATIVE_FORMATS = ("wav", "pcm", "flac")
+FFMPEG_FORMATS = ("mp3", "ogg", "opus")
+LOSSY_FORMATS = FFMPEG_FORMATS
+
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 48000
+MIN_BITRATE_KBPS = 6
+MAX_BITRATE_KBPS = 320
+
+
+@dataclass(frozen=True)
+class OutputOptions:
+    """How generated audio is delivered: format plus optional rate/channels/bitrate."""
+    fmt: str = "wav"
+    sample_rate: Optional[int] = None  # None = the model's native rate
+    channels: int = 1
+    bitrate_kbps: Optional[int] = None  # lossy formats only; None = format default
+
+    def validate(self) -> "OutputOptions":
+        if self.fmt not in NATIVE_FORMATS + FFMPEG_FORMATS:
+            raise ValueError(f"Unsupported output format: {self.fmt}. Supported: {sorted(NATIVE_FORMATS + FFMPEG_FORMATS)}")
+        if self.sample_rate is not None and not MIN_SAMPLE_RATE <= self.sample_rate <= MAX_SAMPLE_RATE:
+            raise ValueError(f"sample_rate must be between {MIN_SAMPLE_RATE} and {MAX_SAMPLE_RATE}")
+        if self.channels not in (1, 2):
+            raise ValueError("channels must be 1 or 2")
+        if self.bitrate_kbps is not None:
+            if self.fmt not in LOSSY_FORMATS:
+                raise ValueError(f"bitrate only applies to {', '.join(LOSSY_FORMATS)}")
+            if not MIN_BITRATE_KBPS <= self.bitrate_kbps <= MAX_BITRATE_KBPS:
+                raise ValueError(f"bitrate must be between {MIN_BITRATE_KBPS} and {MAX_BITRATE_KBPS} kbps")
+        return self
+
+
+def _codec_args(fmt: str, bitrate_kbps: Optional[int], channels: int) -> list[str]:
+    """ffmpeg codec + container arguments (explicit container, so output can be a pipe)."""
+    if fmt == "wav":
+        return ["-codec:a", "pcm_s16le", "-f", "wav"]
+    if fmt == "pcm":
+        return ["-codec:a", "pcm_s16le", "-f", "s16le"]
+    if fmt == "flac":
+        return ["-codec:a", "flac", "-f", "flac"]
+    if fmt == "mp3":
+        quality = ["-b:a", f"{bitrate_kbps}k"] if bitrate_kbps else ["-q:a", "3"]
+        return ["-codec:a", "libmp3lame", *quality, "-f", "mp3"]
+    if fmt == "ogg":
+        quality = ["-b:a", f"{bitrate_kbps}k"] if bitrate_kbps else ["-q:a", "5"]
+        return ["-codec:a", "libvorbis", *quality, "-f", "ogg"]
+    if fmt == "opus":
+        # Speech-tuned default: 32 kbps per channel is transparent for TTS output
+        return ["-codec:a", "libopus", "-b:a", f"{bitrate_kbps or 32 * channels}k", "-f", "ogg"]
+    raise ValueError(f"Unsupported output format: {fmt}")
+
+
+def convert_audio(
+    in_wav_path: str, out_path: str, opts: Optional[OutputOptions] = None, max_seconds: Optional[float] = None
+) -> None:
     """
-    Uses ffmpeg to convert from wav to mp3/ogg or to normalize wav output.
+    Uses ffmpeg to convert an audio file (any format ffmpeg reads) to the
+    output format (format taken from the extension), optionally keeping only
+    the first max_seconds. Used for long outputs that are streamed from disk
+    and for the transcoding cache; sample rate and channel changes are left
+    to ffmpeg there.
     Assumes ffmpeg exists in the container (it does in your Dockerfile).
     """
     out_ext = Path(out_path).suffix.lower().lstrip(".")
-    if out_ext == "wav":
-        # Just copy/ensure valid wav through ffmpeg (optional). We’ll do a pass-through.
-        subprocess.run(
-            ["ffmpeg", "-y", "-i", in_wav_path, out_path],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-        return
-
-    if out_ext == "mp3":
-        subprocess.run(
-            ["ffmpeg", "-y", "-i", in_wav_path, "-codec:a", "libmp3lame", "-q:a", "3", out_path],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-        return
-
-    if out_ext == "ogg":
-        subprocess.run(
-            ["ffmpeg", "-y", "-i", in_wav_path, "-codec:a", "libvorbis", "-q:a", "5", out_path],
-            check=True,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
-        )
-        return
-
-    raise ValueError(f"Unsupported output format: {out_ext}")
\ No newline at end of file
+    opts = opts or OutputOptions(fmt=out_ext)
+    # -vn: uploaded mp3/ogg files may carry cover art
+    cmd = ["ffmpeg", "-y", "-i", in_wav_path, "-vn"]
+    if max_seconds:
+        cmd += ["-t", f"{max_seconds:g}"]
+    if opts.sample_rate:
+        cmd += ["-ar", str(opts.sample_rate)]
+    cmd += ["-ac", str(opts.channels)] + _codec_args(out_ext, opts.bitrate_kbps, opts.channels) + [out_path]
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def pcm_s16le(wav: np.ndarray) -> bytes:
+    """Float samples (frames x channels or mono) as raw 16-bit little-endian PCM."""
+    return (np.clip(np.asarray(wav, dtype=np.float32), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def prepare_samples(wav, sr: int, opts: OutputOptions) -> tuple[np.ndarray, int]:
+    """Resamples (vectorized, in-process) and lays out channels; returns (samples, rate)."""
+    samples = np.asarray(wav, dtype=np.float32).reshape(-1)
+    out_sr = opts.sample_rate or sr
+    if out_sr != sr:
+        samples = resample(samples, sr, out_sr)
+    if opts.channels == 2:
+        samples = np.repeat(samples[:, None], 2, axis=1)
+    return samples, out_sr
+
+
+def encode_samples(samples: np.ndarray, sr: int, opts: OutputOptions) -> bytes:
+    """
+    Encodes prepared samples. wav/pcm/flac are written in-process; lossy
+    formats pipe raw float PCM through ffmpeg (no intermediate wav file).
+    """
+    if opts.fmt == "pcm":
+        return pcm_s16le(samples)
+    if opts.fmt in ("wav", "flac"):
+        buf = io.BytesIO()
+        sf.write(buf, samples, sr, format=opts.fmt.upper(), subtype="PCM_16")
+        return buf.getvalue()
+    channels = 1 if samples.ndim == 1 else samples.shape[1]
+    cmd = [
+        "ffmpeg", "-y", "-f", "f32le", "-ar", str(sr), "-ac", str(channels), "-i", "pipe:0",
+        *_codec_args(opts.fmt, opts.bitrate_kbps, channels), "pipe:1",
+    ]
+    proc = subprocess.run(
+        cmd, input=np.ascontiguousarray(samples, dtype="<f4").tobytes(), check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+    )
+    return proc.stdout
+
+
+def encode_audio(wav, sr: int, opts: OutputOptions) -> tuple[bytes, int]:
+    """Generated waveform -> (encoded bytes, output sample rate)."""
+    samples, out_sr = prepare_samples(wav, sr, opts)
+    return encode_samples(samples, out_sr, opts), out_sr
+
+
+def benchmark_encoding(
+    wav,
+    sr: int,
+    formats: list[str],
+    sample_rates: list[Optional[int]],
+    channels: int = 1,
+    bitrate_kbps: Optional[int] = None,
+    repeat: int = 3,
+) -> list[dict]:
+    """
+    Encoded size and time per (format, sample rate) for one waveform
+    (best of `repeat` runs; resampling is timed separately).
+    """
+    seconds = len(np.asarray(wav).reshape(-1)) / sr
+    rows = []
+    for rate in sample_rates:
+        prep_ms = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            samples, out_sr = prepare_samples(wav, sr, OutputOptions(sample_rate=rate, channels=channels))
+            prep_ms = min(prep_ms, (time.perf_counter() - t0) * 1000)
+        for fmt in formats:
+            opts = OutputOptions(
+                fmt=fmt, sample_rate=rate, channels=channels,
+                bitrate_kbps=bitrate_kbps if fmt in LOSSY_FORMATS else None,
+            ).validate()
+            encode_ms, size = float("inf"), 0
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                size = len(encode_samples(samples, out_sr, opts))
+                encode_ms = min(encode_ms, (time.perf_counter() - t0) * 1000)
+            rows.append({
+                "format": fmt,
+                "sample_rate": out_sr,
+                "channels": channels,
+                "bytes": size,
+                "kbps": round(size * 8 / 1000 / seconds, 1),
+                "resample_ms": round(prep_ms, 2),
+                "encode_ms": round(encode_ms, 2),
+                "realtime_x": round(seconds * 1000 / max(prep_ms + encode_ms, 1e-6), 1),
+            })
+    return rows
+
+
+def normalize_reference_audio(in_path: str, out_path: str, sample_rate: int, max_seconds: float) -> None:
+    """
+    Produces a compact model input from an uploaded reference: mono, resampled,
+    leading/trailing silence trimmed and capped at max_seconds (16-bit wav).
+    """
+    trim = "silenceremove=start_periods=1:start_threshold=-50dB"
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-i", in_path,
+            "-af", f"{trim},areverse,{trim},areverse",
+            "-ac", "1", "-ar", str(sample_rate), "-t", str(max_seconds),
+            "-codec:a", "pcm_s16le", out_path,
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
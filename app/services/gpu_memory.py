@@ -0,0 +1,183 @@
+# app/services/gpu_memory.py
+"""
+GPU memory management around model calls.
+
+Instead of emptying the CUDA cache after every call (which makes the caching
+allocator release and re-acquire memory on each request), generation goes
+through GpuMemoryManager.run():
+
+* a batch is pre-split so no sub-batch exceeds the learned safe size
+  (total input chars, a proxy for decoder tokens);
+* a CUDA OOM splits the failing batch in half and retries recursively; a
+  single item that still OOMs is retried once after trimming the cache;
+* each OOM lowers the safe size to 3/4 of the batch that failed, and it grows
+  back by 5% after GROWTH_AFTER OOM-free calls that were limited by it;
+* the cache is trimmed only when reserved memory exceeds
+  GPU_CACHE_TRIM_FRACTION of device memory;
+* peak allocated memory is reported per call (device-wide, so concurrent
+  calls are included).
+
+The model call is injected as generate(indices) -> (wavs, sr), so the split
+logic can be exercised with a stub that raises OOM above a threshold.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Optional
+
+import torch
+
+from app.core.config import Settings
+from app.services.inference import CallStats
+
+log = logging.getLogger(__name__)
+
+OOM_BACKOFF = 0.75
+GROWTH_AFTER = 50
+GROWTH_FACTOR = 1.05
+
+Generate = Callable[[list[int]], tuple[list, int]]
+
+
+def is_oom(e: BaseException) -> bool:
+    return isinstance(e, torch.cuda.OutOfMemoryError) or (
+        isinstance(e, RuntimeError) and "out of memory" in str(e).lower()
+    )
+
+
+class GpuMemoryManager:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.max_batch_chars: Optional[int] = None  # learned; None = no OOM seen yet
+        self._limited_ok = 0
+        self.totals = {"calls": 0, "ooms": 0, "splits": 0, "cache_trims": 0, "peak_mb_max": 0.0}
+
+    # ---- limit ----
+
+    def _limit(self, settings: Settings) -> Optional[int]:
+        with self._lock:
+            if self.max_batch_chars is not None:
+                return self.max_batch_chars
+        return settings.gpu_max_batch_chars or None
+
+    def _on_oom(self, settings: Settings, chars: int) -> None:
+        with self._lock:
+            current = self.max_batch_chars or settings.gpu_max_batch_chars or chars
+            self.max_batch_chars = max(1, min(current, int(chars * OOM_BACKOFF)))
+            self._limited_ok = 0
+        log.warning("CUDA OOM at %d chars; max batch chars now %d", chars, self.max_batch_chars)
+
+    @staticmethod
+    def pack(sizes: list[int], limit: Optional[int]) -> list[list[int]]:
+        """Greedy in-order split into groups of total size <= limit (oversized items go alone)."""
+        if not limit:
+            return [list(range(len(sizes)))] if sizes else []
+        groups: list[list[int]] = []
+        current: list[int] = []
+        total = 0
+        for i, n in enumerate(sizes):
+            if current and total + n > limit:
+                groups.append(current)
+                current, total = [], 0
+            current.append(i)
+            total += n
+        if current:
+            groups.append(current)
+        return groups
+
+    # ---- cache ----
+
+    def _empty_cache(self) -> None:
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _trim_if_pressured(self, settings: Settings) -> bool:
+        if settings.gpu_cache_trim_fraction <= 0 or not torch.cuda.is_available():
+            return False
+        total = torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory
+        if torch.cuda.memory_reserved() < settings.gpu_cache_trim_fraction * total:
+            return False
+        torch.cuda.empty_cache()
+        return True
+
+    # ---- calls ----
+
+    def run(self, settings: Settings, sizes: list[int], generate: Generate) -> tuple[list, int, CallStats]:
+        """
+        Generates len(sizes) items (sizes = input chars per item) and returns
+        (wavs in input order, sample rate, stats). Non-OOM errors propagate.
+        """
+        stats = CallStats()
+        cuda_on = torch.cuda.is_available()
+        if cuda_on:
+            torch.cuda.reset_peak_memory_stats()
+
+        out: list = [None] * len(sizes)
+        sr = 0
+        groups = self.pack(sizes, self._limit(settings))
+        for group in groups:
+            sr = self._run_group(settings, group, sizes, generate, out, stats)
+
+        if cuda_on:
+            stats.peak_mb = round(torch.cuda.max_memory_allocated() / 2**20, 1)
+            stats.cache_trimmed = self._trim_if_pressured(settings)
+        self._record(stats, limited=len(groups) > 1)
+        return out, sr, stats
+
+    def _run_group(
+        self, settings: Settings, idx: list[int], sizes: list[int], generate: Generate,
+        out: list, stats: CallStats, retried: bool = False,
+    ) -> int:
+        try:
+            wavs, sr = generate(idx)
+        except Exception as e:
+            if not is_oom(e):
+                raise
+            stats.ooms += 1
+            self._empty_cache()
+            if len(idx) > 1:
+                # A lone item that OOMs says nothing about batch sizing
+                self._on_oom(settings, sum(sizes[i] for i in idx))
+                stats.splits += 1
+                mid = len(idx) // 2
+                self._run_group(settings, idx[:mid], sizes, generate, out, stats)
+                return self._run_group(settings, idx[mid:], sizes, generate, out, stats)
+            if retried:
+                raise
+            return self._run_group(settings, idx, sizes, generate, out, stats, retried=True)
+
+        if len(wavs) != len(idx):
+            raise RuntimeError("Model returned unexpected output shape")
+        for i, wav in zip(idx, wavs):
+            out[i] = wav
+        stats.sub_batches += 1
+        return sr
+
+    def _record(self, stats: CallStats, limited: bool) -> None:
+        with self._lock:
+            t = self.totals
+            t["calls"] += 1
+            t["ooms"] += stats.ooms
+            t["splits"] += stats.splits
+            t["cache_trims"] += int(stats.cache_trimmed)
+            if stats.peak_mb is not None:
+                t["peak_mb_max"] = max(t["peak_mb_max"], stats.peak_mb)
+            # Probe upwards again once the limit has held for a while
+            if limited and not stats.ooms and self.max_batch_chars is not None:
+                self._limited_ok += 1
+                if self._limited_ok >= GROWTH_AFTER:
+                    self.max_batch_chars = int(self.max_batch_chars * GROWTH_FACTOR) + 1
+                    self._limited_ok = 0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            out = {"max_batch_chars": self.max_batch_chars, **self.totals}
+        if torch.cuda.is_available():
+            out["allocated_mb"] = round(torch.cuda.memory_allocated() / 2**20, 1)
+            out["reserved_mb"] = round(torch.cuda.memory_reserved() / 2**20, 1)
+            out["total_mb"] = round(torch.cuda.get_device_properties(torch.cuda.current_device()).total_memory / 2**20, 1)
+        return out
+
+
+gpu_memory = GpuMemoryManager()
@@ -0,0 +1,301 @@
+# app/services/idempotency.py
+"""
+Idempotency-Key handling and single-flight coalescing for /tts and /batchtts.
+
+A request is fingerprinted over (user, endpoint, body). Identical requests
+running concurrently in this process share one computation (the followers
+get the leader's response). With an Idempotency-Key header the outcome is
+also recorded in the idempotency_keys table:
+  - a retry while the original is still running (in any process) waits for
+    it, up to IDEMPOTENCY_WAIT_S, then replays its response; past that, or
+    when IDEMPOTENCY_MAX_WAITERS retries are already waiting in this process,
+    it gets 409 with Retry-After instead of holding a worker thread;
+  - a retry after it finished replays the recorded response for
+    IDEMPOTENCY_TTL_S without generating or billing again;
+  - reusing a key for a different request is rejected.
+Failed requests drop their record, so a retry runs again.
+
+The in-progress record is a lease of IDEMPOTENCY_LEASE_S, renewed while the
+request runs however long that takes; only a lease that lapsed (the process
+running it died) lets a retry take the key over and run it again.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Callable, Iterator, Optional
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+from app.core.config import Settings
+from app.core.db import get_engine
+from app.core.models import IdempotencyRecord
+from app.core.security import now_utc
+from app.services.output_paths import allocate_output_path, atomic_output
+
+log = logging.getLogger(__name__)
+
+MAX_KEY_LEN = 255
+POLL_S = 0.25
+LEASE_RENEWALS = 3  # renewals per lease period, so a slow renewal doesn't let it lapse
+
+
+class IdempotencyKeyReused(ValueError):
+    pass
+
+
+class IdempotencyInProgress(RuntimeError):
+    pass
+
+
+@dataclass
+class StoredResponse:
+    body: bytes
+    media_type: str
+    headers: dict[str, str] = field(default_factory=dict)
+    status_code: int = 200
+
+
+@dataclass
+class _Flight:
+    fingerprint: str
+    done: threading.Event = field(default_factory=threading.Event)
+    result: Optional[StoredResponse] = None
+    error: Optional[BaseException] = None
+
+
+def fingerprint(user_id: int, endpoint: str, payload: Any) -> str:
+    raw = json.dumps([user_id, endpoint, payload], sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def record_key(user_id: int, key: str) -> str:
+    return hashlib.sha256(f"{user_id}\0{key}".encode("utf-8")).hexdigest()
+
+
+class Idempotency:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._flights: dict[str, _Flight] = {}
+        self._leases: set[str] = set()
+        self._renewer: Optional[threading.Thread] = None
+        self._waiting = 0
+        self.coalesced = 0
+        self.replayed = 0
+        self.busy = 0  # retries turned away with 409
+
+    def run(
+        self,
+        settings: Settings,
+        user_id: int,
+        endpoint: str,
+        payload: Any,
+        key: Optional[str],
+        compute: Callable[[], StoredResponse],
+    ) -> tuple[StoredResponse, bool]:
+        """Returns (response, replayed); replayed responses did no new work."""
+        if key is not None and not 0 < len(key) <= MAX_KEY_LEN:
+            raise ValueError(f"Idempotency-Key must be 1-{MAX_KEY_LEN} characters")
+        fp = fingerprint(user_id, endpoint, payload)
+        rkey = record_key(user_id, key) if key is not None else None
+        flight_id = f"key:{rkey}" if rkey else f"fp:{fp}"
+
+        with self._lock:
+            flight = self._flights.get(flight_id)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_id] = _Flight(fp)
+            elif flight.fingerprint == fp:
+                self.coalesced += 1
+        if not leader:
+            if flight.fingerprint != fp:
+                raise IdempotencyKeyReused("Idempotency-Key was already used for a different request")
+            with self._waiter(settings):
+                finished = flight.done.wait(settings.idempotency_wait_s)
+            if not finished:
+                self._busy()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        claimed = False
+        try:
+            if rkey:
+                replay = self._claim(settings, user_id, rkey, endpoint, fp)
+                if replay is not None:
+                    self.replayed += 1
+                    flight.result = replay
+                    return replay, True
+                claimed = True
+                self._lease(settings, rkey)
+            result = compute()
+            if rkey:
+                self._complete(settings, user_id, rkey, result)
+            flight.result = result
+            return result, False
+        except BaseException as e:
+            flight.error = e
+            if claimed:
+                self._release(rkey)
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(flight_id, None)
+                self._leases.discard(rkey)
+            flight.done.set()
+
+    # ---- bounded waiting ----
+
+    @contextmanager
+    def _waiter(self, settings: Settings) -> Iterator[None]:
+        """A slot for a request blocking on another one; raises IdempotencyInProgress when all are taken."""
+        with self._lock:
+            if self._waiting >= settings.idempotency_max_waiters:
+                full = True
+            else:
+                full = False
+                self._waiting += 1
+        if full:
+            self._busy()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def _busy(self) -> None:
+        with self._lock:
+            self.busy += 1
+        raise IdempotencyInProgress("A request with this Idempotency-Key is still in progress")
+
+    # ---- in-progress leases ----
+
+    def _lease(self, settings: Settings, rkey: str) -> None:
+        with self._lock:
+            self._leases.add(rkey)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew, args=(settings,), name="idempotency-lease", daemon=True)
+                self._renewer.start()
+
+    def _renew(self, settings: Settings) -> None:
+        """Keeps the in-progress records of this process's running requests from lapsing."""
+        while True:
+            time.sleep(settings.idempotency_lease_s / LEASE_RENEWALS)
+            with self._lock:
+                keys = list(self._leases)
+            if not keys:
+                continue
+            try:
+                with get_engine().begin() as conn:
+                    conn.execute(
+                        update(IdempotencyRecord)
+                        .where(IdempotencyRecord.key.in_(keys), IdempotencyRecord.status == "in_progress")
+                        .values(expires_at=now_utc() + timedelta(seconds=settings.idempotency_lease_s))
+                    )
+            except Exception:
+                log.exception("Could not renew idempotency leases")
+
+    # ---- persisted records ----
+
+    def _claim(self, settings: Settings, user_id: int, rkey: str, endpoint: str, fp: str) -> Optional[StoredResponse]:
+        """
+        Records this request as in progress and returns None, or returns the
+        finished response of an earlier request with the same key.
+        """
+        queued = False
+        with ExitStack() as waiting:
+            deadline = time.monotonic() + settings.idempotency_wait_s
+            while True:
+                with Session(get_engine()) as session:
+                    rec = session.get(IdempotencyRecord, rkey)
+                    now = now_utc()
+                    if rec is not None and rec.expires_at <= now:
+                        # Replay window over, or the lease lapsed because the process running it died
+                        _delete_record(session, rec)
+                        rec = None
+                    if rec is None:
+                        session.add(IdempotencyRecord(
+                            key=rkey,
+                            user_id=user_id,
+                            endpoint=endpoint,
+                            fingerprint=fp,
+                            created_at=now,
+                            expires_at=now + timedelta(seconds=settings.idempotency_lease_s),
+                        ))
+                        try:
+                            session.commit()
+                            return None
+                        except IntegrityError:
+                            session.rollback()  # claimed concurrently by another process
+                            continue
+                    if rec.fingerprint != fp:
+                        raise IdempotencyKeyReused("Idempotency-Key was already used for a different request")
+                    if rec.status == "done":
+                        try:
+                            body = Path(rec.body_path).read_bytes()
+                        except (OSError, TypeError):
+                            _delete_record(session, rec)
+                            continue
+                        return StoredResponse(body, rec.media_type, json.loads(rec.headers_json or "{}"), rec.status_code or 200)
+                if time.monotonic() > deadline:
+                    self._busy()
+                if not queued:
+                    waiting.enter_context(self._waiter(settings))
+                    queued = True
+                time.sleep(POLL_S)
+
+    def _complete(self, settings: Settings, user_id: int, rkey: str, result: StoredResponse) -> None:
+        path = allocate_output_path(settings, "idempotency", user_id, "bin")
+        with atomic_output(path) as tmp:
+            Path(tmp).write_bytes(result.body)
+        with Session(get_engine()) as session:
+            rec = session.get(IdempotencyRecord, rkey)
+            if rec is None:
+                path.unlink(missing_ok=True)
+                return
+            rec.status = "done"
+            rec.status_code = result.status_code
+            rec.media_type = result.media_type
+            rec.headers_json = json.dumps(result.headers)
+            rec.body_path = str(path)
+            rec.expires_at = now_utc() + timedelta(seconds=settings.idempotency_ttl_s)
+            session.add(rec)
+            session.commit()
+
+    def _release(self, rkey: str) -> None:
+        try:
+            with Session(get_engine()) as session:
+                rec = session.get(IdempotencyRecord, rkey)
+                if rec is not None and rec.status == "in_progress":
+                    _delete_record(session, rec)
+        except Exception:
+            log.exception("Could not release idempotency record")
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "waiting": self._waiting,
+                "coalesced": self.coalesced,
+                "replayed": self.replayed,
+                "busy": self.busy,
+            }
+
+
+def _delete_record(session: Session, rec: IdempotencyRecord) -> None:
+    if rec.body_path:
+        Path(rec.body_path).unlink(missing_ok=True)
+    session.delete(rec)
+    session.commit()
+
+
+idempotency = Idempotency()
@@ -0,0 +1,299 @@
+# app/services/inference.py
+"""
+Where model calls run.
+
+INFERENCE_MODE=local (default): in the API process (LocalBackend).
+INFERENCE_MODE=remote: API processes never import torch; calls are sent to
+`python -m app.worker` processes over the configured transport
+(app/services/transport.py) and answered there by the same LocalBackend.
+
+Routes and the job runner only use the `inference` facade below.
+"""
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, Iterator, NamedTuple, Optional
+
+from sqlmodel import Session, select
+
+from app.core.config import Settings
+from app.core.db import get_engine
+from app.core.models import Voice
+
+log = logging.getLogger(__name__)
+
+INFO_TIMEOUT_S = 2.0
+INFO_TTL_S = 10.0  # workers restarted with another model are noticed within this long
+NOT_READY = {"ready": False, "voice_design": False, "base_revision": ""}
+
+
+@dataclass
+class CallStats:
+    sub_batches: int = 0
+    ooms: int = 0
+    splits: int = 0
+    cache_trimmed: bool = False
+    peak_mb: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    def add(self, other: "CallStats") -> "CallStats":
+        """Combined stats of two model calls (e.g. one per temperature group)."""
+        peaks = [p for p in (self.peak_mb, other.peak_mb) if p is not None]
+        return CallStats(
+            sub_batches=self.sub_batches + other.sub_batches,
+            ooms=self.ooms + other.ooms,
+            splits=self.splits + other.splits,
+            cache_trimmed=self.cache_trimmed or other.cache_trimmed,
+            peak_mb=max(peaks) if peaks else None,
+        )
+
+
+class Synthesis(NamedTuple):
+    wavs: list
+    sr: int
+    stats: CallStats
+
+
+class RemoteBackend:
+    """
+    Client side of INFERENCE_MODE=remote. Each API process has one reply
+    channel (client id); a reader thread hands replies to waiting calls.
+    """
+
+    def __init__(self, settings: Settings, transport) -> None:
+        self._settings = settings
+        self._transport = transport
+        self._client_id = uuid.uuid4().hex
+        self._pending: dict[str, "queue.Queue[dict]"] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._reader = threading.Thread(target=self._read_replies, name="inference-replies", daemon=True)
+        self._reader.start()
+        self._info: dict = NOT_READY
+        self._info_expires = 0.0
+        self._info_lock = threading.Lock()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._reader.join(timeout=5)
+        self._transport.close(self._client_id)
+
+    def _read_replies(self) -> None:
+        while not self._stop.is_set():
+            try:
+                reply = self._transport.receive(self._client_id, timeout=1.0)
+            except Exception as e:
+                log.warning("Inference transport receive failed: %s", e)
+                self._stop.wait(1.0)
+                continue
+            if reply is None:
+                continue
+            value = reply.get("value")
+            if isinstance(value, dict) and "wavs" in value:
+                # Always decode, even if the caller timed out, so shared buffers are released
+                value["wavs"] = self._transport.unpack_audio(value["wavs"])
+            with self._lock:
+                box = self._pending.get(reply["id"])
+            if box is not None:
+                box.put(reply)
+
+    def _call(self, op: str, timeout: Optional[float] = None, **args) -> Any:
+        job_id = uuid.uuid4().hex
+        box: "queue.Queue[dict]" = queue.Queue(maxsize=1)
+        with self._lock:
+            self._pending[job_id] = box
+        timeout = timeout or self._settings.inference_timeout_s
+        try:
+            self._transport.send({"id": job_id, "client": self._client_id, "op": op, "args": args})
+            try:
+                reply = box.get(timeout=timeout)
+            except queue.Empty:
+                raise TimeoutError(f"No inference worker answered '{op}' within {timeout:g}s")
+        finally:
+            with self._lock:
+                self._pending.pop(job_id, None)
+        if not reply.get("ok"):
+            raise RuntimeError(reply.get("error") or "Inference worker error")
+        return reply.get("value")
+
+    def _cast(self, op: str, **args) -> None:
+        # Fire-and-forget (no reply channel)
+        self._transport.send({"id": uuid.uuid4().hex, "client": None, "op": op, "args": args})
+
+    def info(self) -> dict:
+        if time.monotonic() < self._info_expires:
+            return self._info
+        # One thread refreshes; the others keep using the last answer instead of blocking
+        if not self._info_lock.acquire(blocking=False):
+            return self._info
+        try:
+            try:
+                self._info = self._call("info", timeout=INFO_TIMEOUT_S)
+                ttl = INFO_TTL_S
+            except (TimeoutError, RuntimeError, OSError):
+                # Workers still loading (they answer once models are up): retry soon
+                self._info = NOT_READY
+                ttl = INFO_TIMEOUT_S
+            self._info_expires = time.monotonic() + ttl
+            return self._info
+        finally:
+            self._info_lock.release()
+
+    def synthesize(
+        self,
+        settings: Settings,
+        prompt_blobs: dict[int, bytes],
+        voice_ids: list[int],
+        texts: list[str],
+        languages: list[str],
+        temperature: float,
+    ) -> Synthesis:
+        v = self._call(
+            "synthesize",
+            prompt_blobs=list(prompt_blobs.items()),  # each voice's blob sent once; JSON-safe keys
+            voice_ids=voice_ids,
+            texts=texts,
+            languages=languages,
+            temperature=temperature,
+        )
+        return Synthesis(v["wavs"], v["sr"], CallStats(**v["stats"]))
+
+    def extract_prompts(self, settings: Settings, ref_paths: list[str], ref_texts: list[str]) -> list[bytes]:
+        return self._call("extract_prompts", ref_paths=ref_paths, ref_texts=ref_texts)
+
+    def design(self, settings: Settings, texts: list[str], languages: list[str], instructs: list[str]) -> tuple[list, int]:
+        v = self._call("design", texts=texts, languages=languages, instructs=instructs)
+        return v["wavs"], v["sr"]
+
+    def prefetch(self, settings: Settings, voice_id: int, prompt_blob: bytes) -> None:
+        self._cast("prefetch", voice_id=voice_id, prompt_blob=prompt_blob)
+
+    def invalidate(self, voice_id: int) -> None:
+        # Each worker has its own pool; a deleted voice is never requested again and ages out by LRU
+        pass
+
+    def stats(self) -> dict:
+        return self._call("stats", timeout=INFO_TIMEOUT_S * 5)
+
+    def profile_torch(self, settings: Settings, generations: int) -> dict:
+        # Arms whichever worker picks the job up; its artifacts land in that worker's DATA_DIR
+        return self._call("profile_torch", timeout=INFO_TIMEOUT_S * 5, generations=generations)
+
+
+class Inference:
+    def __init__(self) -> None:
+        self._backend = None
+        self._lock = threading.Lock()
+        self._active = 0
+        self._last_call = time.monotonic()
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            from app.services.inference_local import LocalBackend
+
+            self._backend = LocalBackend()
+        return self._backend
+
+    def start(self, settings: Settings) -> None:
+        if settings.inference_mode == "remote":
+            from app.services.transport import make_transport
+
+            self._backend = RemoteBackend(settings, make_transport(settings))
+        elif settings.inference_mode != "local":
+            raise RuntimeError(f"Unknown INFERENCE_MODE: {settings.inference_mode} (local|remote)")
+
+    def stop(self) -> None:
+        if self._backend is not None:
+            self._backend.close()
+
+    def warm(self, settings: Settings) -> None:
+        """Prefetches the PROMPT_POOL_WARM most used voices' prompts at startup."""
+        if settings.prompt_pool_warm <= 0:
+            return
+        with Session(get_engine()) as session:
+            rows = session.exec(
+                select(Voice.id, Voice.prompt_blob)
+                .where(Voice.deleted_at.is_(None))
+                .order_by(Voice.use_count.desc())
+                .limit(settings.prompt_pool_warm)
+            ).all()
+        try:
+            for voice_id, blob in rows:
+                self.prefetch(settings, voice_id, blob)
+        except OSError as e:
+            log.warning("Prompt warm-up skipped: inference workers unreachable (%s)", e)
+
+    def ready(self, design: bool = False) -> bool:
+        info = self.backend.info()
+        return bool(info["ready"] and (info["voice_design"] or not design))
+
+    def base_revision(self) -> str:
+        return self.backend.info()["base_revision"]
+
+    @contextmanager
+    def _busy(self) -> Iterator[None]:
+        with self._lock:
+            self._active += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+                self._last_call = time.monotonic()
+
+    def idle_for(self) -> float:
+        """Seconds since this process last had a model call in flight (0 while one is)."""
+        with self._lock:
+            return 0.0 if self._active else time.monotonic() - self._last_call
+
+    def synthesize(self, settings: Settings, voice_id: int, prompt_blob: bytes, texts: list[str], language: str, temperature: float) -> Synthesis:
+        """Single-voice batch."""
+        n = len(texts)
+        with self._busy():
+            return self.backend.synthesize(settings, {voice_id: prompt_blob}, [voice_id] * n, texts, [language] * n, temperature)
+
+    def synthesize_items(
+        self,
+        settings: Settings,
+        prompt_blobs: dict[int, bytes],
+        voice_ids: list[int],
+        texts: list[str],
+        languages: list[str],
+        temperature: float,
+    ) -> Synthesis:
+        """Mixed-voice batch: item i is texts[i] in voice voice_ids[i], languages[i]."""
+        with self._busy():
+            return self.backend.synthesize(settings, prompt_blobs, voice_ids, texts, languages, temperature)
+
+    def extract_prompts(self, settings: Settings, ref_paths: list[str], ref_texts: list[str]) -> list[bytes]:
+        with self._busy():
+            return self.backend.extract_prompts(settings, ref_paths, ref_texts)
+
+    def design(self, settings: Settings, texts: list[str], languages: list[str], instructs: list[str]) -> tuple[list, int]:
+        with self._busy():
+            return self.backend.design(settings, texts, languages, instructs)
+
+    def prefetch(self, settings: Settings, voice_id: int, prompt_blob: bytes) -> None:
+        self.backend.prefetch(settings, voice_id, prompt_blob)
+
+    def invalidate(self, voice_id: int) -> None:
+        self.backend.invalidate(voice_id)
+
+    def stats(self) -> dict:
+        return self.backend.stats()
+
+    def profile_torch(self, settings: Settings, generations: int) -> dict:
+        """Runs torch.profiler around the next `generations` model calls."""
+        return self.backend.profile_torch(settings, generations)
+
+
+inference = Inference()
@@ -0,0 +1,99 @@
+# app/services/inference_local.py
+"""
+In-process model calls: used by the API process with INFERENCE_MODE=local
+and by `python -m app.worker`. Importing this module imports torch.
+"""
+from __future__ import annotations
+
+from typing import Any
+
+from app.core.config import Settings
+from app.services.gpu_memory import gpu_memory
+from app.services.inference import Synthesis
+from app.services.profiling import profiler
+from app.services.prompt_pool import prompt_pool
+from app.services.qwen_models import model_registry
+
+
+class LocalBackend:
+    def close(self) -> None:
+        prompt_pool.stop()
+
+    def info(self) -> dict:
+        return {
+            "ready": model_registry.loaded and model_registry.base is not None,
+            "voice_design": model_registry.voice_design is not None,
+            "base_revision": model_registry.base_revision,
+        }
+
+    def synthesize(
+        self,
+        settings: Settings,
+        prompt_blobs: dict[int, bytes],
+        voice_ids: list[int],
+        texts: list[str],
+        languages: list[str],
+        temperature: float,
+    ) -> Synthesis:
+        if model_registry.base is None:
+            raise RuntimeError("Model not loaded")
+        prompts = {voice_id: prompt_pool.get(settings, voice_id, blob) for voice_id, blob in prompt_blobs.items()}
+        # Split into sub-batches that fit in GPU memory (halved again on OOM);
+        # prompts and languages are per item, so any mix of voices shares a call
+        with profiler.generation():
+            wavs, sr, stats = gpu_memory.run(
+                settings,
+                [len(t) for t in texts],
+                lambda idx: model_registry.base.generate_voice_clone(
+                    text=[texts[i] for i in idx],   # batch list supported by Qwen3-TTS
+                    language=[languages[i] for i in idx],
+                    voice_clone_prompt=[prompts[voice_ids[i]] for i in idx],
+                    temperature=temperature,
+                ),
+            )
+        return Synthesis(wavs, sr, stats)
+
+    def extract_prompts(self, settings: Settings, ref_paths: list[str], ref_texts: list[str]) -> list[bytes]:
+        prompts = model_registry.base.create_voice_clone_prompt(
+            ref_audio=ref_paths,
+            ref_text=ref_texts,
+            x_vector_only_mode=False,
+        )
+        return [model_registry.dump_prompt(p) for p in prompts]
+
+    def design(self, settings: Settings, texts: list[str], languages: list[str], instructs: list[str]) -> tuple[list, int]:
+        with profiler.generation():
+            return model_registry.voice_design.generate_voice_design(text=texts, language=languages, instruct=instructs)
+
+    def prefetch(self, settings: Settings, voice_id: int, prompt_blob: bytes) -> None:
+        prompt_pool.prefetch(settings, voice_id, prompt_blob)
+
+    def invalidate(self, voice_id: int) -> None:
+        prompt_pool.invalidate(voice_id)
+
+    def stats(self) -> dict:
+        return {**gpu_memory.snapshot(), "prompt_pool": prompt_pool.snapshot()}
+
+    def profile_torch(self, settings: Settings, generations: int) -> dict:
+        return profiler.start_torch(settings, generations)
+
+
+def execute(backend: LocalBackend, settings: Settings, op: str, args: dict) -> Any:
+    """Runs one transport job on the worker side; audio is returned under "wavs"."""
+    if op == "synthesize":
+        s = backend.synthesize(settings, **{**args, "prompt_blobs": dict(args["prompt_blobs"])})
+        return {"wavs": s.wavs, "sr": s.sr, "stats": s.stats.to_dict()}
+    if op == "design":
+        wavs, sr = backend.design(settings, **args)
+        return {"wavs": list(wavs), "sr": sr}
+    if op == "extract_prompts":
+        return backend.extract_prompts(settings, **args)
+    if op == "prefetch":
+        return backend.prefetch(settings, **args)
+    if op == "info":
+        return backend.info()
+    if op == "stats":
+        return backend.stats()
+    if op == "profile_torch":
+        return backend.profile_torch(settings, **args)
+    raise ValueError(f"Unknown inference op: {op}")
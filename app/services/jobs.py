@@ -0,0 +1,330 @@
+# app/services/jobs.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import queue
+import shutil
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Optional
+
+import soundfile as sf
+from sqlalchemy import or_, update
+from sqlmodel import Session, select
+
+from app.core.config import Settings
+from app.core.db import get_engine
+from app.core.models import Generation, LongformJob, Voice
+from app.core.security import now_utc, sha256_file
+from app.services.cost_model import cost_estimator
+from app.services.drain import drain
+from app.services.encode import OutputOptions, convert_audio
+from app.services.inference import inference
+from app.services.longform import concat_with_crossfade
+from app.services.output_paths import allocate_output_path, atomic_output
+
+log = logging.getLogger(__name__)
+
+# Backoff after a failed model call: 30s, 1m, 2m, ... capped at an hour
+RETRY_BASE_S = 30
+RETRY_MAX_S = 3600
+
+
+def job_dir(settings: Settings, job_id: int) -> Path:
+    return settings.media_dir / "jobs" / str(job_id)
+
+
+class JobRunner:
+    """
+    Background worker for long-form jobs. Segments are generated in batches
+    and written to media_dir/jobs/<id>/<n>.wav as they finish, so a resumed
+    job continues after the last completed segment instead of starting over.
+
+    Every API process runs one; a job is worked on by whichever runner claims
+    its lease (runner_id, lease_expires_at), renewed after every batch. Idle
+    runners poll for unclaimed jobs and for jobs whose runner stopped renewing,
+    and a draining runner hands its job back after the current batch, so any
+    instance sharing the database and MEDIA_DIR picks it up where it stopped.
+
+    A failed model call (OOM, worker restart, transport timeout) is usually
+    transient: the job is handed back with a backoff (retry_at) and only
+    marked "error" after LONGFORM_MAX_ATTEMPTS failures in a row.
+    """
+
+    def __init__(self) -> None:
+        self._queue: "queue.Queue[Optional[int]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._settings: Optional[Settings] = None
+        self._current: Optional[int] = None
+        self._stopping = threading.Event()
+        self.runner_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def start(self, settings: Settings) -> None:
+        if self._thread is not None:
+            return
+        self._settings = settings
+        self._stopping.clear()
+        # Unfinished jobs (including a previous process's) are found by polling
+        self._thread = threading.Thread(target=self._run, name="job-runner", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Hands the current job back after its in-flight batch (waits up to timeout)."""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._queue.put(None)
+        self._thread.join(timeout=timeout)
+        self._thread = None
+
+    def submit(self, job_id: int) -> None:
+        self._queue.put(job_id)
+
+    def queued(self) -> int:
+        return self._queue.qsize()
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._thread is not None,
+            "runner_id": self.runner_id,
+            "current_job": self._current,
+            "queued": self.queued(),
+        }
+
+    def _should_yield(self) -> bool:
+        return self._stopping.is_set() or drain.active(self._settings)
+
+    def _next_job(self) -> Optional[int]:
+        """Blocks until there is a job to try; None means stop."""
+        settings = self._settings
+        while True:
+            try:
+                return self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            # Nothing is claimed while the model is loading (remote workers warming up)
+            if not self._should_yield() and inference.ready():
+                job_id = self._find_claimable()
+                if job_id is not None:
+                    return job_id
+            try:
+                return self._queue.get(timeout=settings.longform_poll_s)
+            except queue.Empty:
+                continue
+
+    def _find_claimable(self) -> Optional[int]:
+        now = now_utc()
+        with Session(get_engine()) as session:
+            return session.exec(
+                select(LongformJob.id)
+                .where(
+                    LongformJob.status.in_(("queued", "running")),
+                    or_(LongformJob.lease_expires_at.is_(None), LongformJob.lease_expires_at < now),
+                    or_(LongformJob.retry_at.is_(None), LongformJob.retry_at <= now),
+                )
+                .order_by(LongformJob.id)
+                .limit(1)
+            ).first()
+
+    def _claim(self, job_id: int) -> bool:
+        """Takes the job's lease if it is free, expired or already ours (atomic across processes)."""
+        now = now_utc()
+        with get_engine().begin() as conn:
+            return conn.execute(
+                update(LongformJob)
+                .where(
+                    LongformJob.id == job_id,
+                    LongformJob.status.in_(("queued", "running")),
+                    or_(LongformJob.retry_at.is_(None), LongformJob.retry_at <= now),
+                    or_(
+                        LongformJob.runner_id.is_(None),
+                        LongformJob.runner_id == self.runner_id,
+                        LongformJob.lease_expires_at.is_(None),
+                        LongformJob.lease_expires_at < now,
+                    ),
+                )
+                .values(runner_id=self.runner_id, lease_expires_at=now + timedelta(seconds=self._settings.longform_lease_s))
+            ).rowcount == 1
+
+    def _run(self) -> None:
+        while True:
+            job_id = self._next_job()
+            if job_id is None:
+                return
+            # Left queued in the DB for another instance while draining, or for
+            # the poll once the model is ready
+            if self._should_yield() or not inference.ready() or not self._claim(job_id):
+                continue
+            self._current = job_id
+            try:
+                self._process(job_id)
+            except Exception as e:
+                log.exception("Long-form job %s failed", job_id)
+                with Session(get_engine()) as session:
+                    job = session.get(LongformJob, job_id)
+                    if job is not None:
+                        job.status = "error"
+                        job.error = str(e) or e.__class__.__name__
+                        job.runner_id = None
+                        job.lease_expires_at = None
+                        job.updated_at = now_utc()
+                        session.add(job)
+                        session.commit()
+            finally:
+                self._current = None
+
+    @staticmethod
+    def _hand_back(session: Session, job: LongformJob) -> None:
+        job.status = "queued"
+        job.runner_id = None
+        job.lease_expires_at = None
+        job.updated_at = now_utc()
+        session.add(job)
+        session.commit()
+
+    @staticmethod
+    def _retry_later(session: Session, settings: Settings, job: LongformJob, error: str) -> None:
+        """The model call failed: hand the job back with a backoff, or fail it after too many attempts."""
+        job.attempts += 1
+        job.error = error
+        job.runner_id = None
+        job.lease_expires_at = None
+        job.updated_at = now_utc()
+        if job.attempts >= settings.longform_max_attempts:
+            job.status, job.retry_at = "error", None
+        else:
+            job.status = "queued"
+            job.retry_at = job.updated_at + timedelta(seconds=min(RETRY_BASE_S * 2 ** (job.attempts - 1), RETRY_MAX_S))
+        session.add(job)
+        session.commit()
+
+    def _process(self, job_id: int) -> None:
+        settings = self._settings
+        assert settings is not None
+        with Session(get_engine()) as session:
+            job = session.get(LongformJob, job_id)
+            if job is None or job.status not in ("queued", "running") or job.runner_id != self.runner_id:
+                return
+            voice = session.get(Voice, job.voice_id)
+            if voice is None or voice.deleted_at is not None:
+                raise RuntimeError("Voice not found")
+            if not inference.ready():
+                # Lost the model between claim and start (e.g. workers restarting): not the job's fault
+                self._hand_back(session, job)
+                return
+
+            segments: list[str] = json.loads(job.segments_json)
+            work_dir = job_dir(settings, job_id)
+            work_dir.mkdir(parents=True, exist_ok=True)
+            seg_paths = [str(work_dir / f"{i}.wav") for i in range(len(segments))]
+
+            job.status = "running"
+            job.updated_at = now_utc()
+            session.add(job)
+            session.commit()
+
+            pending = [i for i, p in enumerate(seg_paths) if not Path(p).exists()]
+            sr = None
+            pos = 0
+            while pos < len(pending):
+                if self._should_yield():
+                    # Finished segments stay on disk; whoever claims the job next skips them
+                    log.info("Handing back long-form job %s at %d/%d segments", job_id, job.done_segments, len(segments))
+                    self._hand_back(session, job)
+                    return
+                session.refresh(job)
+                if job.runner_id != self.runner_id:
+                    log.warning("Lost the lease on long-form job %s; stopping", job_id)
+                    return
+                # Cost-model planner: size each call to the latency target (capped by LONGFORM_BATCH_SIZE)
+                window = pending[pos:pos + max(1, settings.longform_batch_size)]
+                n = cost_estimator.plan_batch(settings, [len(segments[i]) for i in window], job.language, "wav")
+                idx = window[:n]
+                t0 = time.perf_counter()
+                try:
+                    out_wavs, sr, _ = inference.synthesize(
+                        settings, voice.id, voice.prompt_blob, [segments[i] for i in idx], job.language, job.temperature
+                    )
+                except Exception as e:
+                    # Finished segments stay on disk for the retry
+                    log.warning("Long-form job %s: model call failed (attempt %d): %s", job_id, job.attempts + 1, e)
+                    self._retry_later(session, settings, job, str(e) or e.__class__.__name__)
+                    return
+                elapsed_ms = int((time.perf_counter() - t0) * 1000)
+                for i, wav in zip(idx, out_wavs):
+                    tmp = seg_paths[i] + ".tmp"
+                    sf.write(tmp, wav, sr, format="WAV")
+                    Path(tmp).replace(seg_paths[i])
+
+                pos += len(idx)
+                job.done_segments = len(segments) - len(pending) + pos
+                job.attempts, job.error, job.retry_at = 0, None, None
+                job.latency_ms_total += elapsed_ms
+                job.updated_at = now_utc()
+                job.lease_expires_at = job.updated_at + timedelta(seconds=settings.longform_lease_s)
+                session.add(job)
+                session.commit()
+
+            if sr is None:
+                sr = sf.info(seg_paths[0]).samplerate
+
+            # Concatenate (streamed from disk) and convert to the requested format
+            wav_path = work_dir / "joined.wav"
+            concat_with_crossfade(seg_paths, str(wav_path), sr, settings.longform_crossfade_ms)
+            out_path = allocate_output_path(settings, "gens", job.user_id, job.requested_format)
+            opts = OutputOptions(job.requested_format, job.sample_rate, job.channels, job.bitrate_kbps)
+            with atomic_output(out_path) as tmp:
+                if opts == OutputOptions("wav"):
+                    os.replace(wav_path, tmp)
+                else:
+                    # Streamed through ffmpeg (which also resamples) rather than loaded into memory
+                    convert_audio(str(wav_path), tmp, opts)
+            final_path = str(out_path)
+
+            text = "\n".join(segments)
+            gen = Generation(
+                user_id=job.user_id,
+                voice_id=job.voice_id,
+                batch_id=None,
+                store=job.store,
+                requested_format=job.requested_format,
+                language=job.language,
+                temperature=job.temperature,
+                tokens_used=job.tokens_used,
+                latency_ms=job.latency_ms_total,
+                chars=sum(len(t) for t in segments),
+                status="ok",
+                error=None,
+                created_at=now_utc(),
+                audio_path=final_path if job.store else None,
+                audio_sha256=sha256_file(final_path) if job.store else None,
+                audio_bytes=os.path.getsize(final_path) if job.store else None,
+                input_text=text if job.store else None,
+            )
+            session.add(gen)
+            voice.use_count += 1
+            session.add(voice)
+            session.commit()
+            session.refresh(gen)
+
+            job.generation_id = gen.id
+            job.audio_path = final_path
+            job.done_segments = len(segments)
+            job.status = "done"
+            job.runner_id = None
+            job.lease_expires_at = None
+            job.finished_at = now_utc()
+            job.updated_at = job.finished_at
+            session.add(job)
+            session.commit()
+
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+job_runner = JobRunner()
@@ -0,0 +1,126 @@
+# app/services/longform.py
+from __future__ import annotations
+
+import re
+
+import numpy as np
+import soundfile as sf
+
+
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+# Sentence ends: latin punctuation followed by whitespace, or CJK full-width punctuation.
+_SENTENCE_RE = re.compile(r"(?<=[.!?…])\s+|(?<=[.!?…][\"')\]])\s+|(?<=[。！？；])")
+_CJK_END = tuple("。！？；，、")
+_CLAUSE_RE = re.compile(r"(?<=[,;:，、])\s*")
+
+
+def _split_long(sentence: str, max_chars: int) -> list[str]:
+    # Fall back to clause boundaries, then whitespace, then a hard cut.
+    parts: list[str] = []
+    for splitter in (_CLAUSE_RE, re.compile(r"\s+")):
+        pieces = [p for p in splitter.split(sentence) if p]
+        if len(pieces) > 1:
+            parts = pieces
+            break
+    if not parts:
+        return [sentence[i:i + max_chars] for i in range(0, len(sentence), max_chars)]
+    return _pack(parts, max_chars)
+
+
+def _pack(units: list[str], max_chars: int) -> list[str]:
+    out: list[str] = []
+    cur = ""
+    for u in units:
+        u = u.strip()
+        if not u:
+            continue
+        if len(u) > max_chars:
+            if cur:
+                out.append(cur)
+                cur = ""
+            out.extend(_split_long(u, max_chars))
+            continue
+        sep = "" if not cur or cur.endswith(_CJK_END) else " "
+        candidate = f"{cur}{sep}{u}"
+        if len(candidate) <= max_chars:
+            cur = candidate
+        else:
+            out.append(cur)
+            cur = u
+    if cur:
+        out.append(cur)
+    return out
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in _SENTENCE_RE.split(text) if s and s.strip()]
+
+
+def segment_text(text: str, max_chars: int) -> list[str]:
+    """
+    Splits a document into synthesis units of at most max_chars.
+    Sentences are packed together up to the limit, never across paragraphs.
+    """
+    segments: list[str] = []
+    for para in _PARAGRAPH_RE.split(text):
+        para = " ".join(para.split())
+        if para:
+            segments.extend(_pack(split_sentences(para), max_chars))
+    return segments
+
+
+def split_complete(buffer: str, max_chars: int) -> tuple[list[str], str]:
+    """
+    Incremental variant of segment_text for streamed text: returns the units
+    whose sentence (or paragraph) has already ended and the unterminated
+    remainder. A remainder longer than max_chars is cut at a clause or word
+    boundary so a run-on stream still makes progress.
+    """
+    end = 0
+    for rx in (_SENTENCE_RE, _PARAGRAPH_RE):
+        for m in rx.finditer(buffer):
+            end = max(end, m.end())
+    done, rest = buffer[:end], buffer[end:]
+    units = segment_text(done, max_chars) if done.strip() else []
+    if len(rest) > max_chars:
+        pieces = _split_long(rest.strip(), max_chars)
+        units.extend(pieces[:-1])
+        rest = pieces[-1] + (" " if rest[-1].isspace() else "")
+    return units, rest
+
+
+def concat_with_crossfade(paths: list[str], out_path: str, sr: int, crossfade_ms: int) -> int:
+    """
+    Streams segment wavs into one mono wav, overlapping consecutive segments
+    by a short linear crossfade. Only one segment is held in memory at a time.
+    Returns the number of samples written.
+    """
+    n_fade = max(0, int(sr * crossfade_ms / 1000))
+    written = 0
+    tail = np.zeros(0, dtype=np.float32)
+    with sf.SoundFile(out_path, mode="w", samplerate=sr, channels=1, subtype="PCM_16", format="WAV") as out:
+        for p in paths:
+            data, file_sr = sf.read(p, dtype="float32", always_2d=False)
+            if file_sr != sr:
+                raise ValueError(f"Segment sample rate {file_sr} != {sr}")
+            if data.ndim > 1:
+                data = data.mean(axis=1)
+
+            n = min(n_fade, len(tail), len(data))
+            if n > 0:
+                ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)
+                head = data[:n] * ramp + tail[len(tail) - n:] * (1.0 - ramp)
+                out.write(tail[:len(tail) - n])
+                written += len(tail) - n
+                data = np.concatenate([head, data[n:]])
+            else:
+                out.write(tail)
+                written += len(tail)
+
+            keep = min(n_fade, len(data))
+            out.write(data[:len(data) - keep])
+            written += len(data) - keep
+            tail = data[len(data) - keep:]
+        out.write(tail)
+        written += len(tail)
+    return written
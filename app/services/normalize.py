@@ -0,0 +1,149 @@
+# app/services/normalize.py
+"""
+Text normalization before synthesis (and before phrase-library / batch
+dedup keys are computed, so equivalent texts compare equal):
+
+  - always: Unicode NFC and whitespace collapsed to single spaces;
+  - optionally (`expand_numbers`): numbers, currency, percentages and a few common
+    abbreviations spelled out in English words. Only applied to English
+    text (language "English", or "auto" with mostly Latin letters), since
+    the words are English.
+"""
+from __future__ import annotations
+
+import re
+import unicodedata
+
+_WS = re.compile(r"\s+")
+
+_ONES = (
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen "
+    "fourteen fifteen sixteen seventeen eighteen nineteen"
+).split()
+_TENS = "_ _ twenty thirty forty fifty sixty seventy eighty ninety".split()
+_SCALES = ((10**12, "trillion"), (10**9, "billion"), (10**6, "million"), (10**3, "thousand"))
+_ORDINAL_IRREGULAR = {"one": "first", "two": "second", "three": "third", "five": "fifth", "eight": "eighth", "nine": "ninth", "twelve": "twelfth"}
+MAX_SPOKEN = 10**15  # larger numbers are read digit by digit
+
+_ABBREVIATIONS = {
+    "Dr.": "Doctor",
+    "Mr.": "Mister",
+    "Mrs.": "Missus",
+    "Prof.": "Professor",
+    "etc.": "et cetera",
+    "e.g.": "for example",
+    "i.e.": "that is",
+    "vs.": "versus",
+    "approx.": "approximately",
+}
+_ABBREV_RE = re.compile(r"(?<![\w.])(" + "|".join(re.escape(a) for a in _ABBREVIATIONS) + r")(?=\s|$)")
+
+_CURRENCY = {"$": ("dollar", "dollars", "cent", "cents"), "£": ("pound", "pounds", "penny", "pence"), "€": ("euro", "euros", "cent", "cents")}
+_MONEY_RE = re.compile(r"([$£€])(\d[\d,]*)(?:\.(\d{2}))?\b")
+_PERCENT_RE = re.compile(r"(\d[\d,]*(?:\.\d+)?)\s?%")
+_ORDINAL_RE = re.compile(r"\b(\d+)(st|nd|rd|th)\b", re.IGNORECASE)
+_NUMBER_RE = re.compile(r"(?<![\w.])(-)?(\d{1,3}(?:,\d{3})+|\d+)(?:\.(\d+))?(?![\w])")
+
+
+def collapse(text: str) -> str:
+    """NFC + single spaces; what every text goes through."""
+    return _WS.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def number_to_words(n: int) -> str:
+    if n < 0:
+        return "minus " + number_to_words(-n)
+    if n >= MAX_SPOKEN:
+        return " ".join(_ONES[int(d)] for d in str(n))
+    if n < 20:
+        return _ONES[n]
+    if n < 100:
+        tens, ones = divmod(n, 10)
+        return _TENS[tens] + (f"-{_ONES[ones]}" if ones else "")
+    if n < 1000:
+        hundreds, rest = divmod(n, 100)
+        return f"{_ONES[hundreds]} hundred" + (f" {number_to_words(rest)}" if rest else "")
+    for scale, name in _SCALES:
+        if n >= scale:
+            head, rest = divmod(n, scale)
+            return f"{number_to_words(head)} {name}" + (f" {number_to_words(rest)}" if rest else "")
+    raise AssertionError(n)
+
+
+def year_to_words(n: int) -> str:
+    """1999 -> nineteen ninety-nine, 2005 -> two thousand five, 1900 -> nineteen hundred."""
+    if 2000 <= n < 2010:
+        return number_to_words(n)
+    head, tail = divmod(n, 100)
+    if tail == 0:
+        return f"{number_to_words(head)} hundred"
+    return f"{number_to_words(head)} {'oh ' if tail < 10 else ''}{number_to_words(tail)}"
+
+
+def ordinal_to_words(n: int) -> str:
+    words = number_to_words(n)
+    head, sep, last = words.rpartition(" ")
+    if "-" in last:
+        head, sep, last = words.rpartition("-")
+    if last in _ORDINAL_IRREGULAR:
+        last = _ORDINAL_IRREGULAR[last]
+    elif last.endswith("y"):
+        last = last[:-1] + "ieth"
+    else:
+        last += "th"
+    return head + sep + last
+
+
+def _int(digits: str) -> int:
+    return int(digits.replace(",", ""))
+
+
+def _money(m: re.Match) -> str:
+    one, many, sub_one, sub_many = _CURRENCY[m.group(1)]
+    whole = _int(m.group(2))
+    out = f"{number_to_words(whole)} {one if whole == 1 else many}"
+    if m.group(3) and int(m.group(3)):
+        sub = int(m.group(3))
+        out += f" {number_to_words(sub)} {sub_one if sub == 1 else sub_many}"
+    return out
+
+
+def _number(m: re.Match) -> str:
+    sign, digits, frac = m.groups()
+    n = _int(digits)
+    if not sign and not frac and "," not in digits and len(digits) == 4 and 1100 <= n < 2100:
+        words = year_to_words(n)
+    elif len(digits) > 1 and digits.startswith("0"):
+        words = " ".join(_ONES[int(d)] for d in digits)  # codes, PINs, leading zeros
+    else:
+        words = number_to_words(n)
+    if frac:
+        words += " point " + " ".join(_ONES[int(d)] for d in frac)
+    return ("minus " if sign else "") + words
+
+
+def expand(text: str) -> str:
+    """Spells out abbreviations, currency, percentages, ordinals and numbers (English)."""
+    text = _ABBREV_RE.sub(lambda m: _ABBREVIATIONS[m.group(1)], text)
+    text = _MONEY_RE.sub(_money, text)
+    text = _PERCENT_RE.sub(lambda m: _NUMBER_RE.sub(_number, m.group(1)) + " percent", text)
+    text = _ORDINAL_RE.sub(lambda m: ordinal_to_words(int(m.group(1))), text)
+    text = text.replace(" & ", " and ")
+    return _NUMBER_RE.sub(_number, text)
+
+
+def is_english(text: str, language: str) -> bool:
+    lang = language.strip().lower()
+    if lang in ("english", "en"):
+        return True
+    if lang != "auto":
+        return False
+    letters = [c for c in text if c.isalpha()]
+    return not letters or sum(c.isascii() for c in letters) / len(letters) > 0.9
+
+
+def normalize_text(text: str, language: str = "auto", expand_numbers: bool = False) -> str:
+    text = collapse(text)
+    if expand_numbers and is_english(text, language):
+        text = collapse(expand(text))
+    return text
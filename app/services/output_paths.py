@@ -0,0 +1,51 @@
+# app/services/output_paths.py
+from __future__ import annotations
+
+import os
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from app.core.config import Settings
+from app.services.encode import OutputOptions, encode_audio
+
+
+def allocate_output_path(settings: Settings, kind: str, user_id: int, ext: str) -> Path:
+    """
+    Returns a fresh, collision-free path media_dir/<kind>/<user>/<ab>/<cd>/<uuid>.<ext>.
+    The two-level hex shard keeps every directory small regardless of volume.
+    """
+    uid = uuid.uuid4().hex
+    out_dir = settings.media_dir / kind / str(user_id) / uid[:2] / uid[2:4]
+    out_dir.mkdir(parents=True, exist_ok=True)
+    return out_dir / f"{uid}.{ext}"
+
+
+@contextmanager
+def atomic_output(path: Path) -> Iterator[str]:
+    """
+    Yields a sibling temp path to write to; it is renamed over `path` only if
+    the block succeeds, so readers never observe a partially written file.
+    The temp name keeps the real extension so encoders can infer the format.
+    """
+    tmp = path.with_name(f".{path.stem}.{uuid.uuid4().hex[:8]}.tmp{path.suffix}")
+    try:
+        yield str(tmp)
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def write_output_bytes(settings: Settings, kind: str, user_id: int, data: bytes, ext: str) -> str:
+    """Writes already encoded audio to a newly allocated output path."""
+    path = allocate_output_path(settings, kind, user_id, ext)
+    with atomic_output(path) as tmp:
+        Path(tmp).write_bytes(data)
+    return str(path)
+
+
+def write_output_audio(settings: Settings, kind: str, user_id: int, wav, sr: int, opts: OutputOptions) -> str:
+    """Encodes one generated waveform (in memory) and writes it to a newly allocated output path."""
+    data, _ = encode_audio(wav, sr, opts)
+    return write_output_bytes(settings, kind, user_id, data, opts.fmt)
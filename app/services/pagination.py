@@ -0,0 +1,27 @@
+# app/services/pagination.py
+from __future__ import annotations
+
+import base64
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{row_id}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        ts, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def before_cursor(created_col, id_col, cursor: str):
+    """WHERE clause for keyset pagination in (created_at DESC, id DESC) order."""
+    created_at, row_id = decode_cursor(cursor)
+    return or_(created_col < created_at, and_(created_col == created_at, id_col < row_id))
@@ -0,0 +1,375 @@
+# app/services/phrases.py
+"""
+Per-voice phrase library: fixed phrases (greetings, numbers, prompts) are
+registered once, pre-rendered in the requested output formats while the GPU
+is idle, and stored under media_dir/phrases. A /tts request whose text,
+language, temperature and output options match a rendered phrase is served
+from that file without running the model.
+
+Rendering runs in every API process; phrases are claimed atomically (status
+"rendering"), and a claim older than RENDER_LEASE_S is taken over, so a
+crashed process does not strand its phrases. A failed model call (workers
+not ready, OOM) puts the batch back to "pending" with exponential backoff;
+after PHRASE_MAX_ATTEMPTS failures in a row a phrase is marked "error".
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import and_, case, exists, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, func
+
+from app.core.config import Settings
+from app.core.db import get_engine
+from app.core.models import Generation, LongformJob, Phrase, PhraseRendition, Voice
+from app.core.security import now_utc
+from app.services.drain import drain
+from app.services.encode import OutputOptions, encode_audio
+from app.services.inference import inference
+from app.services.output_paths import write_output_bytes
+
+log = logging.getLogger(__name__)
+
+RENDER_LEASE_S = 600
+RETRY_BASE_S = 30
+RETRY_MAX_S = 3600
+LOOKUP_CHUNK = 500
+
+
+def phrase_key(text: str, language: str, temperature: float) -> str:
+    return hashlib.sha256(f"{language}\0{temperature!r}\0{text}".encode("utf-8")).hexdigest()
+
+
+def rendition_key(opts: OutputOptions) -> str:
+    return f"{opts.fmt}/{opts.sample_rate or 'native'}/{opts.channels}/{opts.bitrate_kbps or 'default'}"
+
+
+def register_phrases(
+    session: Session,
+    settings: Settings,
+    voice: Voice,
+    items: list[tuple[str, str, float]],
+    formats: list[OutputOptions],
+) -> dict:
+    """
+    Adds (text, language, temperature) items to the voice's library in every
+    given format. Phrases already present only gain the missing renditions.
+    """
+    keys = {phrase_key(*item): item for item in items}
+    existing: dict[str, Phrase] = {}
+    key_list = list(keys)
+    for i in range(0, len(key_list), LOOKUP_CHUNK):
+        for p in session.exec(
+            select(Phrase).where(Phrase.voice_id == voice.id, Phrase.text_key.in_(key_list[i:i + LOOKUP_CHUNK]))
+        ):
+            existing[p.text_key] = p
+
+    new_keys = [k for k in keys if k not in existing]
+    total = session.exec(select(func.count(Phrase.id)).where(Phrase.voice_id == voice.id)).one()
+    if total + len(new_keys) > settings.phrase_max_per_voice:
+        raise ValueError(f"Phrase library full (max {settings.phrase_max_per_voice} phrases per voice)")
+
+    ts = now_utc()
+    for k in new_keys:
+        text, language, temperature = keys[k]
+        p = Phrase(
+            user_id=voice.user_id,
+            voice_id=voice.id,
+            text=text,
+            text_key=k,
+            language=language,
+            temperature=temperature,
+            created_at=ts,
+            updated_at=ts,
+        )
+        session.add(p)
+        existing[k] = p
+    session.flush()
+
+    phrases = [existing[k] for k in keys]
+    have = {
+        (pid, ok)
+        for pid, ok in session.exec(
+            select(PhraseRendition.phrase_id, PhraseRendition.opts_key).where(
+                PhraseRendition.phrase_id.in_([p.id for p in phrases])
+            )
+        )
+    }
+    added = 0
+    for p in phrases:
+        for opts in formats:
+            if (p.id, rendition_key(opts)) in have:
+                continue
+            session.add(PhraseRendition(
+                phrase_id=p.id,
+                opts_key=rendition_key(opts),
+                requested_format=opts.fmt,
+                sample_rate=opts.sample_rate,
+                channels=opts.channels,
+                bitrate_kbps=opts.bitrate_kbps,
+            ))
+            have.add((p.id, rendition_key(opts)))
+            added += 1
+            if p.status in ("ready", "rendering"):
+                # A renderer holding the claim sees the new updated_at and leaves the phrase pending
+                p.status, p.updated_at = "pending", ts
+                session.add(p)
+        if p.status == "error":
+            # Registering a failed phrase again retries it
+            p.status, p.error, p.attempts, p.retry_at, p.updated_at = "pending", None, 0, None, ts
+            session.add(p)
+    try:
+        session.commit()
+    except IntegrityError:
+        session.rollback()
+        raise ValueError("The phrase library was changed concurrently; retry")
+    return {"phrases": len(phrases), "created": len(new_keys), "renditions_added": added}
+
+
+def lookup(
+    session: Session, voice_id: int, text: str, language: str, temperature: float, opts: OutputOptions
+) -> Optional[tuple[Phrase, PhraseRendition]]:
+    """The rendered phrase matching a /tts request exactly, if any."""
+    return session.exec(
+        select(Phrase, PhraseRendition)
+        .join(PhraseRendition, PhraseRendition.phrase_id == Phrase.id)
+        .where(
+            Phrase.voice_id == voice_id,
+            Phrase.text_key == phrase_key(text, language, temperature),
+            PhraseRendition.opts_key == rendition_key(opts),
+            PhraseRendition.path.is_not(None),
+        )
+    ).first()
+
+
+def delete_phrases(session: Session, phrases: list[Phrase]) -> int:
+    if not phrases:
+        return 0
+    ids = [p.id for p in phrases]
+    for r in session.exec(select(PhraseRendition).where(PhraseRendition.phrase_id.in_(ids))).all():
+        if r.path:
+            Path(r.path).unlink(missing_ok=True)
+        session.delete(r)
+    for p in phrases:
+        session.delete(p)
+    session.commit()
+    return len(ids)
+
+
+def library_stats(session: Session, user_id: int) -> list[dict]:
+    """Per voice: phrases, how many are rendered, and the share of /tts calls served from the library."""
+    phrases = {
+        voice_id: (int(n), int(ready or 0))
+        for voice_id, n, ready in session.exec(
+            select(
+                Phrase.voice_id,
+                func.count(Phrase.id),
+                func.sum(case((Phrase.status == "ready", 1), else_=0)),
+            )
+            .where(Phrase.user_id == user_id)
+            .group_by(Phrase.voice_id)
+        )
+    }
+    longform_ids = select(LongformJob.generation_id).where(LongformJob.generation_id.is_not(None))
+    calls = {
+        voice_id: (int(n), int(hits or 0))
+        for voice_id, n, hits in session.exec(
+            select(
+                Generation.voice_id,
+                func.count(Generation.id),
+                func.count(Generation.phrase_id),
+            )
+            .where(
+                Generation.user_id == user_id,
+                Generation.batch_id.is_(None),
+                Generation.voice_id.in_(list(phrases)),
+                Generation.id.not_in(longform_ids),
+            )
+            .group_by(Generation.voice_id)
+        )
+    }
+    out = []
+    for voice_id, (n, ready) in sorted(phrases.items()):
+        tts_calls, hits = calls.get(voice_id, (0, 0))
+        out.append({
+            "voice_id": voice_id,
+            "phrases": n,
+            "phrases_ready": ready,
+            "tts_calls": tts_calls,
+            "library_hits": hits,
+            "hit_rate": round(hits / tts_calls, 4) if tts_calls else None,
+        })
+    return out
+
+
+class PhraseRenderer:
+    """Pre-renders pending phrases whenever this process's GPU work has been idle for PHRASE_IDLE_S."""
+
+    def __init__(self) -> None:
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.rendered = 0
+        self.failed = 0
+
+    def start(self, settings: Settings) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(settings,), name="phrase-renderer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _idle(self, settings: Settings) -> bool:
+        return (
+            not self._stop.is_set()
+            and not drain.active(settings)
+            and inference.idle_for() >= settings.phrase_idle_s
+            and inference.ready()
+        )
+
+    def _run(self, settings: Settings) -> None:
+        while not self._stop.wait(settings.phrase_poll_s):
+            try:
+                while self._idle(settings) and self.render_batch(settings):
+                    pass
+            except Exception:
+                log.exception("Phrase pre-rendering failed")
+
+    @staticmethod
+    def _claimable(now):
+        stale = now - timedelta(seconds=RENDER_LEASE_S)
+        return or_(
+            and_(Phrase.status == "pending", or_(Phrase.retry_at.is_(None), Phrase.retry_at <= now)),
+            and_(Phrase.status == "rendering", Phrase.updated_at < stale),
+        )
+
+    def _claim(self, settings: Settings) -> tuple[list[int], datetime]:
+        now = now_utc()
+        with Session(get_engine()) as session:
+            first = session.exec(select(Phrase).where(self._claimable(now)).order_by(Phrase.id).limit(1)).first()
+            if first is None:
+                return [], now
+            # One model call takes one temperature; languages and voices may differ per item
+            candidates = session.exec(
+                select(Phrase.id)
+                .where(self._claimable(now), Phrase.temperature == first.temperature)
+                .order_by(Phrase.id)
+                .limit(max(1, settings.phrase_batch_size))
+            ).all()
+        claimed = []
+        with get_engine().begin() as conn:
+            for pid in candidates:
+                n = conn.execute(
+                    update(Phrase).where(Phrase.id == pid, self._claimable(now)).values(status="rendering", updated_at=now)
+                ).rowcount
+                if n == 1:
+                    claimed.append(pid)
+        return claimed, now
+
+    @staticmethod
+    def _finish(session: Session, phrase_id: int, claimed_at: datetime) -> None:
+        """
+        Marks a rendered phrase ready, unless it was re-registered meanwhile
+        (new updated_at) or still has renditions without a file; then it goes
+        back to pending so the missing renditions are rendered next time.
+        """
+        ours = and_(Phrase.id == phrase_id, Phrase.status == "rendering", Phrase.updated_at == claimed_at)
+        missing = exists().where(PhraseRendition.phrase_id == phrase_id, PhraseRendition.path.is_(None))
+        ts = now_utc()
+        done = session.execute(
+            update(Phrase).where(ours, ~missing).values(status="ready", attempts=0, retry_at=None, updated_at=ts)
+        ).rowcount
+        if not done:
+            session.execute(update(Phrase).where(ours).values(status="pending", updated_at=ts))
+
+    def render_batch(self, settings: Settings) -> bool:
+        """Renders one batch of pending phrases; False when there was nothing to do."""
+        ids, claimed_at = self._claim(settings)
+        if not ids:
+            return False
+        with Session(get_engine()) as session:
+            phrases = session.exec(select(Phrase).where(Phrase.id.in_(ids)).order_by(Phrase.id)).all()
+            voices = {
+                v.id: v
+                for v in session.exec(
+                    select(Voice).where(Voice.id.in_({p.voice_id for p in phrases}), Voice.deleted_at.is_(None))
+                )
+            }
+            orphaned = [p for p in phrases if p.voice_id not in voices]
+            delete_phrases(session, orphaned)
+            phrases = [p for p in phrases if p.voice_id in voices]
+            if not phrases:
+                return True
+            try:
+                out_wavs, sr, _ = inference.synthesize_items(
+                    settings,
+                    {vid: voices[vid].prompt_blob for vid in {p.voice_id for p in phrases}},
+                    [p.voice_id for p in phrases],
+                    [p.text for p in phrases],
+                    [p.language for p in phrases],
+                    phrases[0].temperature,
+                )
+            except Exception as e:
+                log.exception("Pre-rendering %d phrases failed", len(phrases))
+                self._retry_later(session, settings, phrases, str(e) or e.__class__.__name__)
+                return True
+
+            pending: dict[int, list[PhraseRendition]] = {p.id: [] for p in phrases}
+            for r in session.exec(
+                select(PhraseRendition).where(PhraseRendition.phrase_id.in_(list(pending)), PhraseRendition.path.is_(None))
+            ):
+                pending[r.phrase_id].append(r)
+            for i, p in enumerate(phrases):
+                try:
+                    for r in pending[p.id]:
+                        opts = OutputOptions(r.requested_format, r.sample_rate, r.channels, r.bitrate_kbps)
+                        data, out_sr = encode_audio(out_wavs[i], sr, opts)
+                        r.path = write_output_bytes(settings, "phrases", p.user_id, data, opts.fmt)
+                        r.bytes = len(data)
+                        r.out_sample_rate = out_sr
+                        session.add(r)
+                        session.commit()
+                    self._finish(session, p.id, claimed_at)
+                    self.rendered += 1
+                except Exception as e:
+                    log.exception("Encoding phrase %s failed", p.id)
+                    # Renditions encoded so far are kept and served
+                    p.status, p.error, p.updated_at = "error", str(e) or e.__class__.__name__, now_utc()
+                    session.add(p)
+                    self.failed += 1
+                session.commit()
+        return True
+
+    def _retry_later(self, session: Session, settings: Settings, phrases: list[Phrase], error: str) -> None:
+        """The model call failed for the whole batch: usually transient, so back off and retry."""
+        ts = now_utc()
+        for p in phrases:
+            p.attempts += 1
+            p.error = error
+            p.updated_at = ts
+            if p.attempts >= settings.phrase_max_attempts:
+                p.status, p.retry_at = "error", None
+                self.failed += 1
+            else:
+                p.status = "pending"
+                p.retry_at = ts + timedelta(seconds=min(RETRY_BASE_S * 2 ** (p.attempts - 1), RETRY_MAX_S))
+            session.add(p)
+        session.commit()
+
+    def snapshot(self) -> dict:
+        return {"running": self._thread is not None, "rendered": self.rendered, "failed": self.failed}
+
+
+phrase_renderer = PhraseRenderer()
@@ -0,0 +1,263 @@
+# app/services/profiling.py
+"""
+On-demand profiling for admins (/admin/profile/*). Artifacts are written to
+DATA_DIR/profiles and downloaded through /admin/profiles/{name}.
+
+  - CPU sampling: a thread snapshots every thread's Python stack at a fixed
+    interval for a bounded time and writes collapsed stacks (`.folded`,
+    readable by flamegraph.pl / speedscope).
+  - torch.profiler: armed for the next N model calls in this process
+    (or an inference worker with INFERENCE_MODE=remote); writes a Chrome
+    trace plus an operator summary table.
+  - State dump: thread stacks and whatever scheduler/cache snapshots the
+    caller passes in, as JSON.
+
+Nothing runs while inactive: the model-call hook is one attribute check.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+
+from app.core.config import Settings
+
+log = logging.getLogger(__name__)
+
+KEEP_ARTIFACTS = 50
+ARTIFACT_NAME = re.compile(r"^[A-Za-z0-9_.-]+$")
+MIN_INTERVAL_MS = 1
+TOP_FUNCTIONS = 20
+
+
+def profiles_dir(settings: Settings) -> Path:
+    return settings.data_dir / "profiles"
+
+
+def artifact_path(settings: Settings, name: str) -> Path:
+    """Resolves a downloadable artifact name; ValueError for anything else."""
+    if not ARTIFACT_NAME.match(name) or name.startswith("."):
+        raise ValueError("Invalid artifact name")
+    path = profiles_dir(settings) / name
+    if not path.is_file():
+        raise FileNotFoundError(name)
+    return path
+
+
+def list_artifacts(settings: Settings) -> list[dict]:
+    d = profiles_dir(settings)
+    if not d.is_dir():
+        return []
+    out = []
+    for p in sorted(d.iterdir(), key=lambda p: p.stat().st_mtime, reverse=True):
+        if p.is_file() and not p.name.startswith("."):
+            st = p.stat()
+            out.append({
+                "name": p.name,
+                "bytes": st.st_size,
+                "created_at": datetime.fromtimestamp(st.st_mtime, timezone.utc).isoformat(),
+            })
+    return out
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profiler:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._cpu: Optional[dict] = None
+        self._torch: Optional[dict] = None
+        self.last_cpu: Optional[dict] = None
+        self.torch_armed = False  # read without the lock on every model call
+
+    # ---- artifacts ----
+
+    def _new_artifact(self, settings: Settings, kind: str, suffix: str) -> Path:
+        d = profiles_dir(settings)
+        d.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        path = d / f"{kind}-{stamp}-{os.getpid()}{suffix}"
+        n = 1
+        while path.exists():
+            n += 1
+            path = d / f"{kind}-{stamp}-{os.getpid()}-{n}{suffix}"
+        # Keep the directory bounded; oldest artifacts go first
+        files = sorted((p for p in d.iterdir() if p.is_file()), key=lambda p: p.stat().st_mtime)
+        for p in files[:max(0, len(files) - KEEP_ARTIFACTS + 1)]:
+            p.unlink(missing_ok=True)
+        return path
+
+    @staticmethod
+    def _write(path: Path, data: str) -> None:
+        tmp = path.with_name(f".{path.name}.tmp")
+        tmp.write_text(data, encoding="utf-8")
+        tmp.replace(path)
+
+    # ---- CPU sampling ----
+
+    def start_cpu(self, settings: Settings, seconds: float, interval_ms: float) -> dict:
+        if not 0 < seconds <= settings.profile_max_seconds:
+            raise ValueError(f"seconds must be between 0 and {settings.profile_max_seconds:g}")
+        if interval_ms < MIN_INTERVAL_MS:
+            raise ValueError(f"interval_ms must be at least {MIN_INTERVAL_MS}")
+        with self._lock:
+            if self._cpu is not None:
+                raise RuntimeError("A CPU profile is already running")
+            path = self._new_artifact(settings, "cpu", ".folded")
+            self._cpu = {"artifact": path.name, "seconds": seconds, "interval_ms": interval_ms, "started_at": time.time()}
+            info = dict(self._cpu)
+        threading.Thread(
+            target=self._sample, args=(path, seconds, interval_ms / 1000.0), name="cpu-profiler", daemon=True
+        ).start()
+        return info
+
+    def _sample(self, path: Path, seconds: float, interval: float) -> None:
+        me = threading.get_ident()
+        stacks: Counter[str] = Counter()
+        self_time: Counter[str] = Counter()
+        samples = 0
+        try:
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    labels = []
+                    f = frame
+                    while f is not None:
+                        labels.append(_frame_label(f.f_code))
+                        f = f.f_back
+                    labels.append(names.get(ident, f"thread-{ident}"))
+                    labels.reverse()
+                    stacks[";".join(labels)] += 1
+                    self_time[labels[-1]] += 1
+                samples += 1
+                time.sleep(interval)
+            self._write(path, "".join(f"{stack} {n}\n" for stack, n in stacks.most_common()))
+            top = [{"function": fn, "samples": n} for fn, n in self_time.most_common(TOP_FUNCTIONS)]
+            log.info("CPU profile written to %s (%d samples)", path, samples)
+        except Exception as e:
+            log.exception("CPU profile failed")
+            top = [{"error": str(e)}]
+        with self._lock:
+            self.last_cpu = {**(self._cpu or {}), "samples": samples, "top_self": top}
+            self._cpu = None
+
+    # ---- torch.profiler ----
+
+    def start_torch(self, settings: Settings, generations: int) -> dict:
+        if not 0 < generations <= settings.profile_max_generations:
+            raise ValueError(f"generations must be between 1 and {settings.profile_max_generations}")
+        with self._lock:
+            if self._torch is not None:
+                raise RuntimeError("A torch profile is already armed")
+            path = self._new_artifact(settings, "torch", ".json")
+            self._torch = {"artifact": path.name, "generations": generations, "done": 0, "pid": os.getpid(), "_path": path, "_prof": None}
+            self.torch_armed = True
+            return _public(self._torch)
+
+    @contextmanager
+    def generation(self) -> Iterator[None]:
+        """Wraps one model call; records it while a torch profile is armed."""
+        if not self.torch_armed:
+            yield
+            return
+        with self._lock:
+            session = self._torch
+            if session is not None and session["_prof"] is None:
+                try:
+                    session["_prof"] = _start_torch_profiler()
+                except Exception:
+                    log.exception("Could not start torch profiler")
+                    self._torch, self.torch_armed, session = None, False, None
+        try:
+            yield
+        finally:
+            if session is not None:
+                self._generation_done(session)
+
+    def _generation_done(self, session: dict) -> None:
+        with self._lock:
+            session["done"] += 1
+            if session["done"] < session["generations"] or self._torch is not session:
+                return
+            self._torch = None
+            self.torch_armed = False
+        prof, path = session["_prof"], session["_path"]
+        try:
+            prof.stop()
+            prof.export_chrome_trace(str(path))
+            sort_by = "cuda_time_total" if _cuda_available() else "cpu_time_total"
+            table = prof.key_averages().table(sort_by=sort_by, row_limit=50)
+            self._write(path.with_suffix(".txt"), table)
+            log.info("torch profile written to %s", path)
+        except Exception:
+            log.exception("torch profile export failed")
+
+    # ---- state ----
+
+    def dump_state(self, settings: Settings, sections: dict) -> dict:
+        names = {t.ident: t for t in threading.enumerate()}
+        threads = []
+        for ident, frame in sys._current_frames().items():
+            t = names.get(ident)
+            threads.append({
+                "name": t.name if t else f"thread-{ident}",
+                "daemon": t.daemon if t else None,
+                "stack": [line.rstrip("\n") for line in traceback.format_stack(frame)],
+            })
+        state = {
+            "pid": os.getpid(),
+            "at": datetime.now(timezone.utc).isoformat(),
+            **sections,
+            "profiler": self.snapshot(),
+            "threads": sorted(threads, key=lambda t: t["name"]),
+        }
+        path = self._new_artifact(settings, "state", ".json")
+        self._write(path, json.dumps(state, indent=2, default=str))
+        return {"artifact": path.name, **state}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "cpu": dict(self._cpu) if self._cpu else None,
+                "torch": _public(self._torch) if self._torch else None,
+                "last_cpu": self.last_cpu,
+            }
+
+
+def _public(session: dict) -> dict:
+    return {k: v for k, v in session.items() if not k.startswith("_")}
+
+
+def _cuda_available() -> bool:
+    import torch
+
+    return torch.cuda.is_available()
+
+
+def _start_torch_profiler():
+    from torch.profiler import ProfilerActivity, profile
+
+    activities = [ProfilerActivity.CPU]
+    if _cuda_available():
+        activities.append(ProfilerActivity.CUDA)
+    prof = profile(activities=activities, record_shapes=True, profile_memory=True)
+    prof.start()
+    return prof
+
+
+profiler = Profiler()
@@ -0,0 +1,54 @@
+# app/services/prompt_cache.py
+from __future__ import annotations
+
+import hashlib
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from app.core.models import PromptCache
+from app.core.security import now_utc
+
+
+def prompt_cache_key(audio_sha256: str, ref_text: str, x_vector_only_mode: bool, model_revision: str) -> str:
+    h = hashlib.sha256()
+    for part in (audio_sha256, str(bool(x_vector_only_mode)), model_revision, ref_text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def get_cached_prompt(session: Session, key: str) -> Optional[bytes]:
+    row = session.exec(select(PromptCache).where(PromptCache.key == key)).first()
+    if row is None:
+        return None
+    row.hit_count += 1
+    row.last_hit_at = now_utc()
+    session.add(row)
+    session.commit()
+    return row.prompt_blob
+
+
+def put_cached_prompt(
+    session: Session,
+    key: str,
+    audio_sha256: str,
+    x_vector_only_mode: bool,
+    model_revision: str,
+    prompt_blob: bytes,
+) -> None:
+    row = PromptCache(
+        key=key,
+        audio_sha256=audio_sha256,
+        x_vector_only_mode=x_vector_only_mode,
+        model_revision=model_revision,
+        prompt_blob=prompt_blob,
+        created_at=now_utc(),
+    )
+    session.add(row)
+    try:
+        session.commit()
+    except IntegrityError:
+        # Another request derived the same prompt concurrently; theirs is equivalent.
+        session.rollback()
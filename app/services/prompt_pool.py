@@ -0,0 +1,146 @@
+# app/services/prompt_pool.py
+from __future__ import annotations
+
+import dataclasses
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+import torch
+
+from app.core.config import Settings
+from app.services.qwen_models import model_registry
+
+log = logging.getLogger(__name__)
+
+
+def _tensor_fields(prompt: Any) -> dict[str, torch.Tensor]:
+    return {
+        f.name: getattr(prompt, f.name)
+        for f in dataclasses.fields(prompt)
+        if isinstance(getattr(prompt, f.name), torch.Tensor)
+    }
+
+
+class PromptPool:
+    """
+    Device-resident voice-clone prompts. A voice's prompt tensors are copied
+    to the model device once (via pinned host memory, on a side stream so
+    prefetches don't stall generation) and reused by every request for that
+    voice. Entries are evicted least-recently-used to stay within
+    PROMPT_POOL_MB of VRAM. Without CUDA (or with a zero budget) prompts are
+    simply deserialized per request.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, tuple[Any, int]]" = OrderedDict()  # voice_id -> (prompt, bytes)
+        self._bytes = 0
+        self._stream = None
+        self._queue: "queue.Queue[Optional[tuple[Settings, int, bytes]]]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _enabled(self, settings: Settings) -> bool:
+        return settings.prompt_pool_mb > 0 and torch.cuda.is_available() and model_registry.base is not None
+
+    # ---- lookup ----
+
+    def get(self, settings: Settings, voice_id: int, blob: bytes) -> Any:
+        if not self._enabled(settings):
+            return model_registry.load_prompt(blob)
+        with self._lock:
+            entry = self._entries.get(voice_id)
+            if entry is not None:
+                self._entries.move_to_end(voice_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        return self._load(settings, voice_id, blob)
+
+    def _load(self, settings: Settings, voice_id: int, blob: bytes) -> Any:
+        prompt = model_registry.load_prompt(blob)
+        tensors = _tensor_fields(prompt)
+        size = sum(t.numel() * t.element_size() for t in tensors.values())
+        budget = settings.prompt_pool_mb * 1024 * 1024
+        if size > budget:
+            return prompt
+
+        device = model_registry.base.device
+        if self._stream is None:
+            self._stream = torch.cuda.Stream(device=device)
+        with torch.cuda.stream(self._stream):
+            moved = {k: t.pin_memory().to(device, non_blocking=True) for k, t in tensors.items()}
+        self._stream.synchronize()  # pinned buffers may be freed once the copy is done
+        resident = dataclasses.replace(prompt, **moved)
+
+        with self._lock:
+            existing = self._entries.get(voice_id)
+            if existing is not None:  # raced with another loader
+                self._entries.move_to_end(voice_id)
+                return existing[0]
+            while self._entries and self._bytes + size > budget:
+                _, (_, freed) = self._entries.popitem(last=False)
+                self._bytes -= freed
+                self.evictions += 1
+            self._entries[voice_id] = (resident, size)
+            self._bytes += size
+        return resident
+
+    def invalidate(self, voice_id: int) -> None:
+        with self._lock:
+            entry = self._entries.pop(voice_id, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+
+    # ---- prefetch ----
+
+    def prefetch(self, settings: Settings, voice_id: int, blob: bytes) -> None:
+        """Queues an upload (e.g. when a job for this voice is queued); returns immediately."""
+        if not self._enabled(settings):
+            return
+        with self._lock:
+            if voice_id in self._entries:
+                return
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="prompt-prefetch", daemon=True)
+                self._thread.start()
+        self._queue.put((settings, voice_id, blob))
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            settings, voice_id, blob = item
+            with self._lock:
+                if voice_id in self._entries:
+                    continue
+            try:
+                self._load(settings, voice_id, blob)
+            except Exception:
+                log.exception("Prompt prefetch failed for voice %s", voice_id)
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "voices": len(self._entries),
+                "resident_mb": round(self._bytes / 2**20, 2),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+prompt_pool = PromptPool()
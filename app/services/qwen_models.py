@@ -1,8 +1,10 @@
 # app/services/qwen_models.py
 from __future__ import annotations
 
+import hashlib
 import io
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Any, Optional
 
 from torch import bfloat16
@@ -15,10 +17,26 @@ from qwen_tts import Qwen3TTSModel  # type: ignore
 from qwen_tts.inference.qwen3_tts_model import VoiceClonePromptItem
 
 
+def model_revision(model_dir: str) -> str:
+    """
+    Short fingerprint of a model directory (config + weight file names/sizes).
+    Used to invalidate derived artifacts (e.g. cached prompts) when weights change.
+    """
+    root = Path(model_dir)
+    h = hashlib.sha256(root.name.encode("utf-8"))
+    config = root / "config.json"
+    if config.exists():
+        h.update(config.read_bytes())
+    for p in sorted(root.glob("*.safetensors")):
+        h.update(f"{p.name}:{p.stat().st_size}".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
 @dataclass
 class ModelRegistry:
     base: Optional[Any] = None
     voice_design: Optional[Any] = None
+    base_revision: str = ""
     loaded: bool = False
 
     def load(
@@ -30,6 +48,7 @@ class ModelRegistry:
     ) -> None:
         if self.loaded:
             return
+        self.base_revision = model_revision(base_dir)
         # Base model for prompt creation + voice clone
         if base_use_gpu:
             self.base = Qwen3TTSModel.from_pretrained(
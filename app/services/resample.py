@@ -0,0 +1,58 @@
+# app/services/resample.py
+"""
+Sample-rate conversion for generated audio (numpy only).
+
+Polyphase windowed-sinc: for a rate change by L/M (reduced fraction), every
+output sample is a dot product of 2*half input samples with one of L
+precomputed Kaiser-windowed sinc phases. Outputs are computed in blocks as
+one gathered matrix product, so there is no per-sample Python loop.
+"""
+from __future__ import annotations
+
+import math
+from functools import lru_cache
+
+import numpy as np
+
+ZERO_CROSSINGS = 16
+ROLLOFF = 0.945  # passband edge as a fraction of the lower Nyquist frequency
+KAISER_BETA = 8.6
+BLOCK = 16384  # output samples per gathered block
+
+
+@lru_cache(maxsize=32)
+def _filter_bank(sr_in: int, sr_out: int) -> tuple[int, int, np.ndarray]:
+    """(L, M, bank) with bank[p] the taps for output phase p (shape L x 2*half)."""
+    g = math.gcd(sr_in, sr_out)
+    up, down = sr_out // g, sr_in // g
+    cutoff = ROLLOFF * min(1.0, up / down)  # in units of the input Nyquist frequency
+    half = math.ceil(ZERO_CROSSINGS / cutoff)
+    offsets = np.arange(-half + 1, half + 1, dtype=np.float64)
+    # Distance (in input samples) from each tap to the exact output position
+    d = offsets[None, :] - (np.arange(up, dtype=np.float64) / up)[:, None]
+    window = np.i0(KAISER_BETA * np.sqrt(np.clip(1.0 - (d / (half + 1)) ** 2, 0.0, 1.0))) / np.i0(KAISER_BETA)
+    bank = cutoff * np.sinc(cutoff * d) * window
+    bank /= bank.sum(axis=1, keepdims=True)  # unity DC gain for every phase
+    return up, down, bank.astype(np.float32)
+
+
+def resample(x: np.ndarray, sr_in: int, sr_out: int) -> np.ndarray:
+    """Resamples a mono float signal from sr_in to sr_out (float32 result)."""
+    x = np.asarray(x, dtype=np.float32).reshape(-1)
+    if sr_in == sr_out or x.size == 0:
+        return x
+    up, down, bank = _filter_bank(sr_in, sr_out)
+    taps = bank.shape[1]
+    half = taps // 2
+    offsets = np.arange(-half + 1, half + 1)
+    padded = np.pad(x, (half, half + 1))
+
+    n_out = math.ceil(x.size * up / down)
+    out = np.empty(n_out, dtype=np.float32)
+    for start in range(0, n_out, BLOCK):
+        n = np.arange(start, min(start + BLOCK, n_out), dtype=np.int64)
+        pos = n * down
+        base, phase = pos // up, pos % up
+        frames = padded[(base + half)[:, None] + offsets[None, :]]
+        out[start:start + n.size] = np.einsum("ij,ij->i", frames, bank[phase])
+    return out
@@ -0,0 +1,369 @@
+# app/services/retention.py
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, func
+
+from app.core.config import Settings
+from app.core.db import get_engine
+from app.core.models import AudioFile, Generation, IdempotencyRecord, LongformJob, PhraseRendition, RuntimeStat, User
+from app.core.security import now_utc
+from app.services.audio_store import normalized_reference_path
+from app.services.derived import derived_root
+
+log = logging.getLogger(__name__)
+
+SWEEP_CHUNK = 500
+# One process (worker / instance) sweeps per interval; the claim lives in runtime_stats
+SWEEP_CLAIM_KEY = "retention_last_sweep"
+SWEEP_REPORT_KEY = "retention_last_report"
+SWEEP_CLAIM_SLACK = 0.9  # an interval counts as taken for this fraction of RETENTION_INTERVAL_MINUTES
+
+
+@dataclass
+class RetentionReport:
+    started_at: str
+    scan_seconds: float = 0.0
+    files_scanned: int = 0
+    files_deleted: int = 0
+    bytes_reclaimed: int = 0
+    expired: int = 0
+    over_quota: int = 0
+    unstored_outputs: int = 0
+    idempotency_expired: int = 0
+    orphans: int = 0
+    derived_evicted: int = 0
+    errors: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _delete_file(path: str, report: RetentionReport) -> None:
+    try:
+        size = os.stat(path).st_size
+        os.unlink(path)
+    except FileNotFoundError:
+        return
+    except OSError:
+        report.errors += 1
+        return
+    report.files_deleted += 1
+    report.bytes_reclaimed += size
+
+
+def _drop_stored_audio(session: Session, g: Generation, report: RetentionReport) -> None:
+    # The generation row stays (usage/billing); only the retained audio goes.
+    if g.audio_path:
+        _delete_file(g.audio_path, report)
+    g.audio_path = None
+    g.audio_sha256 = None
+    g.audio_bytes = None
+    session.add(g)
+    # A stored long-form job's row points at the same file
+    jobs = select(LongformJob).where(LongformJob.generation_id == g.id, LongformJob.audio_path.is_not(None))
+    for job in session.exec(jobs).all():
+        job.audio_path = None
+        session.add(job)
+
+
+def _stored_query(user_id: int):
+    return select(Generation).where(
+        Generation.user_id == user_id,
+        Generation.store == True,  # pylint: disable=singleton-comparison
+        Generation.audio_path.is_not(None),
+    )
+
+
+def _expire_stored(session: Session, settings: Settings, user: User, report: RetentionReport) -> None:
+    ttl_days = user.storage_ttl_days if user.storage_ttl_days is not None else settings.stored_ttl_days
+    if ttl_days <= 0:
+        return
+    cutoff = now_utc() - timedelta(days=ttl_days)
+    while True:
+        rows = session.exec(
+            _stored_query(user.id).where(Generation.created_at < cutoff).order_by(Generation.id).limit(SWEEP_CHUNK)
+        ).all()
+        if not rows:
+            return
+        for g in rows:
+            _drop_stored_audio(session, g, report)
+            report.expired += 1
+        session.commit()
+
+
+def _enforce_quota(session: Session, settings: Settings, user: User, report: RetentionReport) -> None:
+    quota_mb = user.storage_quota_mb if user.storage_quota_mb is not None else settings.storage_quota_mb
+    if quota_mb <= 0:
+        return
+
+    # Backfill sizes for rows stored before audio_bytes was recorded
+    for g in session.exec(_stored_query(user.id).where(Generation.audio_bytes.is_(None))).all():
+        try:
+            g.audio_bytes = os.stat(g.audio_path).st_size
+        except OSError:
+            g.audio_bytes = 0
+        session.add(g)
+    session.commit()
+
+    used = session.exec(
+        select(func.coalesce(func.sum(Generation.audio_bytes), 0)).where(
+            Generation.user_id == user.id,
+            Generation.store == True,  # pylint: disable=singleton-comparison
+            Generation.audio_path.is_not(None),
+        )
+    ).one()
+    excess = int(used) - quota_mb * 1024 * 1024
+    while excess > 0:
+        rows = session.exec(_stored_query(user.id).order_by(Generation.created_at, Generation.id).limit(SWEEP_CHUNK)).all()
+        if not rows:
+            return
+        for g in rows:
+            if excess <= 0:
+                break
+            excess -= g.audio_bytes or 0
+            _drop_stored_audio(session, g, report)
+            report.over_quota += 1
+        session.commit()
+
+
+def _expire_unstored_longform(session: Session, settings: Settings, report: RetentionReport) -> None:
+    # store=false long-form outputs are kept only long enough to be downloaded
+    cutoff = now_utc() - timedelta(hours=settings.unstored_ttl_hours)
+    rows = session.exec(
+        select(LongformJob).where(
+            LongformJob.store == False,  # pylint: disable=singleton-comparison
+            LongformJob.status == "done",
+            LongformJob.audio_path.is_not(None),
+            LongformJob.finished_at < cutoff,
+        )
+    ).all()
+    for job in rows:
+        _delete_file(job.audio_path, report)
+        job.audio_path = None
+        session.add(job)
+        report.unstored_outputs += 1
+    session.commit()
+
+
+def _expire_idempotency(session: Session, report: RetentionReport) -> None:
+    # Finished responses past their replay window (and abandoned in-progress claims)
+    while True:
+        rows = session.exec(
+            select(IdempotencyRecord).where(IdempotencyRecord.expires_at < now_utc()).limit(SWEEP_CHUNK)
+        ).all()
+        if not rows:
+            return
+        for rec in rows:
+            if rec.body_path:
+                _delete_file(rec.body_path, report)
+            session.delete(rec)
+            report.idempotency_expired += 1
+        session.commit()
+
+
+def _reconcile_orphans(session: Session, settings: Settings, report: RetentionReport) -> None:
+    """
+    Deletes files under media_dir that no row references (crashed requests,
+    pre-retention unstored outputs, abandoned temp files). Files younger than
+    the grace period are skipped so in-flight writes are never touched.
+    """
+    referenced: set[str] = set()
+    referenced.update(p for p in session.exec(select(Generation.audio_path).where(Generation.audio_path.is_not(None))))
+    referenced.update(p for p in session.exec(select(LongformJob.audio_path).where(LongformJob.audio_path.is_not(None))))
+    referenced.update(
+        p for p in session.exec(select(IdempotencyRecord.body_path).where(IdempotencyRecord.body_path.is_not(None)))
+    )
+    referenced.update(p for p in session.exec(select(PhraseRendition.path).where(PhraseRendition.path.is_not(None))))
+    for path, sha in session.exec(select(AudioFile.path, AudioFile.sha256)):
+        referenced.add(path)
+        referenced.add(str(normalized_reference_path(settings, sha)))
+    active_jobs = {
+        str(i)
+        for i in session.exec(select(LongformJob.id).where(LongformJob.status.in_(("queued", "running"))))
+    }
+    referenced = {os.path.normpath(p) for p in referenced}
+
+    grace_cutoff = time.time() - settings.orphan_grace_minutes * 60
+    for sub in ("gens", "batches", "audio", "tmp", "jobs", "idempotency", "phrases"):
+        root = settings.media_dir / sub
+        if not root.is_dir():
+            continue
+        for dirpath, dirnames, filenames in os.walk(root, topdown=True):
+            if sub == "jobs" and Path(dirpath) == root:
+                dirnames[:] = [d for d in dirnames if d not in active_jobs]
+            for name in filenames:
+                path = os.path.normpath(os.path.join(dirpath, name))
+                report.files_scanned += 1
+                if path in referenced:
+                    continue
+                try:
+                    if os.stat(path).st_mtime > grace_cutoff:
+                        continue
+                except OSError:
+                    continue
+                _delete_file(path, report)
+                report.orphans += 1
+        # Prune empty directories left behind (bottom-up, keep the roots)
+        for dirpath, _, _ in sorted(os.walk(root), key=lambda w: len(w[0]), reverse=True):
+            if Path(dirpath) != root:
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+
+def _sweep_derived(session: Session, settings: Settings, report: RetentionReport) -> None:
+    """
+    Trims the transcoding cache: assets whose source file is no longer kept
+    go first (so dropped stored audio does not live on as previews), then the
+    least recently served ones until the cache fits in DERIVED_CACHE_MB.
+    """
+    root = derived_root(settings)
+    if not root.is_dir():
+        return
+    sources = set(session.exec(select(AudioFile.sha256)))
+    sources.update(session.exec(select(Generation.audio_sha256).where(Generation.audio_sha256.is_not(None))))
+
+    grace_cutoff = time.time() - settings.orphan_grace_minutes * 60
+    kept: list[tuple[float, int, str]] = []
+    for src in os.scandir(root):
+        if not src.is_dir():
+            continue
+        for entry in os.scandir(src.path):
+            report.files_scanned += 1
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if entry.name.startswith("."):
+                # Temp file of a transcode that never finished
+                if st.st_mtime < grace_cutoff:
+                    _delete_file(entry.path, report)
+                continue
+            if src.name not in sources:
+                _delete_file(entry.path, report)
+                report.derived_evicted += 1
+            else:
+                kept.append((st.st_mtime, st.st_size, entry.path))
+        try:
+            os.rmdir(src.path)
+        except OSError:
+            pass
+
+    if settings.derived_cache_mb <= 0:
+        return
+    excess = sum(size for _, size, _ in kept) - settings.derived_cache_mb * 1024 * 1024
+    for _, size, path in sorted(kept):
+        if excess <= 0:
+            break
+        _delete_file(path, report)
+        report.derived_evicted += 1
+        excess -= size
+
+
+class RetentionEngine:
+    def __init__(self) -> None:
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.last_report: Optional[RetentionReport] = None
+
+    def start(self, settings: Settings) -> None:
+        if self._thread is not None or settings.retention_interval_minutes <= 0:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(settings,), name="retention", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self._thread = None
+
+    def _run(self, settings: Settings) -> None:
+        while not self._stop.wait(settings.retention_interval_minutes * 60):
+            try:
+                if self._claim_interval(settings):
+                    self.run_once(settings)
+            except Exception:
+                log.exception("Retention sweep failed")
+
+    @staticmethod
+    def _claim_interval(settings: Settings) -> bool:
+        """
+        Compare-and-swap on the start time of the last sweep: the first
+        process to wake up in an interval sweeps, the others skip it.
+        """
+        now = now_utc()
+        taken_since = now - timedelta(minutes=settings.retention_interval_minutes * SWEEP_CLAIM_SLACK)
+        try:
+            with get_engine().begin() as conn:
+                row = conn.execute(text("SELECT value FROM runtime_stats WHERE key = :k"), {"k": SWEEP_CLAIM_KEY}).first()
+                if row is None:
+                    conn.execute(
+                        text("INSERT INTO runtime_stats (key, value, updated_at) VALUES (:k, :v, :t)"),
+                        {"k": SWEEP_CLAIM_KEY, "v": now.isoformat(), "t": now},
+                    )
+                    return True
+                try:
+                    if datetime.fromisoformat(row.value) > taken_since:
+                        return False
+                except ValueError:
+                    pass
+                return conn.execute(
+                    text("UPDATE runtime_stats SET value = :v, updated_at = :t WHERE key = :k AND value = :old"),
+                    {"k": SWEEP_CLAIM_KEY, "v": now.isoformat(), "t": now, "old": row.value},
+                ).rowcount == 1
+        except IntegrityError:
+            return False  # another process inserted the first claim
+
+    def latest_report(self) -> Optional[dict]:
+        """The last sweep's report, whichever process ran it."""
+        with Session(get_engine()) as session:
+            row = session.get(RuntimeStat, SWEEP_REPORT_KEY)
+        if row is not None:
+            return json.loads(row.value)
+        return self.last_report.to_dict() if self.last_report else None
+
+    @staticmethod
+    def _save_report(session: Session, report: RetentionReport) -> None:
+        row = session.get(RuntimeStat, SWEEP_REPORT_KEY) or RuntimeStat(key=SWEEP_REPORT_KEY, value="")
+        row.value = json.dumps(report.to_dict())
+        row.updated_at = now_utc()
+        session.add(row)
+        session.commit()
+
+    def run_once(self, settings: Settings) -> RetentionReport:
+        with self._lock:
+            report = RetentionReport(started_at=now_utc().isoformat())
+            t0 = time.perf_counter()
+            with Session(get_engine()) as session:
+                for user in session.exec(select(User)).all():
+                    _expire_stored(session, settings, user, report)
+                    _enforce_quota(session, settings, user, report)
+                _expire_unstored_longform(session, settings, report)
+                _expire_idempotency(session, report)
+                _reconcile_orphans(session, settings, report)
+                _sweep_derived(session, settings, report)
+                report.scan_seconds = round(time.perf_counter() - t0, 3)
+                self._save_report(session, report)
+            self.last_report = report
+            log.info("Retention sweep: %s", report.to_dict())
+            return report
+
+
+retention_engine = RetentionEngine()
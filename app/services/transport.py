@@ -0,0 +1,304 @@
+# app/services/transport.py
+"""
+Transports between API processes and inference workers (INFERENCE_MODE=remote).
+
+Every transport moves plain dict messages:
+  job   {"id", "client", "op", "args"}          API -> any worker
+  reply {"id", "ok", "value" | "error"}          worker -> the API process `client`
+and has its own encoding for audio (lists of float32 arrays) in replies.
+
+  mp     multiprocessing manager queues served by `python -m app.worker` on
+         INFERENCE_ADDRESS. When the API process and the worker share
+         INFERENCE_SHM_DIR (same host, or containers sharing /dev/shm), audio
+         is written once into a file there and memory-mapped by the API
+         process (no copy through the queue). The API process leaves a
+         marker file there so the worker can tell; otherwise (workers on
+         another host) audio travels inline.
+  redis  Redis lists (LPUSH/BRPOP) on REDIS_URL; audio always travels inline,
+         since workers are usually on other hosts. Any client object with
+         lpush/brpop/expire/delete (e.g. fakeredis) can be passed in.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import mmap
+import os
+import queue
+import threading
+import uuid
+from multiprocessing.managers import BaseManager
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from app.core.config import Settings
+
+
+class Transport:
+    # API side
+    def send(self, job: dict) -> None:
+        raise NotImplementedError
+
+    def receive(self, client_id: str, timeout: float) -> Optional[dict]:
+        raise NotImplementedError
+
+    def unpack_audio(self, packed: Any) -> list:
+        raise NotImplementedError
+
+    def close(self, client_id: str) -> None:
+        """Releases this API process's reply channel (on shutdown)."""
+
+    # worker side
+    def next_job(self, timeout: float) -> Optional[dict]:
+        raise NotImplementedError
+
+    def reply(self, client_id: str, reply: dict) -> None:
+        raise NotImplementedError
+
+    def pack_audio(self, wavs: list, client_id: str) -> Any:
+        raise NotImplementedError
+
+
+def pack_inline(wavs: list) -> dict:
+    return {"f32": [np.ascontiguousarray(w, dtype=np.float32).tobytes() for w in wavs]}
+
+
+def unpack_inline(packed: dict) -> list:
+    return [np.frombuffer(b, dtype=np.float32) for b in packed["f32"]]
+
+
+# ---- multiprocessing + shared memory ----
+
+_jobs: "queue.Queue[dict]" = queue.Queue()
+_replies: dict[str, "queue.Queue[dict]"] = {}
+
+
+def _get_jobs() -> "queue.Queue[dict]":
+    return _jobs
+
+
+def _get_replies(client_id: str) -> "queue.Queue[dict]":
+    return _replies.setdefault(client_id, queue.Queue())
+
+
+def _drop_replies(client_id: str) -> None:
+    _replies.pop(client_id, None)
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+QueueManager.register("jobs", callable=_get_jobs)
+QueueManager.register("replies", callable=_get_replies)
+QueueManager.register("drop_replies", callable=_drop_replies)
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def queue_manager(settings: Settings) -> QueueManager:
+    authkey = (settings.inference_authkey or settings.hmac_secret).encode("utf-8")
+    return QueueManager(address=parse_address(settings.inference_address), authkey=authkey)
+
+
+class MpTransport(Transport):
+    def __init__(self, settings: Settings) -> None:
+        self._settings = settings
+        self._manager: Optional[QueueManager] = None
+        self._jobs = None
+        self._reply_queues: dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._markers: dict[str, Path] = {}  # API side: client id -> marker in INFERENCE_SHM_DIR
+        self._shared: dict[str, bool] = {}  # worker side: client id -> shares INFERENCE_SHM_DIR
+
+    def _connect(self) -> QueueManager:
+        # Request threads and the reply reader race to the first connection
+        with self._lock:
+            if self._manager is None:
+                manager = queue_manager(self._settings)
+                manager.connect()
+                self._jobs = manager.jobs()
+                self._manager = manager
+            return self._manager
+
+    def _replies(self, client_id: str):
+        q = self._reply_queues.get(client_id)
+        if q is None:
+            q = self._connect().replies(client_id)
+            if len(self._reply_queues) > 256:
+                self._reply_queues.clear()
+            self._reply_queues[client_id] = q
+        return q
+
+    def _reset(self) -> None:
+        # Reconnect on next use (e.g. the worker launcher was restarted)
+        with self._lock:
+            self._manager = None
+            self._jobs = None
+            self._reply_queues.clear()
+
+    def _marker(self, client_id: str) -> Path:
+        return Path(self._settings.inference_shm_dir) / f"qtts-client-{client_id}"
+
+    def _announce(self, client_id: str) -> None:
+        # Lets a worker see that it can hand this process audio through INFERENCE_SHM_DIR
+        if client_id in self._markers:
+            return
+        path = self._marker(client_id)
+        try:
+            path.touch()
+        except OSError:
+            pass  # no usable shm dir here: workers fall back to inline audio
+        self._markers[client_id] = path
+
+    def send(self, job: dict) -> None:
+        if job.get("client"):
+            self._announce(job["client"])
+        try:
+            self._connect()
+            self._jobs.put(job)
+        except (OSError, EOFError):
+            self._reset()
+            raise ConnectionError(f"Inference queue server unreachable at {self._settings.inference_address}")
+
+    def receive(self, client_id: str, timeout: float) -> Optional[dict]:
+        try:
+            return self._replies(client_id).get(timeout=timeout)
+        except queue.Empty:
+            return None
+        except (OSError, EOFError):
+            self._reset()
+            raise ConnectionError(f"Inference queue server unreachable at {self._settings.inference_address}")
+
+    def close(self, client_id: str) -> None:
+        marker = self._markers.pop(client_id, None)
+        if marker is not None:
+            marker.unlink(missing_ok=True)
+        # Otherwise the queue server keeps this process's reply queue forever
+        if self._manager is None:
+            return
+        try:
+            self._manager.drop_replies(client_id)
+        except (OSError, EOFError):
+            pass
+        self._reset()
+
+    def next_job(self, timeout: float) -> Optional[dict]:
+        self._connect()
+        try:
+            return self._jobs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def reply(self, client_id: str, reply: dict) -> None:
+        self._replies(client_id).put(reply)
+
+    def pack_audio(self, wavs: list, client_id: str) -> dict:
+        shared = self._shared.get(client_id)
+        if shared is None:
+            shared = self._shared[client_id] = self._marker(client_id).exists()
+            if len(self._shared) > 256:
+                self._shared.clear()
+        if not shared:
+            return pack_inline(wavs)
+        # One write into tmpfs; the receiver maps the same pages
+        arrays = [np.ascontiguousarray(w, dtype=np.float32).reshape(-1) for w in wavs]
+        path = Path(self._settings.inference_shm_dir) / f"qtts-{uuid.uuid4().hex}"
+        with open(path, "xb") as f:
+            for a in arrays:
+                f.write(a.data)
+        return {"shm": str(path), "lengths": [len(a) for a in arrays]}
+
+    def unpack_audio(self, packed: dict) -> list:
+        if "f32" in packed:
+            return unpack_inline(packed)
+        path, lengths = packed["shm"], packed["lengths"]
+        try:
+            with open(path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) if size else None
+        finally:
+            # The mapping outlives the name; pages are freed when the arrays are
+            Path(path).unlink(missing_ok=True)
+        base = np.frombuffer(mm, dtype=np.float32) if mm is not None else np.zeros(0, dtype=np.float32)
+        out, offset = [], 0
+        for n in lengths:
+            out.append(base[offset:offset + n])
+            offset += n
+        return out
+
+
+# ---- Redis ----
+
+def _json_default(o: Any) -> Any:
+    if isinstance(o, (bytes, bytearray)):
+        return {"__b64__": base64.b64encode(bytes(o)).decode("ascii")}
+    raise TypeError(f"Not serializable: {type(o).__name__}")
+
+
+def _json_hook(d: dict) -> Any:
+    if len(d) == 1 and "__b64__" in d:
+        return base64.b64decode(d["__b64__"])
+    return d
+
+
+def dumps(msg: dict) -> bytes:
+    return json.dumps(msg, default=_json_default).encode("utf-8")
+
+
+def loads(raw: bytes) -> dict:
+    return json.loads(raw, object_hook=_json_hook)
+
+
+class RedisTransport(Transport):
+    REPLY_TTL_S = 3600
+
+    def __init__(self, settings: Settings, client: Any = None) -> None:
+        if client is None:
+            import redis  # optional dependency, only needed for INFERENCE_TRANSPORT=redis
+
+            client = redis.Redis.from_url(settings.redis_url)
+        self._r = client
+        self._prefix = settings.inference_queue_prefix
+        self._jobs_key = f"{self._prefix}:jobs"
+
+    def _reply_key(self, client_id: str) -> str:
+        return f"{self._prefix}:replies:{client_id}"
+
+    def send(self, job: dict) -> None:
+        self._r.lpush(self._jobs_key, dumps(job))
+
+    def receive(self, client_id: str, timeout: float) -> Optional[dict]:
+        item = self._r.brpop(self._reply_key(client_id), timeout=max(1, int(timeout)))
+        return loads(item[1]) if item else None
+
+    def close(self, client_id: str) -> None:
+        self._r.delete(self._reply_key(client_id))
+
+    def next_job(self, timeout: float) -> Optional[dict]:
+        item = self._r.brpop(self._jobs_key, timeout=max(1, int(timeout)))
+        return loads(item[1]) if item else None
+
+    def reply(self, client_id: str, reply: dict) -> None:
+        key = self._reply_key(client_id)
+        self._r.lpush(key, dumps(reply))
+        self._r.expire(key, self.REPLY_TTL_S)  # replies to vanished API processes expire
+
+    def pack_audio(self, wavs: list, client_id: str) -> dict:
+        return pack_inline(wavs)
+
+    def unpack_audio(self, packed: dict) -> list:
+        return unpack_inline(packed)
+
+
+def make_transport(settings: Settings) -> Transport:
+    if settings.inference_transport == "mp":
+        return MpTransport(settings)
+    if settings.inference_transport == "redis":
+        return RedisTransport(settings)
+    raise ValueError(f"Unknown INFERENCE_TRANSPORT: {settings.inference_transport} (mp|redis)")
@@ -0,0 +1,95 @@
+# app/worker.py
+"""
+Inference worker processes for INFERENCE_MODE=remote:
+    python -m app.worker [--workers N]
+
+Each worker loads the models once and serves jobs from the transport
+(INFERENCE_TRANSPORT). With the mp transport this process also hosts the
+queue server on INFERENCE_ADDRESS that API processes connect to.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import multiprocessing
+import multiprocessing.connection
+import signal
+from typing import Any, Callable
+
+from app.core.config import Settings
+
+log = logging.getLogger(__name__)
+
+
+def _interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def serve(settings: Settings) -> None:
+    # Imported here: the launcher process never loads torch
+    from app.core.startup import load_models_or_raise
+    from app.services.inference_local import LocalBackend, execute
+    from app.services.transport import make_transport
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(processName)s %(message)s")
+    load_models_or_raise(settings)
+    backend = LocalBackend()
+    transport = make_transport(settings)
+    log.info("Inference worker ready (%s transport)", settings.inference_transport)
+
+    while True:
+        job = transport.next_job(timeout=1.0)
+        if job is not None:
+            handle_job(transport, job, lambda op, args: execute(backend, settings, op, args))
+
+
+def handle_job(transport, job: dict, run: Callable[[str, dict], Any]) -> None:
+    """Runs one job with run(op, args) and replies to the API process that sent it (if any)."""
+    try:
+        value = run(job["op"], job["args"])
+        if isinstance(value, dict) and "wavs" in value:
+            value["wavs"] = transport.pack_audio(value["wavs"], job.get("client") or "")
+        reply = {"id": job["id"], "ok": True, "value": value}
+    except Exception as e:
+        log.exception("Inference job %s (%s) failed", job["id"], job["op"])
+        reply = {"id": job["id"], "ok": False, "error": str(e) or e.__class__.__name__}
+    if job.get("client"):
+        transport.reply(job["client"], reply)
+
+
+def main(argv: list[str] | None = None) -> int:
+    settings = Settings()
+    parser = argparse.ArgumentParser(prog="python -m app.worker")
+    parser.add_argument("--workers", type=int, default=settings.inference_workers, help="worker processes (each loads the models)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    server = None
+    if settings.inference_transport == "mp":
+        from app.services.transport import queue_manager
+
+        server = queue_manager(settings)
+        server.start()
+        log.info("Inference queue server on %s", settings.inference_address)
+
+    ctx = multiprocessing.get_context("spawn")  # CUDA cannot be used in forked children
+    procs = [ctx.Process(target=serve, args=(settings,), name=f"inference-{i}", daemon=True) for i in range(max(1, args.workers))]
+    for p in procs:
+        p.start()
+    signal.signal(signal.SIGTERM, _interrupt)
+    try:
+        # A worker that dies (e.g. missing model dirs) takes the whole group down
+        multiprocessing.connection.wait([p.sentinel for p in procs])
+        code = next(p.exitcode for p in procs if p.exitcode is not None)
+    except KeyboardInterrupt:
+        code = 0
+    finally:
+        for p in procs:
+            p.terminate()
+        if server is not None:
+            server.shutdown()
+    return code
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -5,6 +5,10 @@ set -euo pipefail
 : "${HOST:=0.0.0.0}"
 : "${PORT:=8000}"
 : "${WORKERS:=1}"
+: "${DRAIN_TIMEOUT_S:=120}"  # in-flight requests get this long to finish on shutdown
+# Requests have already drained when uvicorn closes the listener (see app/services/drain.py);
+# this only bounds closing what is left. Keep DRAIN_TIMEOUT_S + this under the stop grace period.
+: "${HTTP_CLOSE_TIMEOUT_S:=10}"
 
 : "${MODEL_BASE_REPO:=Qwen/Qwen3-TTS-12Hz-1.7B-Base}"
 : "${MODEL_VOICEDESIGN_REPO:=Qwen/Qwen3-TTS-12Hz-1.7B-VoiceDesign}"
@@ -31,8 +35,19 @@ download_if_missing() {
 download_if_missing "${MODEL_BASE_REPO}" "${BASE_DIR}"
 download_if_missing "${MODEL_VOICEDESIGN_REPO}" "${VOICEDESIGN_DIR}"
 
+# INFERENCE_MODE=remote: models live in separate worker processes; the API
+# processes (WORKERS) only talk to them. Set START_INFERENCE_WORKERS=0 when
+# the workers run in another container/host.
+: "${INFERENCE_MODE:=local}"
+: "${START_INFERENCE_WORKERS:=1}"
+if [[ "${INFERENCE_MODE}" == "remote" && "${START_INFERENCE_WORKERS}" == "1" ]]; then
+  echo "[entrypoint] Starting inference workers (python -m app.worker)"
+  python -m app.worker &
+fi
+
 echo "[entrypoint] Starting FastAPI (uvicorn) on ${HOST}:${PORT}"
 exec python -m uvicorn server:app \
   --host "${HOST}" \
   --port "${PORT}" \
-  --workers "${WORKERS}"
\ No newline at end of file
+  --workers "${WORKERS}" \
+  --timeout-graceful-shutdown "${HTTP_CLOSE_TIMEOUT_S}"
\ No newline at end of file
@@ -0,0 +1,22 @@
+# tests/conftest.py
+from __future__ import annotations
+
+import pytest
+
+_throughput: list[tuple[str, str, float]] = []
+
+
+@pytest.fixture
+def report_throughput():
+    """report_throughput(backend, what, per_second): listed at the end of the run."""
+    def report(backend: str, what: str, per_second: float) -> None:
+        _throughput.append((backend, what, per_second))
+    return report
+
+
+def pytest_terminal_summary(terminalreporter):
+    if not _throughput:
+        return
+    terminalreporter.section("database throughput")
+    for backend, what, rate in _throughput:
+        terminalreporter.write_line(f"{backend:<12} {what:<40} {rate:>10.0f}/s")
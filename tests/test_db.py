@@ -0,0 +1,267 @@
+# tests/test_db.py
+"""
+Database behaviour that differs between backends, run against SQLite and,
+when TEST_DATABASE_URL points at a throwaway PostgreSQL database (and psycopg
+is installed), against PostgreSQL too. Tables are dropped and recreated there.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+import time
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import func, select, text
+from sqlmodel import Session, SQLModel
+
+import app.core.models  # noqa: F401  (registers tables on SQLModel.metadata)
+from app.cli import cmd_copy_db
+from app.core.config import Settings
+from app.core.db import make_engine
+from app.core.models import AudioFile, RuntimeStat, User, Voice
+from app.core.security import now_utc
+from app.services import batch_discount
+from app.services.batch_discount import BatchCalibrator
+from app.services.pagination import before_cursor, encode_cursor
+
+PG_URL = os.getenv("TEST_DATABASE_URL", "")
+THROUGHPUT_ROWS = 400
+THROUGHPUT_THREADS = 4
+
+
+def _postgres_available() -> bool:
+    if not PG_URL.startswith("postgresql"):
+        return False
+    try:
+        import psycopg  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+BACKENDS = [
+    "sqlite",
+    pytest.param(
+        "postgresql",
+        marks=pytest.mark.skipif(not _postgres_available(), reason="TEST_DATABASE_URL (PostgreSQL) / psycopg not available"),
+    ),
+]
+
+
+def _url(backend: str, tmp_path, name: str = "db") -> str:
+    return f"sqlite:///{tmp_path / f'{name}.sqlite3'}" if backend == "sqlite" else PG_URL
+
+
+@pytest.fixture(params=BACKENDS)
+def engine(request, tmp_path):
+    eng = make_engine(_url(request.param, tmp_path), Settings())
+    SQLModel.metadata.drop_all(eng)
+    SQLModel.metadata.create_all(eng)
+    yield eng
+    SQLModel.metadata.drop_all(eng)
+    eng.dispose()
+
+
+def _seed_voices(engine, n: int, same_timestamp_every: int = 3) -> tuple[int, list[int]]:
+    """n voices for one user; groups of voices share created_at so the id tiebreak matters."""
+    base = now_utc()
+    with Session(engine) as s:
+        user = User(created_at=base, is_active=True)
+        audio = AudioFile(sha256="0" * 64, path="/dev/null", fmt="wav", created_at=base)
+        s.add(user)
+        s.add(audio)
+        s.commit()
+        for i in range(n):
+            s.add(Voice(
+                user_id=user.id,
+                name=f"v{i}",
+                ref_audio_file_id=audio.id,
+                ref_text="hello",
+                prompt_blob=b"\0" * 16,
+                created_at=base + timedelta(seconds=i // same_timestamp_every),
+            ))
+        s.commit()
+        ids = list(s.exec(select(Voice.id).order_by(Voice.created_at.desc(), Voice.id.desc())).scalars())
+        return user.id, ids
+
+
+def test_keyset_pages_cover_every_row_once(engine):
+    user_id, expected = _seed_voices(engine, 50)
+    seen: list[int] = []
+    cursor = None
+    with Session(engine) as s:
+        while True:
+            q = select(Voice).where(Voice.user_id == user_id, Voice.deleted_at.is_(None))
+            if cursor:
+                q = q.where(before_cursor(Voice.created_at, Voice.id, cursor))
+            page = s.exec(q.order_by(Voice.created_at.desc(), Voice.id.desc()).limit(7)).scalars().all()
+            seen.extend(v.id for v in page)
+            if len(page) < 7:
+                break
+            cursor = encode_cursor(page[-1].created_at, page[-1].id)
+    assert seen == expected
+
+
+def test_keyset_cursor_is_stable_under_inserts(engine):
+    user_id, expected = _seed_voices(engine, 10)
+    with Session(engine) as s:
+        first = s.exec(
+            select(Voice).where(Voice.user_id == user_id).order_by(Voice.created_at.desc(), Voice.id.desc()).limit(4)
+        ).scalars().all()
+        cursor = encode_cursor(first[-1].created_at, first[-1].id)
+        first_ids = [v.id for v in first]
+        # A newer voice arriving between pages must not shift the next page
+        s.add(Voice(
+            user_id=user_id, name="new", ref_audio_file_id=first[0].ref_audio_file_id, ref_text="x",
+            prompt_blob=b"", created_at=now_utc() + timedelta(days=1),
+        ))
+        s.commit()
+        rest = s.exec(
+            select(Voice.id)
+            .where(Voice.user_id == user_id, before_cursor(Voice.created_at, Voice.id, cursor))
+            .order_by(Voice.created_at.desc(), Voice.id.desc())
+        ).scalars().all()
+    assert first_ids + list(rest) == expected
+
+
+def test_runtime_stat_merge_inserts_then_blends(engine):
+    cal = BatchCalibrator()
+    assert cal._merge(engine, "test:key", 1.0, 0.5) == 1.0
+    assert cal._merge(engine, "test:key", 3.0, 0.5) == pytest.approx(2.0)
+    with Session(engine) as s:
+        assert float(s.get(RuntimeStat, "test:key").value) == pytest.approx(2.0)
+
+
+def test_runtime_stat_merge_concurrent_writers(engine):
+    """Workers flushing the same key at once: no lost merges (each either lands or reports None to retry)."""
+    cal = BatchCalibrator()
+    cal._merge(engine, "test:cas", 0.0, 1.0)
+    results: list = []
+    lock = threading.Lock()
+
+    def flush() -> None:
+        for _ in range(10):
+            r = cal._merge(engine, "test:cas", 1.0, 0.1)
+            with lock:
+                results.append(r)
+
+    threads = [threading.Thread(target=flush) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    landed = sum(r is not None for r in results)
+    assert landed >= 1
+    with Session(engine) as s:
+        value = float(s.get(RuntimeStat, "test:cas").value)
+    # Each landed merge moves the value 10% of the way to 1.0
+    assert value == pytest.approx(1 - 0.9 ** landed)
+
+
+def test_calibration_flush_shares_buckets_between_processes(engine, monkeypatch):
+    """Two calibrators stand in for two workers: each sees the other's buckets after a flush."""
+    monkeypatch.setattr(batch_discount, "get_engine", lambda: engine)
+    settings = Settings()
+    a, b = BatchCalibrator(), BatchCalibrator()
+    a._settings = b._settings = settings
+    for cal in (a, b):
+        cal.observe_single(settings, 100, 1000)
+    a.observe_batch(settings, 8, 800, 6000)
+    assert b.discount(settings, 8, 100) == settings.batch_discount_default
+    a.flush()
+    b.flush()
+    assert b.discount(settings, 8, 100) == a.discount(settings, 8, 100) == pytest.approx(0.75)
+
+    # A bucket b observed locally since its last flush keeps the local value until it is merged
+    b.observe_batch(settings, 8, 800, 5000)
+    local = b.discount(settings, 8, 100)
+    a.observe_batch(settings, 8, 800, 8000)
+    a.flush()
+    b._reload(engine)
+    assert b.discount(settings, 8, 100) == local
+    b.flush()
+    a.flush()
+    assert a.discount(settings, 8, 100) == b.discount(settings, 8, 100)
+
+
+def test_copy_db(engine, tmp_path, capsys):
+    src_url = f"sqlite:///{tmp_path / 'source.sqlite3'}"
+    src = make_engine(src_url, Settings())
+    SQLModel.metadata.create_all(src)
+    user_id, voice_ids = _seed_voices(src, 12)
+    with Session(src) as s:
+        s.add(RuntimeStat(key="k", value="1.5", updated_at=now_utc()))
+        s.commit()
+
+    target = engine.url.render_as_string(hide_password=False)
+    args = argparse.Namespace(source=src_url, target=target, force=False)
+    assert cmd_copy_db(args) == 0
+    # Refuses to copy into non-empty tables without --force
+    assert cmd_copy_db(args) == 1
+    capsys.readouterr()
+
+    with Session(engine) as s:
+        assert s.exec(select(func.count()).select_from(Voice)).scalars().one() == 12
+        assert sorted(s.exec(select(Voice.id)).scalars().all()) == sorted(voice_ids)
+        assert s.get(RuntimeStat, "k").value == "1.5"
+        # Sequences (PostgreSQL) were moved past the copied ids
+        new = Voice(
+            user_id=user_id, name="after-copy", ref_audio_file_id=1, ref_text="x", prompt_blob=b"", created_at=now_utc()
+        )
+        s.add(new)
+        s.commit()
+        assert new.id > max(voice_ids)
+    src.dispose()
+
+
+def test_throughput(engine, report_throughput):
+    """
+    Request-shaped load, for comparing backends (see the summary at the end of
+    the run): one commit per row from several threads, then keyset page reads.
+    """
+    user_id, _ = _seed_voices(engine, 1)
+    with Session(engine) as s:
+        audio_id = s.exec(select(AudioFile.id)).scalars().first()
+    backend = engine.dialect.name
+
+    def write(worker: int) -> None:
+        for i in range(THROUGHPUT_ROWS // THROUGHPUT_THREADS):
+            with Session(engine) as s:
+                s.add(Voice(
+                    user_id=user_id, name=f"t{worker}-{i}", ref_audio_file_id=audio_id, ref_text="x",
+                    prompt_blob=b"\0" * 1024, created_at=now_utc(),
+                ))
+                s.commit()
+
+    threads = [threading.Thread(target=write, args=(w,)) for w in range(THROUGHPUT_THREADS)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report_throughput(backend, f"inserts, {THROUGHPUT_THREADS} threads", THROUGHPUT_ROWS / (time.perf_counter() - t0))
+
+    t0 = time.perf_counter()
+    with Session(engine) as s:
+        for _ in range(THROUGHPUT_ROWS):
+            page = s.exec(
+                select(Voice.id, Voice.created_at)
+                .where(Voice.user_id == user_id, Voice.deleted_at.is_(None))
+                .order_by(Voice.created_at.desc(), Voice.id.desc())
+                .limit(20)
+            ).all()
+            assert len(page) == 20
+    report_throughput(backend, "keyset first-page reads", THROUGHPUT_ROWS / (time.perf_counter() - t0))
+
+    with Session(engine) as s:
+        assert s.exec(select(func.count()).select_from(Voice)).scalars().one() == THROUGHPUT_ROWS + 1
+
+
+def test_sqlite_uses_wal(tmp_path):
+    eng = make_engine(_url("sqlite", tmp_path), Settings())
+    with eng.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    eng.dispose()
@@ -0,0 +1,90 @@
+# tests/test_gpu_memory.py
+"""OOM split / retry in GpuMemoryManager, against a stub model that runs out of memory above a size."""
+from __future__ import annotations
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from app.core.config import Settings  # noqa: E402
+from app.services.gpu_memory import GpuMemoryManager, is_oom  # noqa: E402
+
+SR = 24000
+
+
+class StubModel:
+    """generate(indices) that raises a CUDA OOM when the batch totals more than max_chars."""
+
+    def __init__(self, sizes: list[int], max_chars: int) -> None:
+        self.sizes = sizes
+        self.max_chars = max_chars
+        self.calls: list[list[int]] = []
+
+    def __call__(self, idx: list[int]) -> tuple[list, int]:
+        self.calls.append(list(idx))
+        if sum(self.sizes[i] for i in idx) > self.max_chars:
+            raise torch.cuda.OutOfMemoryError("CUDA out of memory. Tried to allocate 2.00 GiB")
+        return [f"wav{i}" for i in idx], SR
+
+
+def _settings() -> Settings:
+    return Settings(gpu_max_batch_chars=0, gpu_cache_trim_fraction=0)
+
+
+def test_oom_splits_batch_and_keeps_order():
+    sizes = [100, 80, 120, 60, 90, 110, 70, 50]
+    model = StubModel(sizes, max_chars=250)
+    mgr = GpuMemoryManager()
+
+    wavs, sr, stats = mgr.run(_settings(), sizes, model)
+
+    assert wavs == [f"wav{i}" for i in range(len(sizes))]
+    assert sr == SR
+    assert stats.ooms >= 1 and stats.splits == stats.ooms
+    # Every item was generated exactly once by a call that fit
+    ok_calls = [c for c in model.calls if sum(sizes[i] for i in c) <= 250]
+    assert sorted(i for c in ok_calls for i in c) == list(range(len(sizes)))
+
+
+def test_learned_cap_shrinks_and_presplits_next_batch():
+    sizes = [100] * 8
+    model = StubModel(sizes, max_chars=300)
+    mgr = GpuMemoryManager()
+
+    mgr.run(_settings(), sizes, model)
+    cap = mgr.max_batch_chars
+    assert cap is not None and cap < sum(sizes)
+    assert cap <= int(400 * 0.75)  # shrinks to at most 3/4 of the smallest batch that failed
+
+    # The next call is packed under the learned cap up front: no more OOMs
+    model.calls.clear()
+    wavs, _, stats = mgr.run(_settings(), sizes, model)
+    assert wavs == [f"wav{i}" for i in range(len(sizes))]
+    assert stats.ooms == 0
+    assert all(sum(sizes[i] for i in c) <= cap for c in model.calls)
+    assert mgr.max_batch_chars == cap
+
+
+def test_single_item_oom_is_retried_once_then_propagates():
+    sizes = [50, 500, 50]
+    model = StubModel(sizes, max_chars=400)
+    mgr = GpuMemoryManager()
+
+    with pytest.raises(torch.cuda.OutOfMemoryError) as exc:
+        mgr.run(_settings(), sizes, model)
+
+    assert is_oom(exc.value)
+    assert model.calls.count([1]) == 2
+
+
+def test_other_errors_are_not_retried():
+    def broken(idx: list[int]) -> tuple[list, int]:
+        broken.calls += 1
+        raise ValueError("bad input")
+
+    broken.calls = 0
+    mgr = GpuMemoryManager()
+    with pytest.raises(ValueError):
+        mgr.run(_settings(), [10, 20], broken)
+    assert broken.calls == 1
+    assert mgr.max_batch_chars is None
@@ -0,0 +1,66 @@
+# tests/test_output_paths.py
+from __future__ import annotations
+
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app.core.config import Settings
+from app.services.output_paths import allocate_output_path, atomic_output, write_output_bytes
+
+THREADS = 32
+WRITES_PER_THREAD = 200
+
+
+def _settings(tmp_path: Path) -> Settings:
+    return Settings(media_dir=tmp_path / "media")
+
+
+def test_allocate_output_path_is_sharded(tmp_path):
+    path = allocate_output_path(_settings(tmp_path), "gens", 7, "wav")
+    rel = path.relative_to(tmp_path / "media")
+    kind, user, a, b, name = rel.parts
+    assert (kind, user) == ("gens", "7")
+    assert name.endswith(".wav") and name.startswith(a + b)
+    assert path.parent.is_dir() and not path.exists()
+
+
+def test_atomic_output_leaves_nothing_on_failure(tmp_path):
+    path = allocate_output_path(_settings(tmp_path), "gens", 1, "wav")
+    try:
+        with atomic_output(path) as tmp:
+            Path(tmp).write_bytes(b"partial")
+            raise RuntimeError("encoder crashed")
+    except RuntimeError:
+        pass
+    assert os.listdir(path.parent) == []
+
+
+def test_concurrent_writes_never_collide(tmp_path):
+    """THREADS x WRITES_PER_THREAD writers for the same user/kind: every file distinct and complete."""
+    settings = _settings(tmp_path)
+
+    def payload(worker: int, i: int) -> bytes:
+        # Distinct content, large enough that an interleaved or truncated write would show
+        return f"{worker}:{i}:".encode() * 512
+
+    def writer(worker: int) -> list[tuple[str, str]]:
+        out = []
+        for i in range(WRITES_PER_THREAD):
+            data = payload(worker, i)
+            out.append((write_output_bytes(settings, "batches", 1, data, "wav"), hashlib.sha256(data).hexdigest()))
+        return out
+
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        results = [r for chunk in pool.map(writer, range(THREADS)) for r in chunk]
+
+    paths = [p for p, _ in results]
+    assert len(paths) == THREADS * WRITES_PER_THREAD
+    assert len(set(paths)) == len(paths)
+    for path, digest in results:
+        assert hashlib.sha256(Path(path).read_bytes()).hexdigest() == digest
+
+    # No temp files left behind
+    on_disk = [os.path.join(d, f) for d, _, files in os.walk(tmp_path / "media") for f in files]
+    assert sorted(on_disk) == sorted(paths)
@@ -0,0 +1,272 @@
+# tests/test_transport.py
+"""
+INFERENCE_MODE=remote plumbing without models: RemoteBackend talks to a
+worker loop (app.worker.handle_job) running a stub in a thread, over an
+in-process stand-in transport, the real mp queue server and Redis lists on a
+fake client.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+from collections import defaultdict
+from typing import Any, Callable, Optional
+
+import numpy as np
+import pytest
+
+from app.core.config import Settings
+from app.services.inference import NOT_READY, RemoteBackend
+from app.services.transport import (
+    MpTransport,
+    QueueManager,
+    RedisTransport,
+    Transport,
+    pack_inline,
+    unpack_inline,
+)
+from app.worker import handle_job
+
+SR = 24000
+INFO = {"ready": True, "voice_design": False, "base_revision": "test"}
+
+
+class LocalTransport(Transport):
+    """Stand-in for a real transport: in-process queues, audio inline."""
+
+    def __init__(self) -> None:
+        self.jobs: "queue.Queue[dict]" = queue.Queue()
+        self.replies: dict[str, "queue.Queue[dict]"] = defaultdict(queue.Queue)
+        self.closed: list[str] = []
+
+    def send(self, job: dict) -> None:
+        self.jobs.put(job)
+
+    def receive(self, client_id: str, timeout: float) -> Optional[dict]:
+        try:
+            return self.replies[client_id].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def unpack_audio(self, packed: Any) -> list:
+        return unpack_inline(packed)
+
+    def close(self, client_id: str) -> None:
+        self.closed.append(client_id)
+
+    def next_job(self, timeout: float) -> Optional[dict]:
+        try:
+            return self.jobs.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def reply(self, client_id: str, reply: dict) -> None:
+        self.replies[client_id].put(reply)
+
+    def pack_audio(self, wavs: list, client_id: str) -> Any:
+        return pack_inline(wavs)
+
+
+class FakeRedis:
+    """The four list/key commands RedisTransport uses."""
+
+    def __init__(self) -> None:
+        self._lists: dict[str, list] = defaultdict(list)
+        self._cond = threading.Condition()
+        self.expiring: dict[str, int] = {}
+
+    def lpush(self, key: str, value: bytes) -> None:
+        with self._cond:
+            self._lists[key].insert(0, value)
+            self._cond.notify_all()
+
+    def brpop(self, key: str, timeout: int):
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._lists[key], timeout=timeout):
+                return None
+            return key.encode(), self._lists[key].pop()
+
+    def expire(self, key: str, seconds: int) -> None:
+        self.expiring[key] = seconds
+
+    def delete(self, key: str) -> None:
+        with self._cond:
+            self._lists.pop(key, None)
+
+
+def stub_model(op: str, args: dict) -> Any:
+    if op == "info":
+        return INFO
+    if op == "synthesize":
+        if "boom" in args["texts"]:
+            raise RuntimeError("CUDA error: device-side assert triggered")
+        wavs = [np.full(len(t) * 10, i, dtype=np.float32) for i, t in enumerate(args["texts"])]
+        return {"wavs": wavs, "sr": SR, "stats": {"sub_batches": 1}}
+    raise ValueError(f"unknown op {op}")
+
+
+class Worker:
+    """One inference worker (the loop in app.worker.serve) in a thread."""
+
+    def __init__(self, transport: Transport, run: Callable[[str, dict], Any] = stub_model) -> None:
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, args=(transport, run), daemon=True)
+        self._thread.start()
+
+    def _loop(self, transport: Transport, run) -> None:
+        while not self._stop.is_set():
+            job = transport.next_job(timeout=0.1)
+            if job is not None:
+                handle_job(transport, job, run)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+
+def _synthesize(backend: RemoteBackend, texts: list[str]):
+    n = len(texts)
+    return backend.synthesize(Settings(), {1: b"prompt"}, [1] * n, texts, ["auto"] * n, 0.7)
+
+
+def _assert_audio(result, texts: list[str]) -> None:
+    assert result.sr == SR
+    assert result.stats.sub_batches == 1
+    assert [len(w) for w in result.wavs] == [len(t) * 10 for t in texts]
+    for i, w in enumerate(result.wavs):
+        assert w.dtype == np.float32 and np.all(w == i)
+
+
+@pytest.fixture
+def local():
+    transport = LocalTransport()
+    backend = RemoteBackend(Settings(inference_timeout_s=5), transport)
+    yield transport, backend
+    backend.close()
+
+
+def test_round_trip(local):
+    transport, backend = local
+    worker = Worker(transport)
+    try:
+        texts = ["hello", "a longer sentence"]
+        _assert_audio(_synthesize(backend, texts), texts)
+        assert backend.info() == INFO
+    finally:
+        worker.stop()
+
+
+def test_worker_error_reaches_the_caller(local):
+    transport, backend = local
+    worker = Worker(transport)
+    try:
+        with pytest.raises(RuntimeError, match="device-side assert"):
+            _synthesize(backend, ["fine", "boom"])
+        # The worker keeps serving after a failed job
+        _assert_audio(_synthesize(backend, ["again"]), ["again"])
+    finally:
+        worker.stop()
+
+
+def test_no_worker_times_out_and_reports_not_ready(local):
+    transport, backend = local
+    with pytest.raises(TimeoutError):
+        backend._call("synthesize", timeout=0.3, texts=["x"])
+    assert backend.info() == NOT_READY
+
+
+def test_worker_crash_mid_job_times_out(local):
+    transport, backend = local
+    taken = threading.Event()
+
+    def crash(op: str, args: dict) -> Any:
+        taken.set()
+        raise SystemExit  # the process dies: no reply is ever sent
+
+    def crashing_worker() -> None:
+        job = transport.next_job(timeout=5)
+        try:
+            handle_job(transport, job, crash)
+        except SystemExit:
+            pass
+
+    t = threading.Thread(target=crashing_worker, daemon=True)
+    t.start()
+    with pytest.raises(TimeoutError):
+        backend._call("synthesize", timeout=0.5, texts=["x"])
+    assert taken.is_set()
+    t.join(timeout=5)
+
+    # A replacement worker picks up the next call
+    worker = Worker(transport)
+    try:
+        _assert_audio(_synthesize(backend, ["back"]), ["back"])
+    finally:
+        worker.stop()
+
+
+def test_close_releases_reply_channel():
+    transport = LocalTransport()
+    backend = RemoteBackend(Settings(), transport)
+    backend.close()
+    assert transport.closed == [backend._client_id]
+
+
+@pytest.fixture
+def queue_server():
+    server = QueueManager(address=("127.0.0.1", 0), authkey=b"test-key")
+    server.start()
+    host, port = server.address
+    yield f"{host}:{port}"
+    server.shutdown()
+
+
+class RecordingMpTransport(MpTransport):
+    def __init__(self, settings: Settings) -> None:
+        super().__init__(settings)
+        self.packed: list[dict] = []
+
+    def pack_audio(self, wavs: list, client_id: str) -> dict:
+        packed = super().pack_audio(wavs, client_id)
+        self.packed.append(packed)
+        return packed
+
+
+@pytest.mark.parametrize("shared_shm", [True, False], ids=["shared-shm", "other-host"])
+def test_mp_transport_round_trip(queue_server, tmp_path, shared_shm):
+    api_shm, worker_shm = tmp_path / "api", tmp_path / ("api" if shared_shm else "worker")
+    api_shm.mkdir(exist_ok=True)
+    worker_shm.mkdir(exist_ok=True)
+    common = dict(inference_address=queue_server, inference_authkey="test-key", inference_timeout_s=10)
+    api_settings = Settings(inference_shm_dir=api_shm, **common)
+    worker_transport = RecordingMpTransport(Settings(inference_shm_dir=worker_shm, **common))
+
+    backend = RemoteBackend(api_settings, MpTransport(api_settings))
+    worker = Worker(worker_transport)
+    try:
+        texts = ["hi", "there"]
+        _assert_audio(_synthesize(backend, texts), texts)
+    finally:
+        worker.stop()
+        backend.close()
+
+    # Same shm dir: handed over through a file there. Worker on another host: inline
+    assert [next(iter(p)) for p in worker_transport.packed] == ["shm" if shared_shm else "f32"]
+    # The receiver removed the audio file and close() the marker
+    assert list(api_shm.iterdir()) == [] and list(worker_shm.iterdir()) == []
+
+
+def test_redis_transport_round_trip_inline():
+    fake = FakeRedis()
+    settings = Settings(inference_queue_prefix="t", inference_timeout_s=10)
+    backend = RemoteBackend(settings, RedisTransport(settings, client=fake))
+    worker = Worker(RedisTransport(settings, client=fake))
+    try:
+        texts = ["over", "redis"]
+        _assert_audio(_synthesize(backend, texts), texts)
+    finally:
+        worker.stop()
+        backend.close()
+    reply_key = f"t:replies:{backend._client_id}"
+    assert fake.expiring[reply_key] == RedisTransport.REPLY_TTL_S
+    assert reply_key not in fake._lists